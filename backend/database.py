@@ -1,37 +1,140 @@
+import math
 import os
-from sqlalchemy import create_engine
+import random
+import time
+from contextvars import ContextVar
+from fastapi import Request
+from sqlalchemy import Delete, Insert, Update, create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from starlette.datastructures import MutableHeaders
+from typing import Generator, List, Optional
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Comma-separated URLs of read replicas of DATABASE_URL; empty for none
+DATABASE_REPLICA_URLS = os.getenv("DATABASE_REPLICA_URLS", "")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True) if DATABASE_URL else None
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# How long a client reads from the primary after its own write; must
+# exceed the replicas' lag
+DEFAULT_READ_PRIMARY_SECONDS = 5
+READ_PRIMARY_SECONDS = float(
+    os.getenv("READ_PRIMARY_SECONDS", DEFAULT_READ_PRIMARY_SECONDS)
+)
+READ_PRIMARY_COOKIE = "read_primary_until"
+READ_PRIMARY_HEADER = "X-Read-Primary-Until"
 
+READ_METHODS = {"GET", "HEAD"}
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
 
-def get_db() -> Generator[Session, None, None]:
-    """Database session dependency for FastAPI"""
-    db = SessionLocal()
+# Connections per engine and process: POOL_SIZE kept open, up to
+# MAX_OVERFLOW more under load (SQLAlchemy's defaults)
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", DEFAULT_POOL_SIZE))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW))
+POOL_CAPACITY = POOL_SIZE + MAX_OVERFLOW
+
+
+def build_engine(url: str) -> Engine:
+    return create_engine(
+        url, pool_pre_ping=True, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW
+    )
+
+
+engine = build_engine(DATABASE_URL) if DATABASE_URL else None
+replica_engines: List[Engine] = [
+    build_engine(url.strip()) for url in DATABASE_REPLICA_URLS.split(",") if url.strip()
+]
+
+
+class RoutingSession(Session):
+    """Session that reads from a replica when marked read_only.
+
+    Sessions are bound to the primary unless info["read_only"] is set,
+    as get_db does for GET requests; such a session then sticks to one
+    randomly chosen replica. Flushes and DML always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            not self.info.get("read_only")
+            or not replica_engines
+            or self._flushing
+            or isinstance(clause, (Insert, Update, Delete))
+        ):
+            return engine
+        if "replica" not in self.info:
+            self.info["replica"] = random.choice(replica_engines)
+        return self.info["replica"]
+
+
+SessionLocal = sessionmaker(
+    class_=RoutingSession, autocommit=False, autoflush=False, bind=engine
+)
+
+
+# Session shared by the operations of one POST /batch request; its owner
+# closes it, so get_db hands it out as is
+batch_session: ContextVar[Optional[Session]] = ContextVar(
+    "batch_session", default=None
+)
+
+
+def reads_primary(request: Request) -> bool:
+    """Whether the client wrote within READ_PRIMARY_SECONDS (read-your-writes)"""
+    token = request.headers.get(READ_PRIMARY_HEADER) or request.cookies.get(
+        READ_PRIMARY_COOKIE
+    )
     try:
-        yield db
-    finally:
-        db.close()
+        return float(token) > time.time()
+    except (TypeError, ValueError):
+        return False
 
 
-def init_db():
-    """Initialize database tables"""
-    from models import Base, User
+def get_db(request: Request) -> Generator[Session, None, None]:
+    """Database session dependency for FastAPI.
 
-    Base.metadata.create_all(bind=engine)
+    GET requests read from a replica, unless the client wrote recently.
+    """
+    shared = batch_session.get()
+    if shared is not None:
+        yield shared
+        return
 
-    # Create default user for MVP
     db = SessionLocal()
+    if request.method in READ_METHODS and not reads_primary(request):
+        db.info["read_only"] = True
     try:
-        existing_user = db.query(User).first()
-        if not existing_user:
-            default_user = User(name="Default User")
-            db.add(default_user)
-            db.commit()
-            print("Default user created")
+        yield db
     finally:
         db.close()
+
+
+class ReadYourWritesMiddleware:
+    """After a successful write, point the client's reads at the primary.
+
+    The deadline goes out as a cookie for same-site browsers and as a
+    header that other clients send back as is.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_deadline(message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = f"{time.time() + READ_PRIMARY_SECONDS:.3f}"
+                headers = MutableHeaders(scope=message)
+                headers.append(READ_PRIMARY_HEADER, until)
+                headers.append(
+                    "set-cookie",
+                    f"{READ_PRIMARY_COOKIE}={until}; Path=/; HttpOnly; "
+                    f"SameSite=lax; Max-Age={math.ceil(READ_PRIMARY_SECONDS)}",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_deadline)
@@ -1,7 +0,0 @@
-"""Database initialization script"""
-from database import init_db
-
-if __name__ == "__main__":
-    print("Initializing database...")
-    init_db()
-    print("Database initialized successfully!")
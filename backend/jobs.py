@@ -0,0 +1,270 @@
+"""Maintenance jobs
+
+Usage:
+    python jobs.py archive [--days N] [--batch-size N]
+    python jobs.py partition-tables [--years-ahead N]
+    python jobs.py add-partitions [--years-ahead N]
+    python jobs.py archive-partitions [--keep-years N]
+    python jobs.py dedupe-records
+    python jobs.py extend-doses
+    python jobs.py rebuild-costs
+    python jobs.py recompute-trends
+    python jobs.py purge-uploads [--hours N]
+    python jobs.py purge-reports [--days N]
+    python jobs.py create-user --name NAME
+    python jobs.py issue-token --user-id N
+"""
+import argparse
+import os
+
+from database import SessionLocal
+from services.archive import (
+    archive_deleted_rows,
+    archive_partitions,
+    DEFAULT_RETENTION_DAYS,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_KEEP_YEARS,
+)
+from services.partitions import add_partitions, partition_tables, DEFAULT_YEARS_AHEAD
+from services.records import merge_duplicate_records
+from services.dose_calendar import extend_dose_horizon, DOSE_HORIZON_DAYS
+from services.vet_costs import rebuild_cost_rollups
+from services.weight_trends import recompute_all
+from services.attachments import purge_expired_uploads, UPLOAD_EXPIRY_HOURS
+from services.reports import purge_reports, REPORT_RETENTION_DAYS
+from services.auth import TokenAuthenticator
+from models import User
+
+
+def run_archive(args: argparse.Namespace) -> None:
+    """Move rows deleted more than --days ago into the archive tables"""
+    db = SessionLocal()
+    try:
+        counts = archive_deleted_rows(db, args.days, args.batch_size)
+    finally:
+        db.close()
+
+    for table, count in counts.items():
+        print(f"{table}: {count} rows archived")
+
+
+def run_partition_tables(args: argparse.Namespace) -> None:
+    """Partition records and their child tables by year (MySQL)"""
+    db = SessionLocal()
+    try:
+        counts = partition_tables(db, args.years_ahead)
+    finally:
+        db.close()
+
+    for table, count in counts.items():
+        print(f"{table}: partitioned into {count} years")
+
+
+def run_add_partitions(args: argparse.Namespace) -> None:
+    """Add the year partitions up to --years-ahead (MySQL)"""
+    db = SessionLocal()
+    try:
+        counts = add_partitions(db, args.years_ahead)
+    finally:
+        db.close()
+
+    for table, count in counts.items():
+        print(f"{table}: {count} partitions added")
+
+
+def run_archive_partitions(args: argparse.Namespace) -> None:
+    """Move the years before the last --keep-years into archive tables"""
+    db = SessionLocal()
+    try:
+        archived = archive_partitions(db, args.keep_years)
+    finally:
+        db.close()
+
+    for table, targets in archived.items():
+        print(f"{table}: {len(targets)} years archived")
+        for target in targets:
+            print(f"  -> {target}")
+
+
+def run_dedupe_records(args: argparse.Namespace) -> None:
+    """Merge duplicate live records of the same pet and day"""
+    db = SessionLocal()
+    try:
+        retired = merge_duplicate_records(db)
+    finally:
+        db.close()
+
+    print(f"records: {retired} duplicates merged")
+
+
+def run_extend_doses(args: argparse.Namespace) -> None:
+    """Roll the dose calendar forward to the current horizon"""
+    db = SessionLocal()
+    try:
+        inserted = extend_dose_horizon(db)
+    finally:
+        db.close()
+
+    print(f"medication_doses: {inserted} days added")
+
+
+def run_rebuild_costs(args: argparse.Namespace) -> None:
+    """Recompute the vet cost rollups from the visits"""
+    db = SessionLocal()
+    try:
+        buckets = rebuild_cost_rollups(db)
+    finally:
+        db.close()
+
+    print(f"vet_cost_rollups: {buckets} buckets rebuilt")
+
+
+def run_recompute_trends(args: argparse.Namespace) -> None:
+    """Rebuild every pet's weight trend from its weights"""
+    db = SessionLocal()
+    try:
+        pets = recompute_all(db)
+    finally:
+        db.close()
+
+    print(f"pet_weight_trends: {pets} pets recomputed")
+
+
+def run_purge_uploads(args: argparse.Namespace) -> None:
+    """Drop attachment uploads left unfinished for more than --hours"""
+    db = SessionLocal()
+    try:
+        purged = purge_expired_uploads(db, args.hours)
+    finally:
+        db.close()
+
+    print(f"attachment_uploads: {purged} expired uploads purged")
+
+
+def run_purge_reports(args: argparse.Namespace) -> None:
+    """Drop generated reports finished more than --days ago"""
+    db = SessionLocal()
+    try:
+        purged = purge_reports(db, args.days)
+    finally:
+        db.close()
+
+    print(f"report_jobs: {purged} old reports purged")
+
+
+def token_authenticator() -> TokenAuthenticator:
+    return TokenAuthenticator(os.getenv("AUTH_SECRET", ""))
+
+
+def run_create_user(args: argparse.Namespace) -> None:
+    """Add a user and print its API token"""
+    authenticator = token_authenticator()
+    db = SessionLocal()
+    try:
+        user = User(name=args.name)
+        db.add(user)
+        db.commit()
+        user_id = user.id
+    finally:
+        db.close()
+
+    print(f"users: created {user_id}")
+    print(authenticator.issue(user_id))
+
+
+def run_issue_token(args: argparse.Namespace) -> None:
+    """Print the API token of an existing user"""
+    authenticator = token_authenticator()
+    db = SessionLocal()
+    try:
+        user = db.get(User, args.user_id)
+    finally:
+        db.close()
+
+    if user is None:
+        raise SystemExit(f"users: {args.user_id} not found")
+    print(authenticator.issue(args.user_id))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintenance jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive = commands.add_parser(
+        "archive", help="Move long-deleted rows into archive tables"
+    )
+    archive.add_argument("--days", type=int, default=DEFAULT_RETENTION_DAYS)
+    archive.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    archive.set_defaults(func=run_archive)
+
+    partition = commands.add_parser(
+        "partition-tables",
+        help="Partition records and child tables by year (MySQL, maintenance window)",
+    )
+    partition.add_argument("--years-ahead", type=int, default=DEFAULT_YEARS_AHEAD)
+    partition.set_defaults(func=run_partition_tables)
+
+    add = commands.add_parser(
+        "add-partitions", help="Add upcoming year partitions (run monthly)"
+    )
+    add.add_argument("--years-ahead", type=int, default=DEFAULT_YEARS_AHEAD)
+    add.set_defaults(func=run_add_partitions)
+
+    archive_years = commands.add_parser(
+        "archive-partitions", help="Swap out old year partitions into archive tables"
+    )
+    archive_years.add_argument("--keep-years", type=int, default=DEFAULT_KEEP_YEARS)
+    archive_years.set_defaults(func=run_archive_partitions)
+
+    dedupe = commands.add_parser(
+        "dedupe-records",
+        help="Merge duplicate daily records before adding uq_records_pet_date_live",
+    )
+    dedupe.set_defaults(func=run_dedupe_records)
+
+    extend = commands.add_parser(
+        "extend-doses",
+        help=f"Expand medication schedules {DOSE_HORIZON_DAYS} days ahead (run daily)",
+    )
+    extend.set_defaults(func=run_extend_doses)
+
+    rebuild = commands.add_parser(
+        "rebuild-costs", help="Recompute vet_cost_rollups from the vet visits"
+    )
+    rebuild.set_defaults(func=run_rebuild_costs)
+
+    trends = commands.add_parser(
+        "recompute-trends", help="Rebuild the weight trends of every pet"
+    )
+    trends.set_defaults(func=run_recompute_trends)
+
+    purge = commands.add_parser(
+        "purge-uploads", help="Drop unfinished attachment uploads (run daily)"
+    )
+    purge.add_argument("--hours", type=int, default=UPLOAD_EXPIRY_HOURS)
+    purge.set_defaults(func=run_purge_uploads)
+
+    reports = commands.add_parser(
+        "purge-reports", help="Drop old generated reports (run daily)"
+    )
+    reports.add_argument("--days", type=int, default=REPORT_RETENTION_DAYS)
+    reports.set_defaults(func=run_purge_reports)
+
+    create_user = commands.add_parser(
+        "create-user", help="Add a user and print its token (AUTH_BACKEND=token)"
+    )
+    create_user.add_argument("--name", required=True)
+    create_user.set_defaults(func=run_create_user)
+
+    issue = commands.add_parser(
+        "issue-token", help="Print a user's token signed with AUTH_SECRET"
+    )
+    issue.add_argument("--user-id", type=int, required=True)
+    issue.set_defaults(func=run_issue_token)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
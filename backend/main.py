@@ -1,21 +1,69 @@
+import math
 import os
-from fastapi import FastAPI
+from dataclasses import asdict
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import text
 from contextlib import asynccontextmanager
 
-from database import engine, init_db
-from routes import pets, records, vet_visits, weights, medications
+from database import (
+    POOL_CAPACITY,
+    READ_PRIMARY_HEADER,
+    ReadYourWritesMiddleware,
+    SessionLocal,
+    engine,
+)
+from routes import (
+    pets,
+    records,
+    vet_visits,
+    weights,
+    medications,
+    active_medications,
+    changes,
+    sync,
+    costs,
+    batch,
+    events,
+    timeline,
+    photos,
+    attachments,
+    reports,
+)
+from services.reminders import ReminderScheduler
+from services.health import health_probe
+from services.events import attach_session_events, build_broker
+from services.photos import shutdown_thumbnail_pool
+from services.reports import report_worker
+from services.schema import check_schema_version
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database on startup"""
-    print("Initializing database...")
-    init_db()
-    print("Database initialized")
+    """Check the schema version and run background services"""
+    check_schema_version(engine)
+    health_probe.start(engine, POOL_CAPACITY)
+
+    broker = build_broker(SessionLocal)
+    attach_session_events(SessionLocal)
+    await broker.start()
+    report_worker.start(SessionLocal)
+
+    scheduler = None
+    if os.getenv("REMINDERS_ENABLED") == "1":
+        scheduler = ReminderScheduler(SessionLocal)
+        scheduler.start()
+        print("Reminder scheduler started")
+
     yield
 
+    # Fail readiness first, so the balancer stops sending requests
+    await health_probe.stop()
+    if scheduler:
+        await scheduler.stop()
+    await report_worker.stop()
+    await broker.stop()
+    shutdown_thumbnail_pool()
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -26,7 +74,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[READ_PRIMARY_HEADER],
 )
+app.add_middleware(ReadYourWritesMiddleware)
 
 # Include routers
 app.include_router(pets.router, prefix="/api")
@@ -34,20 +84,51 @@ app.include_router(records.router, prefix="/api")
 app.include_router(vet_visits.router, prefix="/api")
 app.include_router(weights.router, prefix="/api")
 app.include_router(medications.router, prefix="/api")
+app.include_router(active_medications.router, prefix="/api")
+app.include_router(changes.router, prefix="/api")
+app.include_router(sync.router, prefix="/api")
+app.include_router(costs.router, prefix="/api")
+app.include_router(batch.router, prefix="/api")
+app.include_router(events.router, prefix="/api")
+app.include_router(timeline.router, prefix="/api")
+app.include_router(photos.router, prefix="/api")
+app.include_router(attachments.router, prefix="/api")
+app.include_router(reports.router, prefix="/api")
+
+
+# Health endpoints are async so they run on the event loop: answers do
+# not wait behind database-bound requests in the threadpool
+
+
+@app.get("/livez")
+async def liveness() -> dict:
+    """The process is up; no dependency is checked"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readiness(response: Response) -> dict:
+    """Whether to send this process traffic, per the background probe (503 if not)"""
+    state = health_probe.readiness()
+    if not state.ready:
+        response.status_code = 503
+        response.headers["Retry-After"] = str(math.ceil(health_probe.interval))
+    return {"status": "ok" if state.ready else "unavailable", **asdict(state)}
 
 
 @app.get("/api/health")
-def health_check() -> dict:
+async def health_check() -> dict:
     return {"status": "ok"}
 
 
 @app.get("/api/db/health")
-def db_health_check() -> dict:
+async def db_health_check() -> dict:
+    """Database reachability as of the last background probe (503 if down)"""
     if engine is None:
-        return {"status": "error", "detail": "DATABASE_URL is not set"}
-    try:
-        with engine.connect() as connection:
-            connection.execute(text("SELECT 1"))
-        return {"status": "ok", "db": "connected"}
-    except Exception as exc:
-        return {"detail": "Database connection failed"}
+        raise HTTPException(status_code=503, detail="DATABASE_URL is not set")
+    state = health_probe.readiness()
+    if state.db_error:
+        raise HTTPException(
+            status_code=503, detail=f"Database connection failed: {state.db_error}"
+        )
+    return {"status": "ok", "db": "connected", "latency_ms": state.db_latency_ms}
@@ -0,0 +1,70 @@
+"""Alembic environment: migrates DATABASE_URL against the models' metadata"""
+import os
+import re
+from typing import Set
+from alembic import context
+from sqlalchemy import create_engine, pool
+from sqlalchemy.orm import Session
+
+from models import Base
+from services.partitions import partitioned_tables
+
+# Tables written by jobs.py archive-partitions, not by the models
+YEAR_ARCHIVE_TABLE = re.compile(r"^\w+_archive_\d{4}$")
+
+
+def database_url() -> str:
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_URL is required to run migrations")
+    return url
+
+
+def object_filter(partitioned: Set[str]):
+    """Keep autogenerate from undoing what the maintenance jobs changed"""
+
+    def include_object(obj, name, type_, reflected, compare_to) -> bool:
+        if type_ == "table" and reflected and YEAR_ARCHIVE_TABLE.match(name):
+            return False
+        # Partitioned tables cannot have foreign keys
+        if type_ == "foreign_key_constraint":
+            tables = {obj.table.name, obj.referred_table.name}
+            return not tables & partitioned
+        return True
+
+    return include_object
+
+
+def run_migrations_offline() -> None:
+    """Print the SQL instead of running it (alembic upgrade head --sql)"""
+    context.configure(
+        url=database_url(),
+        target_metadata=Base.metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connectable = create_engine(database_url(), poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        partitioned = partitioned_tables(Session(bind=connection))
+        connection.commit()
+        context.configure(
+            connection=connection,
+            target_metadata=Base.metadata,
+            include_object=object_filter(partitioned),
+            compare_type=True,
+            # SQLite cannot ALTER most things; batch mode copies the table
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
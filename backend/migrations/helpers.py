@@ -0,0 +1,96 @@
+"""Building blocks for migrations that must not lock large tables.
+
+Schema changes go in one revision and data changes in batches:
+- add_column_online / create_index_online ask MySQL for an INSTANT or
+  INPLACE, LOCK=NONE change and fail instead of silently copying the
+  table under a lock when it cannot do that,
+- backfill updates a table in primary-key ranges of batch_size rows,
+  committing each range, so no transaction holds millions of row locks
+  and the replicas apply it in small steps.
+
+Usage in a revision:
+
+    from migrations.helpers import add_column_online, backfill
+
+    def upgrade() -> None:
+        add_column_online("pets", sa.Column("color", sa.String(30)))
+        backfill("pets", {"color": sa.text("'unknown'")}, "color IS NULL")
+"""
+import time
+from typing import Dict, List, Optional
+from alembic import op
+import sqlalchemy as sa
+
+DEFAULT_BATCH_SIZE = 1000
+# Pause between batches so replicas keep up
+DEFAULT_PAUSE_SECONDS = 0.05
+
+
+def is_mysql() -> bool:
+    return op.get_bind().dialect.name == "mysql"
+
+
+def add_column_online(table: str, column: sa.Column) -> None:
+    """Add a column without rebuilding the table (MySQL INSTANT)"""
+    if not is_mysql():
+        op.add_column(table, column)
+        return
+    ddl = sa.schema.CreateColumn(column).compile(dialect=op.get_bind().dialect)
+    op.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}, ALGORITHM=INSTANT")
+
+
+def create_index_online(name: str, table: str, columns: List[str]) -> None:
+    """Build an index while the table stays writable (MySQL INPLACE)"""
+    if not is_mysql():
+        op.create_index(name, table, columns)
+        return
+    op.execute(
+        f"ALTER TABLE {table} ADD INDEX {name} ({', '.join(columns)}),"
+        " ALGORITHM=INPLACE, LOCK=NONE"
+    )
+
+
+def id_ranges(table: str, batch_size: int):
+    """Consecutive (after_id, last_id] ranges of batch_size rows each"""
+    bind = op.get_bind()
+    after_id = 0
+    while True:
+        last_id = bind.execute(
+            sa.text(
+                f"SELECT id FROM {table} WHERE id > :after_id"
+                " ORDER BY id LIMIT 1 OFFSET :skip"
+            ),
+            {"after_id": after_id, "skip": batch_size - 1},
+        ).scalar()
+        if last_id is None:
+            yield after_id, None
+            return
+        yield after_id, last_id
+        after_id = last_id
+
+
+def backfill(
+    table: str,
+    values: Dict[str, sa.ColumnElement],
+    where: Optional[str] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    pause_seconds: float = DEFAULT_PAUSE_SECONDS,
+) -> int:
+    """UPDATE table SET values [WHERE where], one id range at a time.
+
+    Each range commits on its own, so a failed backfill resumes where
+    it stopped when the where clause excludes rows already done.
+    Returns the number of rows updated.
+    """
+    target = sa.table(table, sa.column("id"), *(sa.column(name) for name in values))
+    updated = 0
+    with op.get_context().autocommit_block():
+        for after_id, last_id in id_ranges(table, batch_size):
+            statement = sa.update(target).where(target.c.id > after_id)
+            if last_id is not None:
+                statement = statement.where(target.c.id <= last_id)
+            if where:
+                statement = statement.where(sa.text(where))
+            updated += op.get_bind().execute(statement.values(values)).rowcount
+            time.sleep(pause_seconds)
+    return updated
@@ -0,0 +1,159 @@
+"""Baseline: the schema as create_all built it before migrations.
+
+Databases created by the old init_db / migrate_db have exactly this
+schema: mark them with `alembic stamp 0001`, then `alembic upgrade head`
+adds everything since (0002 onwards).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 13:07:47.250330
+"""
+
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# The single-user frontend (AUTH_BACKEND=dev) acts as this user
+DEFAULT_USER_ID = 1
+DEFAULT_USER_NAME = "Default User"
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("name", sa.String(length=100), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "pets",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("name", sa.String(length=100), nullable=False),
+        sa.Column("species", sa.String(length=50), nullable=True),
+        sa.Column("sex", sa.String(length=20), nullable=True),
+        sa.Column("birth_date", sa.Date(), nullable=True),
+        sa.Column("photo_url", sa.String(length=500), nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "records",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("recorded_on", sa.Date(), nullable=False),
+        sa.Column("condition", sa.String(length=20), nullable=True),
+        sa.Column("note", sa.Text(), nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["pet_id"],
+            ["pets.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "record_medications",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("record_id", sa.BigInteger(), nullable=False),
+        sa.Column("name", sa.String(length=200), nullable=False),
+        sa.Column("dosage", sa.String(length=200), nullable=True),
+        sa.Column("frequency", sa.String(length=200), nullable=True),
+        sa.Column("start_on", sa.Date(), nullable=False),
+        sa.Column("end_on", sa.Date(), nullable=True),
+        sa.Column("note", sa.Text(), nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["record_id"],
+            ["records.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "record_vet_visits",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("record_id", sa.BigInteger(), nullable=False),
+        sa.Column("visited_on", sa.Date(), nullable=False),
+        sa.Column("hospital_name", sa.String(length=200), nullable=True),
+        sa.Column("doctor_name", sa.String(length=200), nullable=True),
+        sa.Column("chief_complaint", sa.String(length=500), nullable=True),
+        sa.Column("diagnosis", sa.String(length=500), nullable=True),
+        sa.Column("cost_yen", sa.Integer(), nullable=True),
+        sa.Column("note", sa.Text(), nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["record_id"],
+            ["records.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "record_weights",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("record_id", sa.BigInteger(), nullable=False),
+        sa.Column("measured_on", sa.Date(), nullable=False),
+        sa.Column("weight_kg", sa.DECIMAL(precision=5, scale=2), nullable=False),
+        sa.Column("note", sa.String(length=500), nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["record_id"],
+            ["records.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    now = datetime.utcnow()
+    op.bulk_insert(
+        sa.table(
+            "users",
+            sa.column("id", sa.BigInteger),
+            sa.column("name", sa.String),
+            sa.column("created_at", sa.DateTime),
+            sa.column("updated_at", sa.DateTime),
+        ),
+        [
+            {
+                "id": DEFAULT_USER_ID,
+                "name": DEFAULT_USER_NAME,
+                "created_at": now,
+                "updated_at": now,
+            }
+        ],
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("record_weights")
+    op.drop_table("record_vet_visits")
+    op.drop_table("record_medications")
+    op.drop_table("records")
+    op.drop_table("pets")
+    op.drop_table("users")
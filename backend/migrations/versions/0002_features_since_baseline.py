@@ -0,0 +1,616 @@
+"""Schema of the features added since the baseline.
+
+Brings a database at 0001, such as one built by the old init_db and
+stamped, up to the models:
+- new tables: change feed, archives, weight trends, vet cost rollups,
+  dose calendar, attachments and report jobs,
+- row versions, medication schedules and follow-up visit dates,
+- pet_id on the child tables, backfilled from their records in id
+  ranges before it becomes NOT NULL,
+- duplicate live records of a day merged into the oldest, the same
+  rule as jobs.py dedupe-records, so uq_records_pet_date_live fits,
+- the indexes and the generated is_live / end_on_effective columns.
+
+The derived tables start empty: run `jobs.py rebuild-costs` and
+`jobs.py recompute-trends` once afterwards.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 15:02:11.418207
+"""
+
+from datetime import datetime
+from typing import List, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import add_column_online, backfill, create_index_online
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CHILD_TABLES = ("record_weights", "record_medications", "record_vet_visits")
+VERSIONED_TABLES = ("pets", "records", *CHILD_TABLES)
+CHILD_PET_FOREIGN_KEYS = {
+    "record_weights": "fk_weights_pet",
+    "record_medications": "fk_medications_pet",
+    "record_vet_visits": "fk_vet_visits_pet",
+}
+INITIAL_VERSION = "1"
+# models.OPEN_END_DATE, as of this revision
+OPEN_END_DATE = "9999-12-31"
+PET_OF_RECORD = (
+    "(SELECT records.pet_id FROM records WHERE records.id = {table}.record_id)"
+)
+
+INDEXES = [
+    ("idx_pets_deleted_at", "pets", ["deleted_at"]),
+    ("idx_pets_user", "pets", ["user_id", "is_deleted", "id"]),
+    ("idx_pets_user_birth", "pets", ["user_id", "is_deleted", "birth_date"]),
+    ("idx_pets_user_name", "pets", ["user_id", "is_deleted", "name"]),
+    ("idx_records_deleted_at", "records", ["deleted_at"]),
+    ("idx_records_pet_updated", "records", ["pet_id", "updated_at"]),
+    ("idx_medications_deleted_at", "record_medications", ["deleted_at"]),
+    ("idx_medications_pet_start", "record_medications", ["pet_id", "start_on"]),
+    ("idx_medications_pet_updated", "record_medications", ["pet_id", "updated_at"]),
+    ("idx_vet_visits_deleted_at", "record_vet_visits", ["deleted_at"]),
+    ("idx_vet_visits_next_visit", "record_vet_visits", ["next_visit_on"]),
+    ("idx_vet_visits_pet_updated", "record_vet_visits", ["pet_id", "updated_at"]),
+    ("idx_vet_visits_pet_visited", "record_vet_visits", ["pet_id", "visited_on"]),
+    ("idx_weights_deleted_at", "record_weights", ["deleted_at"]),
+    ("idx_weights_pet_measured", "record_weights", ["pet_id", "measured_on"]),
+    ("idx_weights_pet_updated", "record_weights", ["pet_id", "updated_at"]),
+]
+GENERATED_COLUMN_INDEXES = [
+    (
+        "idx_medications_period",
+        "record_medications",
+        ["is_deleted", "end_on_effective", "start_on"],
+    ),
+    (
+        "idx_medications_pet_period",
+        "record_medications",
+        ["pet_id", "is_deleted", "end_on_effective", "start_on"],
+    ),
+]
+
+
+def upgrade() -> None:
+    create_feed_and_job_tables()
+    create_archive_tables()
+    create_derived_tables()
+    create_attachment_tables()
+    add_columns()
+    for table in CHILD_TABLES:
+        backfill(
+            table,
+            {"pet_id": sa.text(PET_OF_RECORD.format(table=table))},
+            "pet_id IS NULL",
+        )
+    merge_duplicate_days()
+    # Before the foreign keys, which MySQL would otherwise index itself
+    for name, table, columns in INDEXES:
+        create_index_online(name, table, columns)
+    add_pet_foreign_keys()
+    # Last: SQLite rebuilds tables in batch mode and cannot copy a
+    # generated column into the rebuilt table
+    add_generated_columns()
+    for name, table, columns in GENERATED_COLUMN_INDEXES:
+        create_index_online(name, table, columns)
+
+
+def create_feed_and_job_tables() -> None:
+    op.create_table(
+        "change_events",
+        sa.Column("seq", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("entity", sa.String(length=20), nullable=False),
+        sa.Column("entity_id", sa.BigInteger(), nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("op", sa.String(length=10), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("seq"),
+    )
+    op.create_index(
+        "idx_change_events_pet_seq", "change_events", ["pet_id", "seq"], unique=False
+    )
+    op.create_table(
+        "report_jobs",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("status", sa.String(length=10), nullable=False),
+        sa.Column("from_date", sa.Date(), nullable=True),
+        sa.Column("to_date", sa.Date(), nullable=True),
+        sa.Column("cache_key", sa.String(length=64), nullable=False),
+        sa.Column("result_key", sa.String(length=200), nullable=True),
+        sa.Column("size_bytes", sa.BigInteger(), nullable=True),
+        sa.Column("error", sa.String(length=500), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["pet_id"],
+            ["pets.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "idx_report_jobs_finished", "report_jobs", ["finished_at"], unique=False
+    )
+    op.create_index(
+        "idx_report_jobs_pet_cache",
+        "report_jobs",
+        ["pet_id", "cache_key"],
+        unique=False,
+    )
+    op.create_index(
+        "idx_report_jobs_status", "report_jobs", ["status", "id"], unique=False
+    )
+
+
+def create_archive_tables() -> None:
+    op.create_table(
+        "pets_archive",
+        sa.Column("id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("user_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("name", sa.String(length=100), autoincrement=False, nullable=False),
+        sa.Column("species", sa.String(length=50), autoincrement=False, nullable=True),
+        sa.Column("sex", sa.String(length=20), autoincrement=False, nullable=True),
+        sa.Column("birth_date", sa.Date(), autoincrement=False, nullable=True),
+        sa.Column(
+            "photo_url", sa.String(length=500), autoincrement=False, nullable=True
+        ),
+        sa.Column("is_deleted", sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), autoincrement=False, nullable=True),
+        sa.Column("version", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("created_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("updated_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "record_medications_archive",
+        sa.Column("id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("record_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("name", sa.String(length=200), autoincrement=False, nullable=False),
+        sa.Column("dosage", sa.String(length=200), autoincrement=False, nullable=True),
+        sa.Column(
+            "frequency", sa.String(length=200), autoincrement=False, nullable=True
+        ),
+        sa.Column("interval_days", sa.Integer(), autoincrement=False, nullable=True),
+        sa.Column("times_per_day", sa.Integer(), autoincrement=False, nullable=True),
+        sa.Column(
+            "days_of_week", sa.SmallInteger(), autoincrement=False, nullable=True
+        ),
+        sa.Column("start_on", sa.Date(), autoincrement=False, nullable=False),
+        sa.Column("end_on", sa.Date(), autoincrement=False, nullable=True),
+        sa.Column("end_on_effective", sa.Date(), autoincrement=False, nullable=True),
+        sa.Column("note", sa.Text(), autoincrement=False, nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), autoincrement=False, nullable=True),
+        sa.Column("version", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("created_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("updated_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "record_vet_visits_archive",
+        sa.Column("id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("record_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("visited_on", sa.Date(), autoincrement=False, nullable=False),
+        sa.Column(
+            "hospital_name", sa.String(length=200), autoincrement=False, nullable=True
+        ),
+        sa.Column(
+            "doctor_name", sa.String(length=200), autoincrement=False, nullable=True
+        ),
+        sa.Column(
+            "chief_complaint", sa.String(length=500), autoincrement=False, nullable=True
+        ),
+        sa.Column(
+            "diagnosis", sa.String(length=500), autoincrement=False, nullable=True
+        ),
+        sa.Column("cost_yen", sa.Integer(), autoincrement=False, nullable=True),
+        sa.Column("next_visit_on", sa.Date(), autoincrement=False, nullable=True),
+        sa.Column("note", sa.Text(), autoincrement=False, nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), autoincrement=False, nullable=True),
+        sa.Column("version", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("created_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("updated_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "record_weights_archive",
+        sa.Column("id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("record_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("measured_on", sa.Date(), autoincrement=False, nullable=False),
+        sa.Column(
+            "weight_kg",
+            sa.DECIMAL(precision=5, scale=2),
+            autoincrement=False,
+            nullable=False,
+        ),
+        sa.Column("note", sa.String(length=500), autoincrement=False, nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), autoincrement=False, nullable=True),
+        sa.Column("version", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("created_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("updated_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "records_archive",
+        sa.Column("id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("recorded_on", sa.Date(), autoincrement=False, nullable=False),
+        sa.Column(
+            "condition", sa.String(length=20), autoincrement=False, nullable=True
+        ),
+        sa.Column("note", sa.Text(), autoincrement=False, nullable=True),
+        sa.Column("is_deleted", sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), autoincrement=False, nullable=True),
+        sa.Column("is_live", sa.SmallInteger(), autoincrement=False, nullable=True),
+        sa.Column("version", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("created_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("updated_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "vet_visit_attachments_archive",
+        sa.Column("id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("vet_visit_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column(
+            "file_name", sa.String(length=255), autoincrement=False, nullable=False
+        ),
+        sa.Column(
+            "content_type", sa.String(length=100), autoincrement=False, nullable=False
+        ),
+        sa.Column("size_bytes", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("sha256", sa.String(length=64), autoincrement=False, nullable=False),
+        sa.Column("is_deleted", sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), autoincrement=False, nullable=True),
+        sa.Column("version", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("created_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("updated_at", sa.DateTime(), autoincrement=False, nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def create_derived_tables() -> None:
+    op.create_table(
+        "pet_weight_trends",
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("last_weight_id", sa.BigInteger(), nullable=True),
+        sa.Column("last_measured_on", sa.Date(), nullable=True),
+        sa.Column("ewma_kg", sa.Double(), nullable=True),
+        sa.Column("prev_measured_on", sa.Date(), nullable=True),
+        sa.Column("prev_ewma_kg", sa.Double(), nullable=True),
+        sa.Column("sudden_loss", sa.SmallInteger(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["pet_id"],
+            ["pets.id"],
+        ),
+        sa.PrimaryKeyConstraint("pet_id"),
+    )
+    op.create_table(
+        "vet_cost_rollups",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("month", sa.SmallInteger(), nullable=False),
+        sa.Column("hospital_name", sa.String(length=200), nullable=False),
+        sa.Column("total_yen", sa.BigInteger(), nullable=False),
+        sa.Column("visit_count", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["pet_id"],
+            ["pets.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "pet_id", "year", "month", "hospital_name", name="uq_vet_costs_bucket"
+        ),
+    )
+    op.create_table(
+        "weight_trend_windows",
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("window_days", sa.SmallInteger(), nullable=False),
+        sa.Column("points", sa.Integer(), nullable=False),
+        sa.Column("sum_x", sa.BigInteger(), nullable=False),
+        sa.Column("sum_y", sa.BigInteger(), nullable=False),
+        sa.Column("sum_xy", sa.BigInteger(), nullable=False),
+        sa.Column("sum_xx", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["pet_id"],
+            ["pets.id"],
+        ),
+        sa.PrimaryKeyConstraint("pet_id", "window_days"),
+    )
+    op.create_table(
+        "medication_doses",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("medication_id", sa.BigInteger(), nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("dose_on", sa.Date(), nullable=False),
+        sa.Column("doses", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["medication_id"],
+            ["record_medications.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["pet_id"],
+            ["pets.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "medication_id", "dose_on", name="uq_doses_medication_date"
+        ),
+    )
+    op.create_index("idx_doses_date", "medication_doses", ["dose_on"], unique=False)
+    op.create_index(
+        "idx_doses_pet_date", "medication_doses", ["pet_id", "dose_on"], unique=False
+    )
+
+
+def create_attachment_tables() -> None:
+    op.create_table(
+        "attachment_uploads",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("vet_visit_id", sa.BigInteger(), nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("file_name", sa.String(length=255), nullable=False),
+        sa.Column("content_type", sa.String(length=100), nullable=False),
+        sa.Column("size_bytes", sa.BigInteger(), nullable=False),
+        sa.Column("received_bytes", sa.BigInteger(), nullable=False),
+        sa.Column("staged_name", sa.String(length=100), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["pet_id"],
+            ["pets.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["vet_visit_id"],
+            ["record_vet_visits.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "idx_attachment_uploads_updated",
+        "attachment_uploads",
+        ["updated_at"],
+        unique=False,
+    )
+    op.create_table(
+        "vet_visit_attachments",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("vet_visit_id", sa.BigInteger(), nullable=False),
+        sa.Column("pet_id", sa.BigInteger(), nullable=False),
+        sa.Column("file_name", sa.String(length=255), nullable=False),
+        sa.Column("content_type", sa.String(length=100), nullable=False),
+        sa.Column("size_bytes", sa.BigInteger(), nullable=False),
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("is_deleted", sa.SmallInteger(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["pet_id"],
+            ["pets.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["vet_visit_id"],
+            ["record_vet_visits.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "idx_attachments_deleted_at",
+        "vet_visit_attachments",
+        ["deleted_at"],
+        unique=False,
+    )
+    op.create_index(
+        "idx_attachments_sha256", "vet_visit_attachments", ["sha256"], unique=False
+    )
+    op.create_index(
+        "idx_attachments_visit",
+        "vet_visit_attachments",
+        ["vet_visit_id", "is_deleted"],
+        unique=False,
+    )
+
+
+def add_columns() -> None:
+    for table in VERSIONED_TABLES:
+        add_column_online(
+            table,
+            sa.Column(
+                "version", sa.Integer(), nullable=False, server_default=INITIAL_VERSION
+            ),
+        )
+    for table in CHILD_TABLES:
+        # NULL until backfilled; add_pet_foreign_keys makes it NOT NULL
+        add_column_online(table, sa.Column("pet_id", sa.BigInteger(), nullable=True))
+    for name in ("interval_days", "times_per_day"):
+        add_column_online("record_medications", sa.Column(name, sa.Integer()))
+    add_column_online(
+        "record_medications", sa.Column("days_of_week", sa.SmallInteger())
+    )
+    add_column_online("record_vet_visits", sa.Column("next_visit_on", sa.Date()))
+
+
+def merge_duplicate_days() -> None:
+    """Fold each day's duplicate live records into the oldest one.
+
+    Live children move to the kept record, which keeps the first
+    condition and note written for the day; the others are deleted.
+    """
+    bind = op.get_bind()
+    records = sa.table(
+        "records",
+        *(
+            sa.column(name)
+            for name in (
+                "id",
+                "pet_id",
+                "recorded_on",
+                "condition",
+                "note",
+                "is_deleted",
+                "deleted_at",
+                "updated_at",
+            )
+        ),
+    )
+    live = records.c.is_deleted == 0
+    days = bind.execute(
+        sa.select(records.c.pet_id, records.c.recorded_on)
+        .where(live)
+        .group_by(records.c.pet_id, records.c.recorded_on)
+        .having(sa.func.count() > 1)
+    ).all()
+    now = datetime.utcnow()
+    for pet_id, recorded_on in days:
+        rows = bind.execute(
+            sa.select(records.c.id, records.c.condition, records.c.note)
+            .where(live, records.c.pet_id == pet_id)
+            .where(records.c.recorded_on == recorded_on)
+            .order_by(records.c.id)
+        ).all()
+        duplicate_ids = [row.id for row in rows[1:]]
+        reparent_children(rows[0].id, duplicate_ids, now)
+        bind.execute(
+            records.update()
+            .where(records.c.id == rows[0].id)
+            .values(
+                condition=next((row.condition for row in rows if row.condition), None),
+                note=next((row.note for row in rows if row.note), None),
+                updated_at=now,
+            )
+        )
+        bind.execute(
+            records.update()
+            .where(records.c.id.in_(duplicate_ids))
+            .values(is_deleted=1, deleted_at=now, updated_at=now)
+        )
+
+
+def reparent_children(keeper_id: int, duplicate_ids: List[int], now: datetime) -> None:
+    for table in CHILD_TABLES:
+        child = sa.table(
+            table,
+            sa.column("record_id"),
+            sa.column("is_deleted"),
+            sa.column("updated_at"),
+        )
+        op.get_bind().execute(
+            child.update()
+            .where(child.c.record_id.in_(duplicate_ids), child.c.is_deleted == 0)
+            .values(record_id=keeper_id, updated_at=now)
+        )
+
+
+def add_pet_foreign_keys() -> None:
+    for table, foreign_key in CHILD_PET_FOREIGN_KEYS.items():
+        with op.batch_alter_table(table) as batch:
+            batch.alter_column("pet_id", existing_type=sa.BigInteger(), nullable=False)
+            batch.create_foreign_key(foreign_key, "pets", ["pet_id"], ["id"])
+
+
+def add_generated_columns() -> None:
+    """Stored generated columns; MySQL copies these two tables once"""
+    with op.batch_alter_table("records") as batch:
+        batch.add_column(
+            sa.Column(
+                "is_live",
+                sa.SmallInteger(),
+                sa.Computed("CASE WHEN is_deleted = 0 THEN 1 END", persisted=True),
+                nullable=True,
+            )
+        )
+        batch.create_unique_constraint(
+            "uq_records_pet_date_live", ["pet_id", "recorded_on", "is_live"]
+        )
+    with op.batch_alter_table("record_medications") as batch:
+        batch.add_column(
+            sa.Column(
+                "end_on_effective",
+                sa.Date(),
+                sa.Computed(f"COALESCE(end_on, '{OPEN_END_DATE}')", persisted=True),
+                nullable=True,
+            )
+        )
+
+
+def downgrade() -> None:
+    for name, table, _ in reversed(GENERATED_COLUMN_INDEXES):
+        op.drop_index(name, table_name=table)
+    with op.batch_alter_table("record_medications") as batch:
+        batch.drop_column("end_on_effective")
+    with op.batch_alter_table("records") as batch:
+        batch.drop_constraint("uq_records_pet_date_live", type_="unique")
+        batch.drop_column("is_live")
+    for table, foreign_key in CHILD_PET_FOREIGN_KEYS.items():
+        with op.batch_alter_table(table) as batch:
+            batch.drop_constraint(foreign_key, type_="foreignkey")
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    drop_columns()
+    op.drop_index("idx_attachments_visit", table_name="vet_visit_attachments")
+    op.drop_index("idx_attachments_sha256", table_name="vet_visit_attachments")
+    op.drop_index("idx_attachments_deleted_at", table_name="vet_visit_attachments")
+    op.drop_table("vet_visit_attachments")
+    op.drop_index("idx_doses_pet_date", table_name="medication_doses")
+    op.drop_index("idx_doses_date", table_name="medication_doses")
+    op.drop_table("medication_doses")
+    op.drop_index("idx_attachment_uploads_updated", table_name="attachment_uploads")
+    op.drop_table("attachment_uploads")
+    op.drop_table("weight_trend_windows")
+    op.drop_table("vet_cost_rollups")
+    op.drop_index("idx_report_jobs_status", table_name="report_jobs")
+    op.drop_index("idx_report_jobs_pet_cache", table_name="report_jobs")
+    op.drop_index("idx_report_jobs_finished", table_name="report_jobs")
+    op.drop_table("report_jobs")
+    op.drop_table("pet_weight_trends")
+    op.drop_table("vet_visit_attachments_archive")
+    op.drop_table("records_archive")
+    op.drop_table("record_weights_archive")
+    op.drop_table("record_vet_visits_archive")
+    op.drop_table("record_medications_archive")
+    op.drop_table("pets_archive")
+    op.drop_index("idx_change_events_pet_seq", table_name="change_events")
+    op.drop_table("change_events")
+
+
+def drop_columns() -> None:
+    dropped = {
+        "record_medications": ["days_of_week", "times_per_day", "interval_days"],
+        "record_vet_visits": ["next_visit_on"],
+    }
+    for table in CHILD_TABLES:
+        dropped.setdefault(table, []).append("pet_id")
+    for table in VERSIONED_TABLES:
+        dropped.setdefault(table, []).append("version")
+    for table, columns in dropped.items():
+        with op.batch_alter_table(table) as batch:
+            for column in columns:
+                batch.drop_column(column)
@@ -0,0 +1,65 @@
+"""Cascade deletes made before soft deletes cascaded.
+
+Until deleting a pet also deleted its records, and deleting a record
+its weights, medications and vet visits, only the parent row was
+marked. The routes used to hide such orphans by joining records; they
+now filter children on their own is_deleted and pet_id, so the
+orphans would show up again.
+
+This marks them deleted as of their parent's deletion, bumping
+updated_at and version so sync clients drop them too. There is no
+downgrade: the rows were already unreachable before the change.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 16:20:48.903114
+"""
+
+from datetime import datetime
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from migrations.helpers import backfill
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CHILD_TABLES = ("record_weights", "record_medications", "record_vet_visits")
+DELETED_AT_OF_PARENT = (
+    "(SELECT COALESCE({parent}.deleted_at, {parent}.updated_at) FROM {parent}"
+    " WHERE {parent}.id = {table}.{foreign_key})"
+)
+LIVE_UNDER_DELETED_PARENT = (
+    "is_deleted = 0"
+    " AND {foreign_key} IN (SELECT id FROM {parent} WHERE is_deleted = 1)"
+)
+
+
+def cascade(table: str, parent: str, foreign_key: str) -> None:
+    names = {"table": table, "parent": parent, "foreign_key": foreign_key}
+    backfill(
+        table,
+        {
+            "is_deleted": sa.literal(1),
+            "deleted_at": sa.text(DELETED_AT_OF_PARENT.format(**names)),
+            "updated_at": sa.literal(datetime.utcnow()),
+            "version": sa.text("version + 1"),
+        },
+        LIVE_UNDER_DELETED_PARENT.format(**names),
+    )
+
+
+def upgrade() -> None:
+    # Records first, so children of a deleted pet's records follow
+    cascade("records", "pets", "pet_id")
+    for table in CHILD_TABLES:
+        cascade(table, "records", "record_id")
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,37 @@
+"""Row version of pet_weight_trends.
+
+Trend writes are made conditional on it instead of locking the pet row.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 17:41:05.226318
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import add_column_online
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INITIAL_VERSION = "1"
+
+
+def upgrade() -> None:
+    add_column_online(
+        "pet_weight_trends",
+        sa.Column(
+            "version", sa.Integer(), nullable=False, server_default=INITIAL_VERSION
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("pet_weight_trends", "version")
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from sqlalchemy import (
     Column,
     BigInteger,
@@ -10,12 +10,20 @@ from sqlalchemy import (
     ForeignKey,
     DECIMAL,
     SmallInteger,
+    Index,
+    Table,
+    Computed,
+    UniqueConstraint,
+    Double,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+# Stands in for a missing end date so open-ended periods can be range-scanned
+OPEN_END_DATE = date(9999, 12, 31)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -32,6 +40,15 @@ class User(Base):
 
 class Pet(Base):
     __tablename__ = "pets"
+    __table_args__ = (
+        # Leads with the owner, so a user's pets are one index range
+        # however many users there are
+        Index("idx_pets_user", "user_id", "is_deleted", "id"),
+        # Sorts and name-prefix search of GET /pets
+        Index("idx_pets_user_name", "user_id", "is_deleted", "name"),
+        Index("idx_pets_user_birth", "user_id", "is_deleted", "birth_date"),
+        Index("idx_pets_deleted_at", "deleted_at"),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
@@ -42,17 +59,32 @@ class Pet(Base):
     photo_url = Column(String(500), nullable=True)
     is_deleted = Column(SmallInteger, nullable=False, default=0)
     deleted_at = Column(DateTime, nullable=True)
+    version = Column(Integer, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(
         DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
+    __mapper_args__ = {"version_id_col": version}
+
     user = relationship("User", back_populates="pets")
-    records = relationship("Record", back_populates="pet")
+    records = relationship(
+        "Record",
+        primaryjoin="and_(Pet.id == Record.pet_id, Record.is_deleted == 0)",
+        back_populates="pet",
+    )
 
 
 class Record(Base):
     __tablename__ = "records"
+    __table_args__ = (
+        Index("idx_records_pet_updated", "pet_id", "updated_at"),
+        Index("idx_records_deleted_at", "deleted_at"),
+        # is_live is NULL once deleted, so only live rows collide
+        UniqueConstraint(
+            "pet_id", "recorded_on", "is_live", name="uq_records_pet_date_live"
+        ),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
@@ -61,73 +93,362 @@ class Record(Base):
     note = Column(Text, nullable=True)
     is_deleted = Column(SmallInteger, nullable=False, default=0)
     deleted_at = Column(DateTime, nullable=True)
+    is_live = Column(
+        SmallInteger,
+        Computed("CASE WHEN is_deleted = 0 THEN 1 END", persisted=True),
+    )
+    version = Column(Integer, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(
         DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
+    __mapper_args__ = {"version_id_col": version}
+
     pet = relationship("Pet", back_populates="records")
-    weights = relationship("RecordWeight", back_populates="record")
-    medications = relationship("RecordMedication", back_populates="record")
-    vet_visits = relationship("RecordVetVisit", back_populates="record")
+    weights = relationship(
+        "RecordWeight",
+        primaryjoin=(
+            "and_(Record.id == RecordWeight.record_id, "
+            "RecordWeight.is_deleted == 0)"
+        ),
+        back_populates="record",
+    )
+    medications = relationship(
+        "RecordMedication",
+        primaryjoin=(
+            "and_(Record.id == RecordMedication.record_id, "
+            "RecordMedication.is_deleted == 0)"
+        ),
+        back_populates="record",
+    )
+    vet_visits = relationship(
+        "RecordVetVisit",
+        primaryjoin=(
+            "and_(Record.id == RecordVetVisit.record_id, "
+            "RecordVetVisit.is_deleted == 0)"
+        ),
+        back_populates="record",
+    )
 
 
 class RecordWeight(Base):
     __tablename__ = "record_weights"
+    __table_args__ = (
+        Index("idx_weights_pet_updated", "pet_id", "updated_at"),
+        Index("idx_weights_deleted_at", "deleted_at"),
+        Index("idx_weights_pet_measured", "pet_id", "measured_on"),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     record_id = Column(BigInteger, ForeignKey("records.id"), nullable=False)
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
     measured_on = Column(Date, nullable=False)
     weight_kg = Column(DECIMAL(5, 2), nullable=False)
     note = Column(String(500), nullable=True)
     is_deleted = Column(SmallInteger, nullable=False, default=0)
     deleted_at = Column(DateTime, nullable=True)
+    version = Column(Integer, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(
         DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
+    __mapper_args__ = {"version_id_col": version}
+
     record = relationship("Record", back_populates="weights")
 
 
 class RecordMedication(Base):
     __tablename__ = "record_medications"
+    __table_args__ = (
+        Index("idx_medications_pet_updated", "pet_id", "updated_at"),
+        Index("idx_medications_deleted_at", "deleted_at"),
+        Index(
+            "idx_medications_pet_period",
+            "pet_id",
+            "is_deleted",
+            "end_on_effective",
+            "start_on",
+        ),
+        Index(
+            "idx_medications_period", "is_deleted", "end_on_effective", "start_on"
+        ),
+        Index("idx_medications_pet_start", "pet_id", "start_on"),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     record_id = Column(BigInteger, ForeignKey("records.id"), nullable=False)
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
     name = Column(String(200), nullable=False)
     dosage = Column(String(200), nullable=True)
     frequency = Column(String(200), nullable=True)
+    # Structured schedule; frequency stays as the free-text label
+    interval_days = Column(Integer, nullable=True)
+    times_per_day = Column(Integer, nullable=True)
+    days_of_week = Column(SmallInteger, nullable=True)
     start_on = Column(Date, nullable=False)
     end_on = Column(Date, nullable=True)
+    # end_on with OPEN_END_DATE for ongoing medications; filter on this
+    # instead of (end_on >= x OR end_on IS NULL)
+    end_on_effective = Column(
+        Date,
+        Computed(f"COALESCE(end_on, '{OPEN_END_DATE.isoformat()}')", persisted=True),
+    )
     note = Column(Text, nullable=True)
     is_deleted = Column(SmallInteger, nullable=False, default=0)
     deleted_at = Column(DateTime, nullable=True)
+    version = Column(Integer, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(
         DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
+    __mapper_args__ = {"version_id_col": version}
+
     record = relationship("Record", back_populates="medications")
 
 
+class MedicationDose(Base):
+    """Dose calendar expanded from a medication's schedule (derived data)"""
+
+    __tablename__ = "medication_doses"
+    __table_args__ = (
+        UniqueConstraint("medication_id", "dose_on", name="uq_doses_medication_date"),
+        Index("idx_doses_pet_date", "pet_id", "dose_on"),
+        Index("idx_doses_date", "dose_on"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    medication_id = Column(
+        BigInteger, ForeignKey("record_medications.id"), nullable=False
+    )
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
+    dose_on = Column(Date, nullable=False)
+    doses = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
 class RecordVetVisit(Base):
     __tablename__ = "record_vet_visits"
+    __table_args__ = (
+        Index("idx_vet_visits_pet_updated", "pet_id", "updated_at"),
+        Index("idx_vet_visits_deleted_at", "deleted_at"),
+        Index("idx_vet_visits_next_visit", "next_visit_on"),
+        Index("idx_vet_visits_pet_visited", "pet_id", "visited_on"),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     record_id = Column(BigInteger, ForeignKey("records.id"), nullable=False)
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
     visited_on = Column(Date, nullable=False)
     hospital_name = Column(String(200), nullable=True)
     doctor_name = Column(String(200), nullable=True)
     chief_complaint = Column(String(500), nullable=True)
     diagnosis = Column(String(500), nullable=True)
     cost_yen = Column(Integer, nullable=True)
+    next_visit_on = Column(Date, nullable=True)
     note = Column(Text, nullable=True)
     is_deleted = Column(SmallInteger, nullable=False, default=0)
     deleted_at = Column(DateTime, nullable=True)
+    version = Column(Integer, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(
         DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
+    __mapper_args__ = {"version_id_col": version}
+
     record = relationship("Record", back_populates="vet_visits")
+
+
+class VetVisitAttachment(Base):
+    """Document attached to a vet visit; the bytes are a content-addressed blob"""
+
+    __tablename__ = "vet_visit_attachments"
+    __table_args__ = (
+        Index("idx_attachments_visit", "vet_visit_id", "is_deleted"),
+        Index("idx_attachments_sha256", "sha256"),
+        Index("idx_attachments_deleted_at", "deleted_at"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    vet_visit_id = Column(
+        BigInteger, ForeignKey("record_vet_visits.id"), nullable=False
+    )
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
+    file_name = Column(String(255), nullable=False)
+    content_type = Column(String(100), nullable=False)
+    size_bytes = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    is_deleted = Column(SmallInteger, nullable=False, default=0)
+    deleted_at = Column(DateTime, nullable=True)
+    version = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(
+        DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    __mapper_args__ = {"version_id_col": version}
+
+
+class AttachmentUpload(Base):
+    """Chunked upload in progress (temporary state, deleted once it ends)"""
+
+    __tablename__ = "attachment_uploads"
+    __table_args__ = (
+        Index("idx_attachment_uploads_updated", "updated_at"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    vet_visit_id = Column(
+        BigInteger, ForeignKey("record_vet_visits.id"), nullable=False
+    )
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
+    file_name = Column(String(255), nullable=False)
+    content_type = Column(String(100), nullable=False)
+    size_bytes = Column(BigInteger, nullable=False)
+    received_bytes = Column(BigInteger, nullable=False, default=0)
+    # File in the storage's staging area that the chunks are written into
+    staged_name = Column(String(100), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(
+        DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+class ChangeEvent(Base):
+    __tablename__ = "change_events"
+    __table_args__ = (Index("idx_change_events_pet_seq", "pet_id", "seq"),)
+
+    seq = Column(BigInteger, primary_key=True, autoincrement=True)
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(BigInteger, nullable=False)
+    pet_id = Column(BigInteger, nullable=False)
+    op = Column(String(10), nullable=False)
+    version = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class VetCostRollup(Base):
+    """Vet visit spend per pet, month and hospital (derived data)"""
+
+    __tablename__ = "vet_cost_rollups"
+    __table_args__ = (
+        UniqueConstraint(
+            "pet_id", "year", "month", "hospital_name", name="uq_vet_costs_bucket"
+        ),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(SmallInteger, nullable=False)
+    # '' for visits without a hospital so the bucket key has no NULLs
+    hospital_name = Column(String(200), nullable=False, default="")
+    total_yen = Column(BigInteger, nullable=False, default=0)
+    visit_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(
+        DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+class PetWeightTrend(Base):
+    """Incremental weight trend state of a pet (derived data)"""
+
+    __tablename__ = "pet_weight_trends"
+
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), primary_key=True)
+    last_weight_id = Column(BigInteger, nullable=True)
+    last_measured_on = Column(Date, nullable=True)
+    ewma_kg = Column(Double, nullable=True)
+    # EWMA before the last weight, so the last weight can be edited in O(1)
+    prev_measured_on = Column(Date, nullable=True)
+    prev_ewma_kg = Column(Double, nullable=True)
+    sudden_loss = Column(SmallInteger, nullable=False, default=0)
+    # Every trend write is conditional on it, windows included
+    version = Column(Integer, nullable=False)
+    updated_at = Column(
+        DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    __mapper_args__ = {"version_id_col": version}
+
+
+class WeightTrendWindow(Base):
+    """Least-squares sums of the weights in a pet's trailing window.
+
+    x is days since TREND_EPOCH and y is weight_kg in hundredths, so the
+    sums stay exact integers however often they are updated.
+    """
+
+    __tablename__ = "weight_trend_windows"
+
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), primary_key=True)
+    window_days = Column(SmallInteger, primary_key=True)
+    points = Column(Integer, nullable=False, default=0)
+    sum_x = Column(BigInteger, nullable=False, default=0)
+    sum_y = Column(BigInteger, nullable=False, default=0)
+    sum_xy = Column(BigInteger, nullable=False, default=0)
+    sum_xx = Column(BigInteger, nullable=False, default=0)
+
+
+class ReportJob(Base):
+    """Queued printable report of a pet (generated output, purged by age)"""
+
+    __tablename__ = "report_jobs"
+    __table_args__ = (
+        Index("idx_report_jobs_pet_cache", "pet_id", "cache_key"),
+        Index("idx_report_jobs_status", "status", "id"),
+        Index("idx_report_jobs_finished", "finished_at"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    pet_id = Column(BigInteger, ForeignKey("pets.id"), nullable=False)
+    # queued -> running -> done | failed
+    status = Column(String(10), nullable=False)
+    from_date = Column(Date, nullable=True)
+    to_date = Column(Date, nullable=True)
+    # Hash of the parameters and the pet's latest change seq: equal keys
+    # mean equal reports
+    cache_key = Column(String(64), nullable=False)
+    result_key = Column(String(200), nullable=True)
+    size_bytes = Column(BigInteger, nullable=True)
+    error = Column(String(500), nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+def archive_table(source: Table) -> Table:
+    """Build the archive copy of a table (same columns, no constraints)"""
+    columns = [
+        Column(
+            column.name,
+            column.type,
+            primary_key=column.primary_key,
+            autoincrement=False,
+            nullable=column.nullable,
+        )
+        for column in source.columns
+    ]
+    return Table(
+        f"{source.name}_archive",
+        Base.metadata,
+        *columns,
+        Column("archived_at", DateTime, nullable=False),
+    )
+
+
+# Rows deleted long ago are moved here by the archive job
+ARCHIVE_TABLES = {
+    table.name: archive_table(table)
+    for table in (
+        Pet.__table__,
+        Record.__table__,
+        RecordWeight.__table__,
+        RecordMedication.__table__,
+        RecordVetVisit.__table__,
+        VetVisitAttachment.__table__,
+    )
+}
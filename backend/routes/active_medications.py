@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from datetime import date
+
+from database import get_db
+from services.auth import current_user_id
+from models import Pet, RecordMedication
+import schemas
+
+router = APIRouter(prefix="/medications", tags=["medications"])
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+@router.get("/active-on", response_model=schemas.MedicationList)
+def get_medications_active_on(
+    on_date: date = Query(..., alias="date"),
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Get medications of the user's pets whose period covers the given date.
+
+    The user's pets come from idx_pets_user, and for each of them only
+    rows with end_on_effective >= date are read from
+    idx_medications_pet_period, so neither other users' nor finished
+    medications are scanned.
+    """
+    query = (
+        db.query(RecordMedication)
+        .join(Pet, RecordMedication.pet_id == Pet.id)
+        .filter(
+            RecordMedication.is_deleted == 0,
+            RecordMedication.end_on_effective >= on_date,
+            RecordMedication.start_on <= on_date,
+            Pet.user_id == user_id,
+            Pet.is_deleted == 0,
+        )
+    )
+
+    total = query.count()
+    medications = (
+        query.order_by(RecordMedication.end_on_effective, RecordMedication.id)
+        .limit(limit)
+        .offset(offset)
+        .all()
+    )
+    items = [schemas.Medication.model_validate(row) for row in medications]
+
+    return {"items": items, "total": total, "limit": limit, "offset": offset}
@@ -0,0 +1,326 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from typing import Optional
+from urllib.parse import quote
+
+from database import get_db
+from services.auth import owned_pet
+from models import (
+    AttachmentUpload,
+    RecordVetVisit,
+    VetVisitAttachment,
+)
+from services.attachments import (
+    DEFAULT_CONTENT_TYPE,
+    ByteRange,
+    FileRangeResponse,
+    advance_upload,
+    blob_key,
+    cancel_upload,
+    complete_upload,
+    open_upload,
+    parse_content_range,
+    read_range,
+    receive_chunk,
+    requested_range,
+)
+from services.outbox import record_row_change, ENTITY_ATTACHMENT, OP_DELETE
+from services.soft_delete import mark_deleted
+from services.storage import get_storage
+from services.concurrency import parse_if_match, check_version, version_conflict
+import schemas
+
+router = APIRouter(
+    prefix="/pets/{pet_id}/vet-visits/{visit_id}",
+    tags=["attachments"],
+    dependencies=[Depends(owned_pet)],
+)
+
+# Medical documents: cacheable by the owner's browser only
+ATTACHMENT_CACHE_CONTROL = "private, max-age=86400"
+
+
+def verify_visit_exists(pet_id: int, visit_id: int, db: Session) -> RecordVetVisit:
+    """Verify the pet's vet visit exists and is not deleted"""
+    visit = (
+        db.query(RecordVetVisit)
+        .filter(
+            RecordVetVisit.id == visit_id,
+            RecordVetVisit.pet_id == pet_id,
+            RecordVetVisit.is_deleted == 0,
+        )
+        .first()
+    )
+    if not visit:
+        raise HTTPException(status_code=404, detail="Vet visit not found")
+    return visit
+
+
+def load_upload(
+    db: Session, pet_id: int, visit_id: int, upload_id: int
+) -> AttachmentUpload:
+    verify_visit_exists(pet_id, visit_id, db)
+    upload = (
+        db.query(AttachmentUpload)
+        .filter(
+            AttachmentUpload.id == upload_id,
+            AttachmentUpload.vet_visit_id == visit_id,
+        )
+        .first()
+    )
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+def load_attachment(
+    db: Session, pet_id: int, visit_id: int, attachment_id: int
+) -> VetVisitAttachment:
+    verify_visit_exists(pet_id, visit_id, db)
+    attachment = (
+        db.query(VetVisitAttachment)
+        .filter(
+            VetVisitAttachment.id == attachment_id,
+            VetVisitAttachment.vet_visit_id == visit_id,
+            VetVisitAttachment.is_deleted == 0,
+        )
+        .first()
+    )
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return attachment
+
+
+def upload_item(upload: AttachmentUpload) -> dict:
+    """Build the upload response item"""
+    return {
+        "id": upload.id,
+        "vet_visit_id": upload.vet_visit_id,
+        "pet_id": upload.pet_id,
+        "file_name": upload.file_name,
+        "content_type": upload.content_type,
+        "size_bytes": upload.size_bytes,
+        "received_bytes": upload.received_bytes,
+        "created_at": upload.created_at,
+        "updated_at": upload.updated_at,
+    }
+
+
+def attachment_item(attachment: VetVisitAttachment) -> dict:
+    """Build the attachment response item"""
+    return {
+        "id": attachment.id,
+        "vet_visit_id": attachment.vet_visit_id,
+        "pet_id": attachment.pet_id,
+        "file_name": attachment.file_name,
+        "content_type": attachment.content_type,
+        "size_bytes": attachment.size_bytes,
+        "sha256": attachment.sha256,
+        "created_at": attachment.created_at,
+        "updated_at": attachment.updated_at,
+        "version": attachment.version,
+    }
+
+
+@router.get("/attachments", response_model=schemas.AttachmentList)
+def get_attachments(
+    pet_id: int,
+    visit_id: int,
+    db: Session = Depends(get_db),
+):
+    """Get the documents attached to a vet visit"""
+    verify_visit_exists(pet_id, visit_id, db)
+    attachments = (
+        db.query(VetVisitAttachment)
+        .filter(
+            VetVisitAttachment.vet_visit_id == visit_id,
+            VetVisitAttachment.is_deleted == 0,
+        )
+        .order_by(VetVisitAttachment.id)
+        .all()
+    )
+    return {"items": attachments}
+
+
+@router.post(
+    "/attachment-uploads", response_model=schemas.ItemResponse, status_code=201
+)
+def create_attachment_upload(
+    pet_id: int,
+    visit_id: int,
+    upload_data: schemas.AttachmentUploadCreate,
+    db: Session = Depends(get_db),
+):
+    """Start a resumable upload of a vet visit document"""
+    verify_visit_exists(pet_id, visit_id, db)
+    upload = open_upload(
+        db,
+        AttachmentUpload(
+            vet_visit_id=visit_id,
+            pet_id=pet_id,
+            file_name=upload_data.file_name,
+            content_type=upload_data.content_type or DEFAULT_CONTENT_TYPE,
+            size_bytes=upload_data.size_bytes,
+        ),
+    )
+    return {"item": upload_item(upload)}
+
+
+@router.get("/attachment-uploads/{upload_id}", response_model=schemas.ItemResponse)
+def get_attachment_upload(
+    pet_id: int,
+    visit_id: int,
+    upload_id: int,
+    db: Session = Depends(get_db),
+):
+    """Get an upload's progress; received_bytes is where it continues"""
+    return {"item": upload_item(load_upload(db, pet_id, visit_id, upload_id))}
+
+
+@router.put("/attachment-uploads/{upload_id}", response_model=schemas.ItemResponse)
+async def put_attachment_chunk(
+    pet_id: int,
+    visit_id: int,
+    upload_id: int,
+    request: Request,
+    response: Response,
+    content_range: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Send the upload's bytes given by Content-Range (bytes start-end/total).
+
+    A chunk must start at received_bytes (409 otherwise). The response is
+    the upload with its new received_bytes or, once the last byte has
+    arrived, the created attachment (201). "bytes */total" without a body
+    reports the upload's state, finishing it if every byte has arrived.
+    """
+    upload = await run_in_threadpool(
+        load_upload, db, pet_id, visit_id, upload_id
+    )
+    chunk = parse_content_range(content_range, upload.size_bytes)
+    if chunk is not None:
+        if chunk.start != upload.received_bytes:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload continues at byte {upload.received_bytes}",
+            )
+        path = get_storage().staging_path(upload.staged_name)
+        written = await receive_chunk(request, path, chunk)
+        advanced = await run_in_threadpool(
+            advance_upload, db, upload.id, chunk.start, written
+        )
+        if not advanced:
+            raise HTTPException(
+                status_code=409, detail="Upload was continued by another request"
+            )
+        await run_in_threadpool(db.refresh, upload)
+
+    if upload.received_bytes < upload.size_bytes:
+        return {"item": upload_item(upload)}
+
+    attachment = await run_in_threadpool(complete_upload, db, upload)
+    if attachment is None:
+        raise HTTPException(
+            status_code=409, detail="Upload was completed by another request"
+        )
+    response.status_code = 201
+    return {"item": attachment_item(attachment)}
+
+
+@router.delete("/attachment-uploads/{upload_id}", status_code=204)
+def delete_attachment_upload(
+    pet_id: int,
+    visit_id: int,
+    upload_id: int,
+    db: Session = Depends(get_db),
+):
+    """Cancel an upload and discard the bytes received so far"""
+    cancel_upload(db, load_upload(db, pet_id, visit_id, upload_id))
+    return None
+
+
+def content_disposition(file_name: str) -> str:
+    quoted = quote(file_name)
+    if quoted == file_name:
+        return f'attachment; filename="{file_name}"'
+    return f"attachment; filename*=utf-8''{quoted}"
+
+
+@router.get("/attachments/{attachment_id}/content")
+def download_attachment(
+    pet_id: int,
+    visit_id: int,
+    attachment_id: int,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Download an attachment, or the single byte range asked for by Range"""
+    attachment = load_attachment(db, pet_id, visit_id, attachment_id)
+    key = blob_key(attachment.sha256)
+    size = attachment.size_bytes
+    etag = f'"{attachment.sha256}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": ATTACHMENT_CACHE_CONTROL,
+        "Content-Disposition": content_disposition(attachment.file_name),
+    }
+
+    # If-Range: a range is only valid against the representation it names
+    byte_range = None
+    if if_range is None or if_range == etag:
+        byte_range = requested_range(range_header, size)
+
+    # Local blobs are sent from the file itself, ranges included
+    path = get_storage().local_path(key)
+    if byte_range is None:
+        if path is not None:
+            return FileResponse(
+                path, media_type=attachment.content_type, headers=headers
+            )
+        byte_range = ByteRange(0, size - 1)
+        status_code = 200
+    else:
+        headers["Content-Range"] = (
+            f"bytes {byte_range.start}-{byte_range.end}/{size}"
+        )
+        if path is not None:
+            return FileRangeResponse(
+                path, byte_range, media_type=attachment.content_type, headers=headers
+            )
+        status_code = 206
+
+    headers["Content-Length"] = str(byte_range.length)
+    return StreamingResponse(
+        read_range(key, byte_range),
+        status_code=status_code,
+        media_type=attachment.content_type,
+        headers=headers,
+    )
+
+
+@router.delete("/attachments/{attachment_id}", status_code=204)
+def delete_attachment(
+    pet_id: int,
+    visit_id: int,
+    attachment_id: int,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Logical delete of attachment"""
+    attachment = load_attachment(db, pet_id, visit_id, attachment_id)
+    check_version(attachment, parse_if_match(if_match))
+
+    try:
+        mark_deleted(attachment)
+        record_row_change(db, ENTITY_ATTACHMENT, attachment, pet_id, OP_DELETE)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+
+    return None
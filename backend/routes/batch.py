@@ -0,0 +1,183 @@
+import json
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, batch_session, engine
+from services.auth import current_user_id
+from services.events import hold_events, publish_held_events
+import schemas
+
+router = APIRouter(tags=["batch"])
+
+API_PREFIX = "/api"
+BATCH_PATH = "/batch"
+
+# Status reported for atomic operations skipped after an earlier failure
+NOT_EXECUTED_STATUS = 424
+
+# Request headers that describe the batch body, not an operation's
+BATCH_ONLY_HEADERS = {b"content-type", b"content-length"}
+
+# Connection-level scope keys an operation inherits from the batch request
+INHERITED_SCOPE_KEYS = (
+    "type",
+    "asgi",
+    "http_version",
+    "scheme",
+    "server",
+    "client",
+    "root_path",
+    "state",
+)
+
+
+@contextmanager
+def batch_transaction(atomic: bool) -> Iterator[Tuple[Session, object]]:
+    """Session shared by the operations of one batch.
+
+    In atomic mode the session joins an outer transaction as savepoints,
+    so each route's own commit/rollback only ends a savepoint and the
+    caller decides at the end whether the outer transaction commits.
+    Otherwise it is a plain session and every route commits on its own.
+    """
+    if not atomic:
+        db = SessionLocal()
+        try:
+            yield db, None
+        finally:
+            db.close()
+        return
+
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = SessionLocal(bind=connection, join_transaction_mode="create_savepoint")
+    # Route commits only release savepoints; notify once the batch commits
+    hold_events(db)
+    try:
+        yield db, transaction
+    finally:
+        db.close()
+        if transaction.is_active:
+            transaction.rollback()
+        connection.close()
+
+
+def operation_scope(
+    request: Request, operation: schemas.BatchOperation, body: bytes
+) -> dict:
+    """ASGI scope of one operation, inheriting the batch request's headers"""
+    path, _, query = operation.path.partition("?")
+    overrides = {
+        name.lower().encode("latin-1"): value.encode("latin-1")
+        for name, value in operation.headers.items()
+    }
+    headers = [
+        (name, value)
+        for name, value in request.scope["headers"]
+        if name not in BATCH_ONLY_HEADERS and name not in overrides
+    ]
+    headers += list(overrides.items())
+    headers += [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode("latin-1")),
+    ]
+    outer = request.scope
+    scope = {key: outer[key] for key in INHERITED_SCOPE_KEYS if key in outer}
+    scope.update(
+        method=operation.method,
+        path=API_PREFIX + path,
+        raw_path=(API_PREFIX + path).encode("utf-8"),
+        query_string=query.encode("utf-8"),
+        headers=headers,
+    )
+    return scope
+
+
+async def dispatch(
+    request: Request, operation: schemas.BatchOperation
+) -> schemas.BatchResult:
+    """Run one operation through the app in-process and capture its response"""
+    body = b"" if operation.body is None else json.dumps(operation.body).encode()
+    scope = operation_scope(request, operation, body)
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"status": 500, "headers": [], "body": b""}
+
+    async def receive() -> dict:
+        return pending.pop() if pending else {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    try:
+        await request.app(scope, receive, send)
+    except Exception as e:
+        return schemas.BatchResult(status=500, body={"detail": str(e)})
+
+    headers = dict(response["headers"])
+    etag = headers.get(b"etag")
+    return schemas.BatchResult(
+        status=response["status"],
+        body=json.loads(response["body"]) if response["body"] else None,
+        etag=etag.decode("latin-1") if etag else None,
+    )
+
+
+def succeeded(result: schemas.BatchResult) -> bool:
+    return result.status < 400
+
+
+# Authenticated up front; each operation also authenticates on its own
+# with the Authorization header it inherits
+@router.post(
+    BATCH_PATH,
+    response_model=schemas.BatchResponse,
+    dependencies=[Depends(current_user_id)],
+)
+async def run_batch(batch: schemas.BatchRequest, request: Request):
+    """Run several API operations in one request and one DB session.
+
+    atomic=true (default) runs them in one transaction and stops at the
+    first failure, rolling everything back; atomic=false commits each
+    operation on its own and runs all of them.
+    """
+    for operation in batch.operations:
+        if operation.path.partition("?")[0].rstrip("/") == BATCH_PATH:
+            raise HTTPException(status_code=400, detail="Batches cannot be nested")
+
+    results: List[schemas.BatchResult] = []
+    with batch_transaction(batch.atomic) as (db, transaction):
+        token = batch_session.set(db)
+        try:
+            for operation in batch.operations:
+                result = await dispatch(request, operation)
+                results.append(result)
+                if succeeded(result):
+                    continue
+                if batch.atomic:
+                    break
+                await run_in_threadpool(db.rollback)
+        finally:
+            batch_session.reset(token)
+
+        # Per-operation batches have already committed what succeeded
+        committed = not batch.atomic or all(map(succeeded, results))
+        if batch.atomic and committed:
+            await run_in_threadpool(db.commit)
+            await run_in_threadpool(transaction.commit)
+            publish_held_events(db)
+
+    skipped = len(batch.operations) - len(results)
+    results += [
+        schemas.BatchResult(
+            status=NOT_EXECUTED_STATUS,
+            body={"detail": "Not executed: an earlier operation failed"},
+        )
+    ] * skipped
+    return {"committed": committed, "results": results}
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from typing import List, Optional, Set, Tuple
+
+from database import SessionLocal
+from models import ChangeEvent, Pet
+from services.auth import current_user_id
+from services.events import bus, Subscription
+from services.outbox import ENTITY_PET, OP_CREATE
+import schemas
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+
+MAX_WAIT_SECONDS = 30
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def fetch_changes(
+    user_id: int, since: int, pet_id: Optional[int], limit: int
+) -> Tuple[List[schemas.ChangeEvent], Set[int]]:
+    """Fetch the user's change events committed after the given sequence.
+
+    Deleted pets count too, so their delete events reach the client.
+    Also returns the ids of the user's pets, to tell which notifications
+    concern the user. The session only lives for this read.
+    """
+    db = SessionLocal()
+    try:
+        pet_ids = set(db.scalars(select(Pet.id).where(Pet.user_id == user_id)))
+        query = db.query(ChangeEvent).filter(
+            ChangeEvent.pet_id.in_(pet_ids), ChangeEvent.seq > since
+        )
+        if pet_id is not None:
+            query = query.filter(ChangeEvent.pet_id == pet_id)
+        events = query.order_by(ChangeEvent.seq).limit(limit).all()
+        items = [schemas.ChangeEvent.model_validate(event) for event in events]
+    finally:
+        db.close()
+    return items, pet_ids
+
+
+def concerns(change: schemas.ChangeEvent, pet_ids: Set[int]) -> bool:
+    """Whether a notification may be one of the user's events"""
+    # A pet created meanwhile is not in pet_ids yet; fetching tells
+    return change.pet_id in pet_ids or (
+        change.entity == ENTITY_PET and change.op == OP_CREATE
+    )
+
+
+async def wait_for_change(
+    subscription: Subscription, pet_ids: Set[int], timeout: float
+) -> bool:
+    """Wait for a notification concerning the user (False on timeout)"""
+    deadline = time.monotonic() + timeout
+    while not subscription.overflowed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        try:
+            change = await asyncio.wait_for(subscription.queue.get(), remaining)
+        except asyncio.TimeoutError:
+            return False
+        if concerns(change, pet_ids):
+            return True
+    # Notifications were dropped; fetching finds whatever they were
+    return True
+
+
+def renew(subscription: Subscription) -> Subscription:
+    """Replace an overflowed subscription before reading again"""
+    if not subscription.overflowed:
+        return subscription
+    bus.unsubscribe(subscription)
+    return bus.subscribe(subscription.pet_id)
+
+
+@router.get("", response_model=schemas.ChangeEventList)
+async def get_changes(
+    since: int = 0,
+    pet_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    wait: int = Query(0, ge=0, le=MAX_WAIT_SECONDS),
+    user_id: int = Depends(current_user_id),
+):
+    """Get change events after `since` (long-poll up to `wait` seconds).
+
+    While waiting, no session is open: the request sleeps on the event
+    bus and reads the database again only when a write concerning the
+    user was committed.
+    """
+    deadline = time.monotonic() + wait
+
+    # Subscribed before reading, so nothing committed in between is missed
+    subscription = bus.subscribe(pet_id)
+    try:
+        items, pet_ids = await run_in_threadpool(
+            fetch_changes, user_id, since, pet_id, limit
+        )
+        while not items and await wait_for_change(
+            subscription, pet_ids, deadline - time.monotonic()
+        ):
+            subscription = renew(subscription)
+            items, pet_ids = await run_in_threadpool(
+                fetch_changes, user_id, since, pet_id, limit
+            )
+    finally:
+        bus.unsubscribe(subscription)
+
+    next_since = items[-1].seq if items else since
+
+    return {"items": items, "limit": limit, "next_since": next_since}
+
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from typing import Literal
+
+from database import get_db
+from services.auth import current_user_id, owned_pet
+from services.vet_costs import cost_breakdown
+import schemas
+
+router = APIRouter(tags=["costs"])
+
+GroupBy = Literal["month", "year", "hospital"]
+
+
+def cost_summary(items: list, group_by: str) -> dict:
+    return {
+        "group_by": group_by,
+        "items": items,
+        "total_yen": sum(item["total_yen"] for item in items),
+    }
+
+
+@router.get(
+    "/pets/{pet_id}/costs",
+    response_model=schemas.CostSummary,
+    dependencies=[Depends(owned_pet)],
+)
+def get_pet_costs(
+    pet_id: int,
+    group_by: GroupBy = "month",
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Get a pet's vet spend per month, year or hospital (from rollups)"""
+    return cost_summary(cost_breakdown(db, group_by, user_id, pet_id), group_by)
+
+
+@router.get("/costs", response_model=schemas.CostSummary)
+def get_costs(
+    group_by: GroupBy = "month",
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Get vet spend of the user's pets per month, year or hospital (from rollups)"""
+    return cost_summary(cost_breakdown(db, group_by, user_id), group_by)
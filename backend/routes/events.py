@@ -0,0 +1,105 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Optional
+
+from database import SessionLocal
+from services.auth import owned_pet
+from models import ChangeEvent
+from services.events import bus, Subscription
+import schemas
+
+router = APIRouter(
+    prefix="/pets/{pet_id}/events",
+    tags=["events"],
+    dependencies=[Depends(owned_pet)],
+)
+
+HEARTBEAT_SECONDS = 15
+REPLAY_BATCH_SIZE = 500
+RETRY_MILLISECONDS = 3000
+
+
+def fetch_missed(pet_id: int, after_seq: int) -> List[schemas.ChangeEvent]:
+    """Committed events of the pet after a sequence, for resuming clients"""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(ChangeEvent)
+            .filter(ChangeEvent.pet_id == pet_id, ChangeEvent.seq > after_seq)
+            .order_by(ChangeEvent.seq)
+            .limit(REPLAY_BATCH_SIZE)
+            .all()
+        )
+        return [schemas.ChangeEvent.model_validate(row) for row in rows]
+    finally:
+        db.close()
+
+
+def sse_message(change: schemas.ChangeEvent) -> str:
+    data = json.dumps(change.model_dump(mode="json"), ensure_ascii=False)
+    return f"id: {change.seq}\nevent: {change.entity}.{change.op}\ndata: {data}\n\n"
+
+
+async def event_stream(
+    request: Request,
+    subscription: Subscription,
+    last_seq: Optional[int],
+) -> AsyncIterator[str]:
+    """Replay what a resuming client missed, then stream live events"""
+    replayed = set()
+    try:
+        yield f"retry: {RETRY_MILLISECONDS}\n\n"
+        # Subscribed before replaying, so nothing committed in between is lost
+        while last_seq is not None:
+            missed = await run_in_threadpool(
+                fetch_missed, subscription.pet_id, last_seq
+            )
+            for change in missed:
+                replayed.add(change.seq)
+                yield sse_message(change)
+            if len(missed) < REPLAY_BATCH_SIZE:
+                break
+            last_seq = missed[-1].seq
+
+        while not subscription.overflowed:
+            try:
+                change = await asyncio.wait_for(
+                    subscription.queue.get(), HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": heartbeat\n\n"
+                continue
+            # Live events can commit out of seq order, so only skip the
+            # ones already sent by the replay
+            if change.seq not in replayed:
+                yield sse_message(change)
+    finally:
+        bus.unsubscribe(subscription)
+
+
+@router.get("")
+async def get_pet_events(
+    pet_id: int,
+    request: Request,
+    since: Optional[int] = Query(None, ge=0),
+    last_event_id: Optional[int] = Header(None),
+):
+    """Stream the pet's create/update/delete notifications (Server-Sent Events).
+
+    Reconnecting clients send Last-Event-ID (or ?since=seq) and first get
+    the events they missed. EventSource cannot send an Authorization
+    header, so browsers pass the token as ?access_token= here.
+    """
+    last_seq = last_event_id if last_event_id is not None else since
+
+    subscription = bus.subscribe(pet_id)
+    return StreamingResponse(
+        event_stream(request, subscription, last_seq),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
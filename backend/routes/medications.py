@@ -1,42 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy.orm.exc import StaleDataError
 from typing import Optional
 from datetime import date, datetime
 
 from database import get_db
-from models import Pet, Record, RecordMedication
+from services.auth import owned_pet
+from models import RecordMedication, MedicationDose
+from services.outbox import (
+    record_change,
+    record_row_change,
+    ENTITY_MEDICATION,
+    OP_CREATE,
+    OP_UPDATE,
+    OP_DELETE,
+)
+from services.soft_delete import mark_deleted
+from services.patching import patch_row, row_values
+from services.dose_calendar import rebuild_doses
+from services.records import touch_record, resolve_daily_record
+from services.concurrency import (
+    parse_if_match,
+    check_version,
+    set_etag,
+    version_conflict,
+)
 import schemas
 
-router = APIRouter(prefix="/pets/{pet_id}/medications", tags=["medications"])
+router = APIRouter(
+    prefix="/pets/{pet_id}/medications",
+    tags=["medications"],
+    dependencies=[Depends(owned_pet)],
+)
 
+MAX_CALENDAR_DAYS = 366
 
-def verify_pet_exists(pet_id: int, db: Session) -> Pet:
-    """Verify pet exists and is not deleted"""
-    pet = db.query(Pet).filter(Pet.id == pet_id, Pet.is_deleted == 0).first()
-    if not pet:
-        raise HTTPException(status_code=404, detail="Pet not found")
-    return pet
 
-
-def get_or_create_record(pet_id: int, start_on: date, db: Session) -> Record:
-    """Get or create a record for the given date"""
-    record = (
-        db.query(Record)
-        .filter(
-            Record.pet_id == pet_id,
-            Record.recorded_on == start_on,
-            Record.is_deleted == 0,
-        )
-        .first()
-    )
-
-    if not record:
-        record = Record(pet_id=pet_id, recorded_on=start_on)
-        db.add(record)
-        db.flush()
-
-    return record
+def medication_item(values: dict, pet_id: int) -> dict:
+    """Build the medication response item from column values"""
+    return {
+        "id": values["id"],
+        "pet_id": pet_id,
+        "name": values["name"],
+        "dosage": values["dosage"],
+        "frequency": values["frequency"],
+        "interval_days": values["interval_days"],
+        "times_per_day": values["times_per_day"],
+        "days_of_week": values["days_of_week"],
+        "start_on": values["start_on"],
+        "end_on": values["end_on"],
+        "note": values["note"],
+        "created_at": values["created_at"],
+        "updated_at": values["updated_at"],
+        "version": values["version"],
+    }
 
 
 @router.get("", response_model=schemas.MedicationList)
@@ -49,26 +66,17 @@ def get_medications(
     db: Session = Depends(get_db),
 ):
     """Get medications for a pet"""
-    verify_pet_exists(pet_id, db)
-
-    # Join with records to filter by pet_id
+    # Filter on the denormalized pet_id so idx_medications_pet_period applies
     query = (
-        db.query(RecordMedication, Record.pet_id)
-        .join(Record, RecordMedication.record_id == Record.id)
+        db.query(RecordMedication, RecordMedication.pet_id)
         .filter(
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordMedication.pet_id == pet_id,
             RecordMedication.is_deleted == 0,
         )
     )
 
     if from_date:
-        query = query.filter(
-            or_(
-                RecordMedication.end_on >= from_date,
-                RecordMedication.end_on.is_(None),
-            )
-        )
+        query = query.filter(RecordMedication.end_on_effective >= from_date)
     if to_date:
         query = query.filter(RecordMedication.start_on <= to_date)
 
@@ -84,11 +92,15 @@ def get_medications(
                 name=medication.name,
                 dosage=medication.dosage,
                 frequency=medication.frequency,
+                interval_days=medication.interval_days,
+                times_per_day=medication.times_per_day,
+                days_of_week=medication.days_of_week,
                 start_on=medication.start_on,
                 end_on=medication.end_on,
                 note=medication.note,
                 created_at=medication.created_at,
                 updated_at=medication.updated_at,
+                version=medication.version,
             )
         )
 
@@ -101,21 +113,14 @@ def get_active_medications(
     db: Session = Depends(get_db),
 ):
     """Get active (ongoing) medications for a pet"""
-    verify_pet_exists(pet_id, db)
-
     today = date.today()
 
     query = (
-        db.query(RecordMedication, Record.pet_id)
-        .join(Record, RecordMedication.record_id == Record.id)
+        db.query(RecordMedication, RecordMedication.pet_id)
         .filter(
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordMedication.pet_id == pet_id,
             RecordMedication.is_deleted == 0,
-            or_(
-                RecordMedication.end_on >= today,
-                RecordMedication.end_on.is_(None),
-            ),
+            RecordMedication.end_on_effective >= today,
         )
     )
 
@@ -130,54 +135,97 @@ def get_active_medications(
                 name=medication.name,
                 dosage=medication.dosage,
                 frequency=medication.frequency,
+                interval_days=medication.interval_days,
+                times_per_day=medication.times_per_day,
+                days_of_week=medication.days_of_week,
                 start_on=medication.start_on,
                 end_on=medication.end_on,
                 note=medication.note,
                 created_at=medication.created_at,
                 updated_at=medication.updated_at,
+                version=medication.version,
             )
         )
 
     return {"items": items, "total": len(items), "limit": len(items), "offset": 0}
 
 
+@router.get("/calendar", response_model=schemas.MedicationCalendar)
+def get_medication_calendar(
+    pet_id: int,
+    from_date: date = Query(..., alias="from"),
+    to_date: date = Query(..., alias="to"),
+    db: Session = Depends(get_db),
+):
+    """Get scheduled doses per day from the precomputed dose calendar"""
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (to_date - from_date).days >= MAX_CALENDAR_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Range must be at most {MAX_CALENDAR_DAYS} days",
+        )
+
+    results = (
+        db.query(MedicationDose, RecordMedication.name, RecordMedication.dosage)
+        .join(RecordMedication, MedicationDose.medication_id == RecordMedication.id)
+        .filter(
+            MedicationDose.pet_id == pet_id,
+            MedicationDose.dose_on >= from_date,
+            MedicationDose.dose_on <= to_date,
+            RecordMedication.is_deleted == 0,
+        )
+        .order_by(MedicationDose.dose_on, MedicationDose.medication_id)
+        .all()
+    )
+
+    items = [
+        schemas.MedicationDose(
+            medication_id=dose.medication_id,
+            name=name,
+            dosage=dosage,
+            dose_on=dose.dose_on,
+            doses=dose.doses,
+        )
+        for dose, name, dosage in results
+    ]
+    return {"items": items, "total": len(items)}
+
+
 @router.post("", response_model=schemas.ItemResponse, status_code=201)
 def create_medication(
-    pet_id: int, medication_data: schemas.MedicationCreate, db: Session = Depends(get_db)
+    pet_id: int,
+    medication_data: schemas.MedicationCreate,
+    db: Session = Depends(get_db),
 ):
     """Create a new medication"""
-    verify_pet_exists(pet_id, db)
-
     try:
-        # Get or create record for the start date
-        record = get_or_create_record(pet_id, medication_data.start_on, db)
+        # Resolve the daily record for the start date
+        record_id = resolve_daily_record(db, pet_id, medication_data.start_on)
 
         medication = RecordMedication(
-            record_id=record.id,
+            record_id=record_id,
+            pet_id=pet_id,
             name=medication_data.name,
             dosage=medication_data.dosage,
             frequency=medication_data.frequency,
+            interval_days=medication_data.interval_days,
+            times_per_day=medication_data.times_per_day,
+            days_of_week=medication_data.days_of_week,
             start_on=medication_data.start_on,
             end_on=medication_data.end_on,
             note=medication_data.note,
         )
         db.add(medication)
+        record_row_change(db, ENTITY_MEDICATION, medication, pet_id, OP_CREATE)
+        rebuild_doses(db, [medication.id])
         db.commit()
         db.refresh(medication)
 
         return {
-            "item": {
-                "id": medication.id,
-                "pet_id": pet_id,
-                "name": medication.name,
-                "dosage": medication.dosage,
-                "frequency": medication.frequency,
-                "start_on": medication.start_on,
-                "end_on": medication.end_on,
-                "note": medication.note,
-                "created_at": medication.created_at,
-                "updated_at": medication.updated_at,
-            }
+            "item": medication_item(
+                row_values(medication, RecordMedication), pet_id
+            )
         }
 
     except Exception as e:
@@ -186,17 +234,18 @@ def create_medication(
 
 
 @router.get("/{med_id}", response_model=schemas.ItemResponse)
-def get_medication(pet_id: int, med_id: int, db: Session = Depends(get_db)):
+def get_medication(
+    pet_id: int,
+    med_id: int,
+    response: Response,
+    db: Session = Depends(get_db),
+):
     """Get medication detail"""
-    verify_pet_exists(pet_id, db)
-
     medication = (
         db.query(RecordMedication)
-        .join(Record, RecordMedication.record_id == Record.id)
         .filter(
             RecordMedication.id == med_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordMedication.pet_id == pet_id,
             RecordMedication.is_deleted == 0,
         )
         .first()
@@ -205,19 +254,11 @@ def get_medication(pet_id: int, med_id: int, db: Session = Depends(get_db)):
     if not medication:
         raise HTTPException(status_code=404, detail="Medication not found")
 
+    set_etag(response, medication.version)
     return {
-        "item": {
-            "id": medication.id,
-            "pet_id": pet_id,
-            "name": medication.name,
-            "dosage": medication.dosage,
-            "frequency": medication.frequency,
-            "start_on": medication.start_on,
-            "end_on": medication.end_on,
-            "note": medication.note,
-            "created_at": medication.created_at,
-            "updated_at": medication.updated_at,
-        }
+        "item": medication_item(
+            row_values(medication, RecordMedication), pet_id
+        )
     }
 
 
@@ -226,18 +267,16 @@ def update_medication(
     pet_id: int,
     med_id: int,
     medication_data: schemas.MedicationUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
 ):
     """Update medication"""
-    verify_pet_exists(pet_id, db)
-
     medication = (
         db.query(RecordMedication)
-        .join(Record, RecordMedication.record_id == Record.id)
         .filter(
             RecordMedication.id == med_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordMedication.pet_id == pet_id,
             RecordMedication.is_deleted == 0,
         )
         .first()
@@ -245,50 +284,94 @@ def update_medication(
 
     if not medication:
         raise HTTPException(status_code=404, detail="Medication not found")
+    check_version(medication, parse_if_match(if_match))
 
     try:
         medication.name = medication_data.name
         medication.dosage = medication_data.dosage
         medication.frequency = medication_data.frequency
+        medication.interval_days = medication_data.interval_days
+        medication.times_per_day = medication_data.times_per_day
+        medication.days_of_week = medication_data.days_of_week
         medication.start_on = medication_data.start_on
         medication.end_on = medication_data.end_on
         medication.note = medication_data.note
+        touch_record(db, medication.record_id)
+        record_row_change(db, ENTITY_MEDICATION, medication, pet_id, OP_UPDATE)
+        rebuild_doses(db, [medication.id])
 
         db.commit()
         db.refresh(medication)
+        set_etag(response, medication.version)
 
         return {
-            "item": {
-                "id": medication.id,
-                "pet_id": pet_id,
-                "name": medication.name,
-                "dosage": medication.dosage,
-                "frequency": medication.frequency,
-                "start_on": medication.start_on,
-                "end_on": medication.end_on,
-                "note": medication.note,
-                "created_at": medication.created_at,
-                "updated_at": medication.updated_at,
-            }
+            "item": medication_item(
+                row_values(medication, RecordMedication), pet_id
+            )
         }
 
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.patch("/{med_id}", response_model=schemas.ItemResponse)
+def patch_medication(
+    pet_id: int,
+    med_id: int,
+    medication_data: schemas.MedicationPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Partially update medication (JSON merge patch)"""
+    changes = medication_data.model_dump(exclude_unset=True)
+    criteria = [
+        RecordMedication.id == med_id,
+        RecordMedication.pet_id == pet_id,
+        RecordMedication.is_deleted == 0,
+    ]
+    expected_version = parse_if_match(if_match)
+
+    try:
+        values = patch_row(db, RecordMedication, criteria, changes, expected_version)
+        if values is not None and changes:
+            touch_record(db, values["record_id"])
+            record_change(
+                db, ENTITY_MEDICATION, med_id, pet_id, OP_UPDATE, values["version"]
+            )
+            rebuild_doses(db, [med_id])
+            db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
+    if values is None:
+        raise HTTPException(status_code=404, detail="Medication not found")
+
+    set_etag(response, values["version"])
+    return {"item": medication_item(values, pet_id)}
+
 
 @router.delete("/{med_id}", status_code=204)
-def delete_medication(pet_id: int, med_id: int, db: Session = Depends(get_db)):
+def delete_medication(
+    pet_id: int,
+    med_id: int,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
     """Logical delete of medication"""
-    verify_pet_exists(pet_id, db)
-
     medication = (
         db.query(RecordMedication)
-        .join(Record, RecordMedication.record_id == Record.id)
         .filter(
             RecordMedication.id == med_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordMedication.pet_id == pet_id,
             RecordMedication.is_deleted == 0,
         )
         .first()
@@ -297,7 +380,16 @@ def delete_medication(pet_id: int, med_id: int, db: Session = Depends(get_db)):
     if not medication:
         raise HTTPException(status_code=404, detail="Medication not found")
 
-    medication.is_deleted = 1
-    db.commit()
+    check_version(medication, parse_if_match(if_match))
+
+    try:
+        mark_deleted(medication)
+        touch_record(db, medication.record_id)
+        record_row_change(db, ENTITY_MEDICATION, medication, pet_id, OP_DELETE)
+        rebuild_doses(db, [medication.id])
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
 
     return None
@@ -1,33 +1,172 @@
-from fastapi import APIRouter, Depends, HTTPException
+import base64
+import json
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import List
+from sqlalchemy.orm.exc import StaleDataError
+from typing import List, Literal, NamedTuple, Optional
 from datetime import date
 
 from database import get_db
-from models import Pet, User, Record, RecordVetVisit, RecordWeight, RecordMedication
+from services.auth import current_user_id, owned_pet
+from models import Pet, RecordVetVisit, RecordWeight, RecordMedication
+from services.outbox import (
+    record_change,
+    record_row_change,
+    ENTITY_PET,
+    OP_CREATE,
+    OP_UPDATE,
+    OP_DELETE,
+)
+from services.soft_delete import soft_delete_pet
+from services.patching import patch_row, row_values
+from services.photos import photo_urls
+from services.weight_trends import trend_item
+from services.concurrency import (
+    parse_if_match,
+    check_version,
+    set_etag,
+    version_conflict,
+)
 import schemas
 
 router = APIRouter(prefix="/pets", tags=["pets"])
 
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# Sorts by a column then id; "-" for descending. Each column has an index
+# after (user_id, is_deleted), and index entries end with the primary key
+PetSort = Literal["id", "-id", "name", "-name", "birth_date", "-birth_date"]
+SORT_COLUMNS = {"id": Pet.id, "name": Pet.name, "birth_date": Pet.birth_date}
+
+
+class PetCursor(NamedTuple):
+    sort: str
+    # The sort column's value; birth_date as an ISO date, null if unset
+    value: object
+    id: int
+
+
+def encode_cursor(sort: PetSort, values: dict) -> str:
+    value = values[sort.lstrip("-")]
+    if isinstance(value, date):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, values["id"]], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token: str, sort: PetSort) -> PetCursor:
+    """The cursor of a previous page, which must use the same sort"""
+    try:
+        raw = base64.urlsafe_b64decode(token.encode()).decode()
+        cursor = PetCursor(*json.loads(raw))
+        if cursor.sort != sort or not isinstance(cursor.id, int):
+            raise ValueError(cursor)
+        if cursor.value is not None and sort.lstrip("-") == "birth_date":
+            cursor = cursor._replace(value=date.fromisoformat(cursor.value))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return cursor
+
+
+def after_cursor(column, descending: bool, cursor: PetCursor):
+    """Keyset condition for the rows after the cursor in (column, id) order.
+
+    NULLs come first ascending and last descending, as MySQL sorts them.
+    """
+    later_id = Pet.id < cursor.id if descending else Pet.id > cursor.id
+    if column is Pet.id:
+        return later_id
+    if cursor.value is None:
+        among_nulls = and_(column.is_(None), later_id)
+        return among_nulls if descending else or_(among_nulls, column.isnot(None))
+    beyond = column < cursor.value if descending else column > cursor.value
+    after = or_(beyond, and_(column == cursor.value, later_id))
+    return or_(after, column.is_(None)) if descending else after
+
+
+def escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def pet_filters(
+    species: Optional[str],
+    sex: Optional[str],
+    born_from: Optional[date],
+    born_to: Optional[date],
+    name_prefix: Optional[str],
+) -> list:
+    conditions = []
+    if species:
+        conditions.append(Pet.species == species)
+    if sex:
+        conditions.append(Pet.sex == sex)
+    if born_from:
+        conditions.append(Pet.birth_date >= born_from)
+    if born_to:
+        conditions.append(Pet.birth_date <= born_to)
+    if name_prefix:
+        # A LIKE without a leading wildcard is a range of idx_pets_user_name
+        pattern = escape_like(name_prefix) + "%"
+        conditions.append(Pet.name.like(pattern, escape="\\"))
+    return conditions
+
 
 @router.get("", response_model=schemas.PetList)
-def get_pets(db: Session = Depends(get_db)):
-    """Get all pets (not deleted)"""
-    pets = db.query(Pet).filter(Pet.is_deleted == 0).all()
-    return {"items": pets}
+def get_pets(
+    species: Optional[str] = None,
+    sex: Optional[str] = None,
+    born_from: Optional[date] = None,
+    born_to: Optional[date] = None,
+    name_prefix: Optional[str] = Query(None, min_length=1, max_length=100),
+    sort: PetSort = "id",
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Get a page of the user's pets (not deleted), filtered and sorted.
 
+    Every sort walks an index leading with (user_id, is_deleted) and a
+    name prefix is a range of idx_pets_user_name, so a page reads its
+    own rows from where the cursor left off, and never other users'.
+    Pass next_cursor as `cursor` for the following page.
+    """
+    query = db.query(Pet).filter(
+        Pet.user_id == user_id,
+        Pet.is_deleted == 0,
+        *pet_filters(species, sex, born_from, born_to, name_prefix),
+    )
+    total = query.count()
 
-@router.post("", response_model=schemas.ItemResponse, status_code=201)
-def create_pet(pet_data: schemas.PetCreate, db: Session = Depends(get_db)):
-    """Create a new pet"""
-    # Get default user (MVP: single user)
-    user = db.query(User).first()
-    if not user:
-        raise HTTPException(status_code=500, detail="No user found in system")
+    column, descending = SORT_COLUMNS[sort.lstrip("-")], sort.startswith("-")
+    if cursor:
+        position = decode_cursor(cursor, sort)
+        query = query.filter(after_cursor(column, descending, position))
+    order = (column.desc(), Pet.id.desc()) if descending else (column, Pet.id)
+    # One extra row tells whether there is a next page
+    pets = query.order_by(*order).limit(limit + 1).all()
 
+    items = [row_values(pet, Pet) for pet in pets[:limit]]
+    next_cursor = encode_cursor(sort, items[-1]) if len(pets) > limit else None
+    return {
+        "items": [pet_item(values) for values in items],
+        "total": total,
+        "limit": limit,
+        "next_cursor": next_cursor,
+    }
+
+
+@router.post("", response_model=schemas.ItemResponse, status_code=201)
+def create_pet(
+    pet_data: schemas.PetCreate,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Create a new pet of the user"""
     pet = Pet(
-        user_id=user.id,
+        user_id=user_id,
         name=pet_data.name,
         species=pet_data.species,
         sex=pet_data.sex,
@@ -35,6 +174,8 @@ def create_pet(pet_data: schemas.PetCreate, db: Session = Depends(get_db)):
         photo_url=pet_data.photo_url,
     )
     db.add(pet)
+    db.flush()
+    record_row_change(db, ENTITY_PET, pet, pet.id, OP_CREATE)
     db.commit()
     db.refresh(pet)
 
@@ -46,18 +187,23 @@ def create_pet(pet_data: schemas.PetCreate, db: Session = Depends(get_db)):
             "sex": pet.sex,
             "birth_date": pet.birth_date,
             "photo_url": pet.photo_url,
+            "photo_urls": photo_urls(pet.photo_url),
             "created_at": pet.created_at,
             "updated_at": pet.updated_at,
+            "version": pet.version,
         }
     }
 
 
 @router.get("/{pet_id}", response_model=schemas.ItemResponse)
-def get_pet(pet_id: int, db: Session = Depends(get_db)):
+def get_pet(
+    pet_id: int,
+    response: Response,
+    pet: Pet = Depends(owned_pet),
+    db: Session = Depends(get_db),
+):
     """Get pet by ID"""
-    pet = db.query(Pet).filter(Pet.id == pet_id, Pet.is_deleted == 0).first()
-    if not pet:
-        raise HTTPException(status_code=404, detail="Pet not found")
+    set_etag(response, pet.version)
 
     return {
         "item": {
@@ -67,26 +213,26 @@ def get_pet(pet_id: int, db: Session = Depends(get_db)):
             "sex": pet.sex,
             "birth_date": pet.birth_date,
             "photo_url": pet.photo_url,
+            "photo_urls": photo_urls(pet.photo_url),
             "created_at": pet.created_at,
             "updated_at": pet.updated_at,
+            "version": pet.version,
         }
     }
 
 
 @router.get("/{pet_id}/summary")
-def get_pet_summary(pet_id: int, db: Session = Depends(get_db)):
+def get_pet_summary(
+    pet_id: int,
+    pet: Pet = Depends(owned_pet),
+    db: Session = Depends(get_db),
+):
     """Get pet summary (dashboard data)"""
-    pet = db.query(Pet).filter(Pet.id == pet_id, Pet.is_deleted == 0).first()
-    if not pet:
-        raise HTTPException(status_code=404, detail="Pet not found")
-
     # Get latest vet visit
     latest_visit = (
         db.query(RecordVetVisit)
-        .join(Record, RecordVetVisit.record_id == Record.id)
         .filter(
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordVetVisit.pet_id == pet_id,
             RecordVetVisit.is_deleted == 0,
         )
         .order_by(RecordVetVisit.visited_on.desc())
@@ -106,10 +252,8 @@ def get_pet_summary(pet_id: int, db: Session = Depends(get_db)):
     # Get latest weight
     latest_weight = (
         db.query(RecordWeight)
-        .join(Record, RecordWeight.record_id == Record.id)
         .filter(
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordWeight.pet_id == pet_id,
             RecordWeight.is_deleted == 0,
         )
         .order_by(RecordWeight.measured_on.desc())
@@ -128,15 +272,10 @@ def get_pet_summary(pet_id: int, db: Session = Depends(get_db)):
     today = date.today()
     active_medications = (
         db.query(RecordMedication)
-        .join(Record, RecordMedication.record_id == Record.id)
         .filter(
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordMedication.pet_id == pet_id,
             RecordMedication.is_deleted == 0,
-            or_(
-                RecordMedication.end_on >= today,
-                RecordMedication.end_on.is_(None),
-            ),
+            RecordMedication.end_on_effective >= today,
         )
         .order_by(RecordMedication.start_on.desc())
         .all()
@@ -161,6 +300,7 @@ def get_pet_summary(pet_id: int, db: Session = Depends(get_db)):
             "pet_id": pet_id,
             "vet_visit_last": vet_visit_last,
             "weight_last": weight_last,
+            "weight_trend": trend_item(db, pet_id),
             "medication_active": medication_active,
         }
     }
@@ -168,12 +308,15 @@ def get_pet_summary(pet_id: int, db: Session = Depends(get_db)):
 
 @router.put("/{pet_id}", response_model=schemas.ItemResponse)
 def update_pet(
-    pet_id: int, pet_data: schemas.PetUpdate, db: Session = Depends(get_db)
+    pet_id: int,
+    pet_data: schemas.PetUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    pet: Pet = Depends(owned_pet),
+    db: Session = Depends(get_db),
 ):
     """Update pet"""
-    pet = db.query(Pet).filter(Pet.id == pet_id, Pet.is_deleted == 0).first()
-    if not pet:
-        raise HTTPException(status_code=404, detail="Pet not found")
+    check_version(pet, parse_if_match(if_match))
 
     pet.name = pet_data.name
     pet.species = pet_data.species
@@ -181,8 +324,14 @@ def update_pet(
     pet.birth_date = pet_data.birth_date
     pet.photo_url = pet_data.photo_url
 
-    db.commit()
+    try:
+        record_row_change(db, ENTITY_PET, pet, pet.id, OP_UPDATE)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
     db.refresh(pet)
+    set_etag(response, pet.version)
 
     return {
         "item": {
@@ -192,20 +341,81 @@ def update_pet(
             "sex": pet.sex,
             "birth_date": pet.birth_date,
             "photo_url": pet.photo_url,
+            "photo_urls": photo_urls(pet.photo_url),
             "created_at": pet.created_at,
             "updated_at": pet.updated_at,
+            "version": pet.version,
         }
     }
 
 
+def pet_item(values: dict) -> dict:
+    """Build the pet response item from column values"""
+    return {
+        "id": values["id"],
+        "name": values["name"],
+        "species": values["species"],
+        "sex": values["sex"],
+        "birth_date": values["birth_date"],
+        "photo_url": values["photo_url"],
+        "photo_urls": photo_urls(values["photo_url"]),
+        "created_at": values["created_at"],
+        "updated_at": values["updated_at"],
+        "version": values["version"],
+    }
+
+
+@router.patch("/{pet_id}", response_model=schemas.ItemResponse)
+def patch_pet(
+    pet_id: int,
+    pet_data: schemas.PetPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Partially update pet (JSON merge patch)"""
+    changes = pet_data.model_dump(exclude_unset=True)
+    criteria = [Pet.id == pet_id, Pet.user_id == user_id, Pet.is_deleted == 0]
+    expected_version = parse_if_match(if_match)
+
+    try:
+        values = patch_row(db, Pet, criteria, changes, expected_version)
+        if values is not None and changes:
+            record_change(
+                db, ENTITY_PET, pet_id, pet_id, OP_UPDATE, values["version"]
+            )
+            db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if values is None:
+        raise HTTPException(status_code=404, detail="Pet not found")
+
+    set_etag(response, values["version"])
+    return {"item": pet_item(values)}
+
+
 @router.delete("/{pet_id}", status_code=204)
-def delete_pet(pet_id: int, db: Session = Depends(get_db)):
+def delete_pet(
+    pet_id: int,
+    if_match: Optional[str] = Header(None),
+    pet: Pet = Depends(owned_pet),
+    db: Session = Depends(get_db),
+):
     """Logical delete of pet"""
-    pet = db.query(Pet).filter(Pet.id == pet_id, Pet.is_deleted == 0).first()
-    if not pet:
-        raise HTTPException(status_code=404, detail="Pet not found")
+    check_version(pet, parse_if_match(if_match))
 
-    pet.is_deleted = 1
-    db.commit()
+    try:
+        soft_delete_pet(db, pet)
+        record_row_change(db, ENTITY_PET, pet, pet.id, OP_DELETE)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
 
     return None
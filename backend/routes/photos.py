@@ -0,0 +1,141 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from typing import Optional
+
+from database import get_db
+from services.auth import current_user_id, owned_pet
+from models import Pet
+from services.outbox import record_change, ENTITY_PET, OP_UPDATE
+from services.patching import patch_row
+from services.photos import (
+    MEDIA_TYPES,
+    PHOTO_NAME,
+    PHOTO_URL_PREFIX,
+    photo_key,
+    receive_photo,
+    schedule_variants,
+)
+from services.storage import get_storage
+from services.concurrency import (
+    parse_if_match,
+    check_version,
+    set_etag,
+    version_conflict,
+)
+from routes.pets import pet_item
+import schemas
+
+router = APIRouter(tags=["photos"])
+
+# Photo names are content hashes, so a name's bytes never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Served in place of a variant that is still being rendered
+PENDING_CACHE_CONTROL = "no-cache"
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def set_pet_photo(
+    db: Session,
+    pet_id: int,
+    user_id: int,
+    name: str,
+    expected_version: Optional[int],
+) -> dict:
+    """Point the pet's photo_url at an uploaded photo"""
+    criteria = [Pet.id == pet_id, Pet.user_id == user_id, Pet.is_deleted == 0]
+    changes = {"photo_url": PHOTO_URL_PREFIX + name}
+    try:
+        values = patch_row(db, Pet, criteria, changes, expected_version)
+        if values is not None:
+            record_change(
+                db, ENTITY_PET, pet_id, pet_id, OP_UPDATE, values["version"]
+            )
+            db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+
+    if values is None:
+        raise HTTPException(status_code=404, detail="Pet not found")
+    return values
+
+
+@router.put("/pets/{pet_id}/photo", response_model=schemas.ItemResponse)
+async def upload_pet_photo(
+    pet_id: int,
+    request: Request,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    # Resolved before the body is read, so failed requests store nothing
+    pet: Pet = Depends(owned_pet),
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db),
+):
+    """Upload the pet's photo as the raw request body (JPEG, PNG or WebP).
+
+    The body is streamed to storage; thumbnails are rendered afterwards
+    and listed in the pet's photo_urls.
+    """
+    expected_version = parse_if_match(if_match)
+    check_version(pet, expected_version)
+
+    name = await receive_photo(request)
+    values = await run_in_threadpool(
+        set_pet_photo, db, pet_id, user_id, name, expected_version
+    )
+    await run_in_threadpool(schedule_variants, name)
+
+    set_etag(response, values["version"])
+    return {"item": pet_item(values)}
+
+
+def stream_object(key: str):
+    with get_storage().open_object(key) as file:
+        while chunk := file.read(STREAM_CHUNK_BYTES):
+            yield chunk
+
+
+def object_response(key: str, name: str, cache_control: str) -> Response:
+    """The stored object, sent straight from disk when the storage is local"""
+    headers = {"Cache-Control": cache_control, "ETag": f'"{name}"'}
+    media_type = MEDIA_TYPES[PHOTO_NAME.match(name)["ext"]]
+    path = get_storage().local_path(key)
+    if path is not None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    return StreamingResponse(
+        stream_object(key), media_type=media_type, headers=headers
+    )
+
+
+@router.get("/photos/{name}")
+def get_photo(name: str, if_none_match: Optional[str] = Header(None)):
+    """Get a photo or one of its variants by its content-hash name.
+
+    Unauthenticated, so <img> tags can load it: a name is the SHA-256 of
+    the photo and cannot be guessed without having the photo.
+    """
+    match = PHOTO_NAME.match(name)
+    if not match:
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    storage = get_storage()
+    if storage.head_object(photo_key(name)) is not None:
+        if if_none_match == f'"{name}"':
+            headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": if_none_match}
+            return Response(status_code=304, headers=headers)
+        return object_response(photo_key(name), name, IMMUTABLE_CACHE_CONTROL)
+
+    if match["variant"]:
+        # Not rendered yet: fall back to the original without caching it
+        for extension in MEDIA_TYPES:
+            original = f"{match['digest']}.{extension}"
+            if storage.head_object(photo_key(original)) is not None:
+                return object_response(
+                    photo_key(original), original, PENDING_CACHE_CONTROL
+                )
+
+    raise HTTPException(status_code=404, detail="Photo not found")
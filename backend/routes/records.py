@@ -1,21 +1,75 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
 from sqlalchemy.orm import Session
-from typing import Optional
-from datetime import date
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from typing import List, Optional, Tuple
+from datetime import date, datetime
 
 from database import get_db
-from models import Pet, Record, RecordWeight, RecordMedication, RecordVetVisit
+from services.auth import owned_pet
+from models import (
+    Record,
+    RecordWeight,
+    RecordMedication,
+    RecordVetVisit,
+    VetVisitAttachment,
+)
+from services.outbox import (
+    record_change,
+    record_row_change,
+    record_row_changes,
+    ENTITY_RECORD,
+    ENTITY_WEIGHT,
+    ENTITY_MEDICATION,
+    ENTITY_VET_VISIT,
+    OP_CREATE,
+    OP_UPDATE,
+    OP_DELETE,
+)
+from services.soft_delete import (
+    mark_deleted,
+    soft_delete_attachments,
+    soft_delete_record,
+)
+from services.patching import patch_row
+from services.records import is_duplicate_day, resolve_daily_record
+from services.dose_calendar import rebuild_doses
+from services.vet_costs import apply_visit_costs, visit_cost, VisitCost
+from services.weight_trends import recompute_pet
+from services.concurrency import (
+    parse_if_match,
+    check_version,
+    set_etag,
+    version_conflict,
+)
 import schemas
 
-router = APIRouter(prefix="/pets/{pet_id}/records", tags=["records"])
+router = APIRouter(
+    prefix="/pets/{pet_id}/records",
+    tags=["records"],
+    dependencies=[Depends(owned_pet)],
+)
 
+DUPLICATE_DAY_DETAIL = "A record already exists for this date"
 
-def verify_pet_exists(pet_id: int, db: Session) -> Pet:
-    """Verify pet exists and is not deleted"""
-    pet = db.query(Pet).filter(Pet.id == pet_id, Pet.is_deleted == 0).first()
-    if not pet:
-        raise HTTPException(status_code=404, detail="Pet not found")
-    return pet
+
+def medication_ids(changes: List[Tuple[str, object, str]]) -> List[int]:
+    """Ids of the medications touched by a record write"""
+    return [row.id for entity, row, _ in changes if entity == ENTITY_MEDICATION]
+
+
+def touches_weights(changes: List[Tuple[str, object, str]]) -> bool:
+    """Whether a record write created, changed or deleted any weight"""
+    return any(entity == ENTITY_WEIGHT for entity, _, _ in changes)
+
+
+def live_visit_costs(changes: List[Tuple[str, object, str]]) -> List[VisitCost]:
+    """Costs of the vet visits a record write left live"""
+    return [
+        visit_cost(row)
+        for entity, row, op in changes
+        if entity == ENTITY_VET_VISIT and op != OP_DELETE
+    ]
 
 
 @router.get("", response_model=schemas.RecordList)
@@ -28,8 +82,6 @@ def get_records(
     db: Session = Depends(get_db),
 ):
     """Get records for a pet"""
-    verify_pet_exists(pet_id, db)
-
     query = db.query(Record).filter(Record.pet_id == pet_id, Record.is_deleted == 0)
 
     if from_date:
@@ -52,6 +104,7 @@ def get_records(
                 has_medications=len(record.medications) > 0,
                 has_vet_visits=len(record.vet_visits) > 0,
                 updated_at=record.updated_at,
+                version=record.version,
             )
         )
 
@@ -60,74 +113,110 @@ def get_records(
 
 @router.post("", response_model=schemas.IdResponse, status_code=201)
 def create_record(
-    pet_id: int, record_data: schemas.RecordCreate, db: Session = Depends(get_db)
+    pet_id: int,
+    record_data: schemas.RecordCreate,
+    db: Session = Depends(get_db),
 ):
-    """Create a new record with child elements"""
-    verify_pet_exists(pet_id, db)
+    """Create a new record with child elements.
 
+    A pet has one live record per day: posting for a day that already has
+    one adds the children to it and overwrites the condition/note given.
+    """
     try:
-        # Create parent record
-        record = Record(
-            pet_id=pet_id,
-            recorded_on=record_data.recorded_on,
-            condition=record_data.condition,
-            note=record_data.note,
-        )
-        db.add(record)
-        db.flush()
+        record_id = resolve_daily_record(db, pet_id, record_data.recorded_on)
+        fields = {
+            name: value
+            for name, value in (
+                ("condition", record_data.condition),
+                ("note", record_data.note),
+            )
+            if value is not None
+        }
+        if fields:
+            db.query(Record).filter(Record.id == record_id).update(
+                fields, synchronize_session=False
+            )
+            record_change(db, ENTITY_RECORD, record_id, pet_id, OP_UPDATE)
+        changes = []
 
         # Create child weights
         for weight_data in record_data.weights:
             weight = RecordWeight(
-                record_id=record.id,
+                record_id=record_id,
+                pet_id=pet_id,
                 measured_on=weight_data.measured_on,
                 weight_kg=weight_data.weight_kg,
                 note=weight_data.note,
             )
             db.add(weight)
+            changes.append((ENTITY_WEIGHT, weight, OP_CREATE))
 
         # Create child medications
         for med_data in record_data.medications:
             medication = RecordMedication(
-                record_id=record.id,
+                record_id=record_id,
+                pet_id=pet_id,
                 name=med_data.name,
                 dosage=med_data.dosage,
                 frequency=med_data.frequency,
+                interval_days=med_data.interval_days,
+                times_per_day=med_data.times_per_day,
+                days_of_week=med_data.days_of_week,
                 start_on=med_data.start_on,
                 end_on=med_data.end_on,
                 note=med_data.note,
             )
             db.add(medication)
+            changes.append((ENTITY_MEDICATION, medication, OP_CREATE))
 
         # Create child vet visits
         for visit_data in record_data.vet_visits:
             visit = RecordVetVisit(
-                record_id=record.id,
+                record_id=record_id,
+                pet_id=pet_id,
                 visited_on=visit_data.visited_on,
                 hospital_name=visit_data.hospital_name,
                 doctor_name=visit_data.doctor_name,
                 chief_complaint=visit_data.chief_complaint,
                 diagnosis=visit_data.diagnosis,
                 cost_yen=visit_data.cost_yen,
+                next_visit_on=visit_data.next_visit_on,
                 note=visit_data.note,
             )
             db.add(visit)
+            changes.append((ENTITY_VET_VISIT, visit, OP_CREATE))
+
+        record_row_changes(db, changes, pet_id)
+        rebuild_doses(db, medication_ids(changes))
+        apply_visit_costs(db, [], live_visit_costs(changes))
+        if touches_weights(changes):
+            recompute_pet(db, pet_id)
 
         db.commit()
-        db.refresh(record)
 
-        return {"id": record.id}
+        return {"id": record_id}
 
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+    except IntegrityError as e:
+        db.rollback()
+        if is_duplicate_day(e):
+            raise HTTPException(status_code=409, detail=DUPLICATE_DAY_DETAIL)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/{record_id}", response_model=schemas.Record)
-def get_record(pet_id: int, record_id: int, db: Session = Depends(get_db)):
+def get_record(
+    pet_id: int,
+    record_id: int,
+    response: Response,
+    db: Session = Depends(get_db),
+):
     """Get record detail with child elements"""
-    verify_pet_exists(pet_id, db)
-
     record = (
         db.query(Record)
         .filter(
@@ -138,6 +227,7 @@ def get_record(pet_id: int, record_id: int, db: Session = Depends(get_db)):
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
 
+    set_etag(response, record.version)
     return record
 
 
@@ -146,11 +236,11 @@ def update_record(
     pet_id: int,
     record_id: int,
     record_data: schemas.RecordUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
 ):
     """Update record with child elements (replacement strategy)"""
-    verify_pet_exists(pet_id, db)
-
     record = (
         db.query(Record)
         .filter(
@@ -160,21 +250,28 @@ def update_record(
     )
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
+    check_version(record, parse_if_match(if_match))
 
     try:
+        old_costs = [visit_cost(visit) for visit in record.vet_visits]
+
         # Update parent record
         record.recorded_on = record_data.recorded_on
         record.condition = record_data.condition
         record.note = record_data.note
+        # Always write the record so its version is checked and bumped
+        record.updated_at = datetime.utcnow()
+        changes = [(ENTITY_RECORD, record, OP_UPDATE)]
 
         # Update weights (replacement strategy)
         existing_weight_ids = {w.id for w in record.weights}
         incoming_weight_ids = {w.id for w in record_data.weights if w.id}
 
-        # Delete weights not in incoming data
+        # Logically delete weights not in incoming data
         for weight in record.weights:
             if weight.id not in incoming_weight_ids:
-                db.delete(weight)
+                mark_deleted(weight)
+                changes.append((ENTITY_WEIGHT, weight, OP_DELETE))
 
         # Update or create weights
         for weight_data in record_data.weights:
@@ -186,15 +283,18 @@ def update_record(
                 weight.measured_on = weight_data.measured_on
                 weight.weight_kg = weight_data.weight_kg
                 weight.note = weight_data.note
+                changes.append((ENTITY_WEIGHT, weight, OP_UPDATE))
             else:
                 # Create new
                 weight = RecordWeight(
                     record_id=record.id,
+                    pet_id=pet_id,
                     measured_on=weight_data.measured_on,
                     weight_kg=weight_data.weight_kg,
                     note=weight_data.note,
                 )
                 db.add(weight)
+                changes.append((ENTITY_WEIGHT, weight, OP_CREATE))
 
         # Update medications (replacement strategy)
         existing_med_ids = {m.id for m in record.medications}
@@ -202,7 +302,8 @@ def update_record(
 
         for medication in record.medications:
             if medication.id not in incoming_med_ids:
-                db.delete(medication)
+                mark_deleted(medication)
+                changes.append((ENTITY_MEDICATION, medication, OP_DELETE))
 
         for med_data in record_data.medications:
             if med_data.id and med_data.id in existing_med_ids:
@@ -214,20 +315,29 @@ def update_record(
                 medication.name = med_data.name
                 medication.dosage = med_data.dosage
                 medication.frequency = med_data.frequency
+                medication.interval_days = med_data.interval_days
+                medication.times_per_day = med_data.times_per_day
+                medication.days_of_week = med_data.days_of_week
                 medication.start_on = med_data.start_on
                 medication.end_on = med_data.end_on
                 medication.note = med_data.note
+                changes.append((ENTITY_MEDICATION, medication, OP_UPDATE))
             else:
                 medication = RecordMedication(
                     record_id=record.id,
+                    pet_id=pet_id,
                     name=med_data.name,
                     dosage=med_data.dosage,
                     frequency=med_data.frequency,
+                    interval_days=med_data.interval_days,
+                    times_per_day=med_data.times_per_day,
+                    days_of_week=med_data.days_of_week,
                     start_on=med_data.start_on,
                     end_on=med_data.end_on,
                     note=med_data.note,
                 )
                 db.add(medication)
+                changes.append((ENTITY_MEDICATION, medication, OP_CREATE))
 
         # Update vet visits (replacement strategy)
         existing_visit_ids = {v.id for v in record.vet_visits}
@@ -235,7 +345,11 @@ def update_record(
 
         for visit in record.vet_visits:
             if visit.id not in incoming_visit_ids:
-                db.delete(visit)
+                mark_deleted(visit)
+                soft_delete_attachments(
+                    db, VetVisitAttachment.vet_visit_id == visit.id
+                )
+                changes.append((ENTITY_VET_VISIT, visit, OP_DELETE))
 
         for visit_data in record_data.vet_visits:
             if visit_data.id and visit_data.id in existing_visit_ids:
@@ -250,34 +364,102 @@ def update_record(
                 visit.chief_complaint = visit_data.chief_complaint
                 visit.diagnosis = visit_data.diagnosis
                 visit.cost_yen = visit_data.cost_yen
+                visit.next_visit_on = visit_data.next_visit_on
                 visit.note = visit_data.note
+                changes.append((ENTITY_VET_VISIT, visit, OP_UPDATE))
             else:
                 visit = RecordVetVisit(
                     record_id=record.id,
+                    pet_id=pet_id,
                     visited_on=visit_data.visited_on,
                     hospital_name=visit_data.hospital_name,
                     doctor_name=visit_data.doctor_name,
                     chief_complaint=visit_data.chief_complaint,
                     diagnosis=visit_data.diagnosis,
                     cost_yen=visit_data.cost_yen,
+                    next_visit_on=visit_data.next_visit_on,
                     note=visit_data.note,
                 )
                 db.add(visit)
+                changes.append((ENTITY_VET_VISIT, visit, OP_CREATE))
+
+        record_row_changes(db, changes, pet_id)
+        rebuild_doses(db, medication_ids(changes))
+        apply_visit_costs(db, old_costs, live_visit_costs(changes))
+        if touches_weights(changes):
+            recompute_pet(db, pet_id)
+        version = record.version
 
         db.commit()
+        set_etag(response, version)
 
         return {"id": record.id}
 
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+    except IntegrityError as e:
+        db.rollback()
+        if is_duplicate_day(e):
+            raise HTTPException(status_code=409, detail=DUPLICATE_DAY_DETAIL)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.patch("/{record_id}", response_model=schemas.IdResponse)
+def patch_record(
+    pet_id: int,
+    record_id: int,
+    record_data: schemas.RecordPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Partially update record fields (JSON merge patch, children untouched)"""
+    changes = record_data.model_dump(exclude_unset=True)
+    criteria = [
+        Record.id == record_id,
+        Record.pet_id == pet_id,
+        Record.is_deleted == 0,
+    ]
+    expected_version = parse_if_match(if_match)
+
+    try:
+        values = patch_row(db, Record, criteria, changes, expected_version)
+        if values is not None and changes:
+            record_change(
+                db, ENTITY_RECORD, record_id, pet_id, OP_UPDATE, values["version"]
+            )
+            db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+    except IntegrityError as e:
+        db.rollback()
+        if is_duplicate_day(e):
+            raise HTTPException(status_code=409, detail=DUPLICATE_DAY_DETAIL)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if values is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+
+    set_etag(response, values["version"])
+    return {"id": record_id}
+
+
 @router.delete("/{record_id}", status_code=204)
-def delete_record(pet_id: int, record_id: int, db: Session = Depends(get_db)):
+def delete_record(
+    pet_id: int,
+    record_id: int,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
     """Logical delete of record"""
-    verify_pet_exists(pet_id, db)
-
     record = (
         db.query(Record)
         .filter(
@@ -288,7 +470,14 @@ def delete_record(pet_id: int, record_id: int, db: Session = Depends(get_db)):
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
 
-    record.is_deleted = 1
-    db.commit()
+    check_version(record, parse_if_match(if_match))
+
+    try:
+        soft_delete_record(db, record)
+        record_row_change(db, ENTITY_RECORD, record, pet_id, OP_DELETE)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
 
     return None
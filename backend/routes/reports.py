@@ -0,0 +1,119 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from database import get_db
+from services.auth import owned_pet
+from models import ReportJob
+from services.reports import STATUS_DONE, enqueue_report
+from services.storage import get_storage
+import schemas
+
+router = APIRouter(
+    prefix="/pets/{pet_id}/reports",
+    tags=["reports"],
+    dependencies=[Depends(owned_pet)],
+)
+
+REPORT_MEDIA_TYPE = "text/html; charset=utf-8"
+# Medical history: cacheable by the owner's browser only
+REPORT_CACHE_CONTROL = "private, max-age=86400"
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def load_report(db: Session, pet_id: int, report_id: int) -> ReportJob:
+    job = (
+        db.query(ReportJob)
+        .filter(ReportJob.id == report_id, ReportJob.pet_id == pet_id)
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return job
+
+
+def report_url(job: ReportJob) -> str:
+    return f"/api/pets/{job.pet_id}/reports/{job.id}"
+
+
+def report_item(job: ReportJob) -> dict:
+    """Build the report response item"""
+    return {
+        "id": job.id,
+        "pet_id": job.pet_id,
+        "status": job.status,
+        "from_date": job.from_date,
+        "to_date": job.to_date,
+        "size_bytes": job.size_bytes,
+        "error": job.error,
+        "download_url": (
+            report_url(job) + "/content" if job.status == STATUS_DONE else None
+        ),
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+@router.post("", response_model=schemas.Report, status_code=202)
+def create_report(
+    pet_id: int,
+    response: Response,
+    report_data: Optional[schemas.ReportCreate] = None,
+    db: Session = Depends(get_db),
+):
+    """Request the pet's printable report, built in the background.
+
+    Answers 202 with the queued job, or 200 with an existing job when
+    an identical report of unchanged data was already requested. Poll
+    the Location until status is done, then fetch download_url.
+    """
+    report_data = report_data or schemas.ReportCreate()
+    from_date, to_date = report_data.from_date, report_data.to_date
+    if from_date and to_date and to_date < from_date:
+        raise HTTPException(
+            status_code=400, detail="'to_date' must not be before 'from_date'"
+        )
+
+    job, created = enqueue_report(db, pet_id, from_date, to_date)
+    if not created:
+        response.status_code = 200
+    response.headers["Location"] = report_url(job)
+    return report_item(job)
+
+
+@router.get("/{report_id}", response_model=schemas.Report)
+def get_report(
+    pet_id: int,
+    report_id: int,
+    db: Session = Depends(get_db),
+):
+    """Get a report job's status"""
+    return report_item(load_report(db, pet_id, report_id))
+
+
+def stream_object(key: str):
+    with get_storage().open_object(key) as file:
+        while chunk := file.read(STREAM_CHUNK_BYTES):
+            yield chunk
+
+
+@router.get("/{report_id}/content")
+def download_report(
+    pet_id: int,
+    report_id: int,
+    db: Session = Depends(get_db),
+):
+    """Download a finished report as HTML (409 until it is done)"""
+    job = load_report(db, pet_id, report_id)
+    if job.status != STATUS_DONE:
+        raise HTTPException(status_code=409, detail=f"Report is {job.status}")
+
+    headers = {"Cache-Control": REPORT_CACHE_CONTROL, "ETag": f'"{job.cache_key}"'}
+    path = get_storage().local_path(job.result_key)
+    if path is not None:
+        return FileResponse(path, media_type=REPORT_MEDIA_TYPE, headers=headers)
+    return StreamingResponse(
+        stream_object(job.result_key), media_type=REPORT_MEDIA_TYPE, headers=headers
+    )
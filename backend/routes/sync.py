@@ -0,0 +1,121 @@
+import base64
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from typing import List, NamedTuple, Optional
+from datetime import datetime, timedelta, timezone
+
+from database import get_db
+from services.auth import owned_pet
+from models import Record, RecordWeight, RecordMedication, RecordVetVisit
+import schemas
+
+router = APIRouter(
+    prefix="/pets/{pet_id}/sync",
+    tags=["sync"],
+    dependencies=[Depends(owned_pet)],
+)
+
+# Rows committed slightly after a sync may carry an earlier updated_at than
+# the newest row returned, so the next token is held back by this window.
+# Clients receive rows in the window again and must upsert them by id.
+SYNC_SAFETY_WINDOW = timedelta(seconds=5)
+
+
+class SyncToken(NamedTuple):
+    """Position after the last row synced, in (updated_at, id) order"""
+
+    updated_at: datetime
+    id: int
+
+
+def encode_token(token: SyncToken) -> str:
+    raw = f"{token.updated_at.isoformat()}|{token.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_token(token: str) -> SyncToken:
+    try:
+        raw = base64.urlsafe_b64decode(token.encode()).decode()
+        updated_at, row_id = raw.split("|")
+        return SyncToken(datetime.fromisoformat(updated_at), int(row_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+def parse_since(since: str) -> SyncToken:
+    """Read `since` as an ISO timestamp (UTC if naive) or as a token.
+
+    A timestamp means every row changed after it: (timestamp, 0).
+    """
+    try:
+        moment = datetime.fromisoformat(since)
+    except ValueError:
+        return decode_token(since)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return SyncToken(moment, 0)
+
+
+def changed_rows(db: Session, model, pet_id: int, since: Optional[SyncToken]) -> List:
+    """Get rows of a table changed after the token, tombstones included.
+
+    Strictly after (updated_at, id), so a sync without changes is empty;
+    the (pet_id, updated_at) index ends with the primary key and serves
+    the id tie-break too.
+    """
+    query = db.query(model).filter(model.pet_id == pet_id)
+    if since:
+        query = query.filter(
+            or_(
+                model.updated_at > since.updated_at,
+                and_(model.updated_at == since.updated_at, model.id > since.id),
+            )
+        )
+    return query.order_by(model.updated_at, model.id).all()
+
+
+def next_token(
+    rows: List, since: Optional[SyncToken], started_at: datetime
+) -> Optional[SyncToken]:
+    """Compute the token the client should send on its next sync"""
+    if not rows:
+        return since
+
+    # Ids only break ties within one updated_at, across tables too: the
+    # newest row with the highest id sorts after every row returned
+    newest = max(SyncToken(row.updated_at, row.id) for row in rows)
+    held_back = SyncToken(started_at - SYNC_SAFETY_WINDOW, 0)
+    token = min(newest, held_back)
+    if since and token < since:
+        return since
+    return token
+
+
+@router.get("", response_model=schemas.SyncResponse)
+def get_sync(
+    pet_id: int,
+    since: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Get records and child rows changed since the token (incl. deleted).
+
+    `since` is the opaque `next_since` of the previous sync, or an ISO
+    timestamp for a first sync from a known point in time.
+    """
+    started_at = datetime.utcnow()
+    after = parse_since(since) if since else None
+
+    records = changed_rows(db, Record, pet_id, after)
+    weights = changed_rows(db, RecordWeight, pet_id, after)
+    medications = changed_rows(db, RecordMedication, pet_id, after)
+    vet_visits = changed_rows(db, RecordVetVisit, pet_id, after)
+    token = next_token(records + weights + medications + vet_visits, after, started_at)
+
+    return {
+        "records": records,
+        "weights": weights,
+        "medications": medications,
+        "vet_visits": vet_visits,
+        "next_since": encode_token(token) if token else None,
+    }
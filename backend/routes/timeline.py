@@ -0,0 +1,184 @@
+import base64
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import Integer, and_, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+from typing import Dict, List, NamedTuple, Optional
+from datetime import date
+
+from database import get_db
+from services.auth import owned_pet
+from models import Record, RecordWeight, RecordMedication, RecordVetVisit
+from services.patching import row_values
+from routes.weights import weight_item
+from routes.medications import medication_item
+from routes.vet_visits import vet_visit_item
+import schemas
+
+router = APIRouter(
+    prefix="/pets/{pet_id}/timeline",
+    tags=["timeline"],
+    dependencies=[Depends(owned_pet)],
+)
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class Stream(NamedTuple):
+    type: str
+    model: type
+    date_column: object
+    build_item: object
+
+
+def record_item(values: dict, pet_id: int) -> dict:
+    """Build the timeline item of a record's own condition/note"""
+    return {
+        "id": values["id"],
+        "pet_id": pet_id,
+        "recorded_on": values["recorded_on"],
+        "condition": values["condition"],
+        "note": values["note"],
+        "updated_at": values["updated_at"],
+        "version": values["version"],
+    }
+
+
+# Entries are ordered by (date, rank, id), newest first; the rank is the
+# stream's index, so on the same day a record comes first, medications last
+STREAMS = (
+    Stream(
+        "medication", RecordMedication, RecordMedication.start_on, medication_item
+    ),
+    Stream("weight", RecordWeight, RecordWeight.measured_on, weight_item),
+    Stream("vet_visit", RecordVetVisit, RecordVetVisit.visited_on, vet_visit_item),
+    Stream("record", Record, Record.recorded_on, record_item),
+)
+
+
+class Cursor(NamedTuple):
+    on: date
+    rank: int
+    id: int
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    raw = f"{cursor.on.isoformat()}|{cursor.rank}|{cursor.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token: str) -> Cursor:
+    try:
+        raw = base64.urlsafe_b64decode(token.encode()).decode()
+        on, rank, row_id = raw.split("|")
+        cursor = Cursor(date.fromisoformat(on), int(rank), int(row_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not 0 <= cursor.rank < len(STREAMS):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return cursor
+
+
+def after_cursor(stream: Stream, rank: int, cursor: Cursor):
+    """Keyset condition for one stream, with its constant rank folded in"""
+    day, row_id = stream.date_column, stream.model.id
+    if rank < cursor.rank:
+        return day <= cursor.on
+    if rank > cursor.rank:
+        return day < cursor.on
+    return or_(day < cursor.on, and_(day == cursor.on, row_id < cursor.id))
+
+
+def stream_page(
+    rank: int,
+    stream: Stream,
+    pet_id: int,
+    cursor: Optional[Cursor],
+    from_date: Optional[date],
+    to_date: Optional[date],
+    limit: int,
+):
+    """The next `limit` entries of one stream, read along its date index"""
+    model, day = stream.model, stream.date_column
+    query = select(
+        literal(rank, Integer).label("rank"),
+        model.id.label("id"),
+        day.label("entry_on"),
+    ).where(model.pet_id == pet_id, model.is_deleted == 0)
+    if model is Record:
+        # A record's children have entries of their own
+        query = query.where(
+            or_(Record.condition.isnot(None), Record.note.isnot(None))
+        )
+    if from_date:
+        query = query.where(day >= from_date)
+    if to_date:
+        query = query.where(day <= to_date)
+    if cursor:
+        query = query.where(after_cursor(stream, rank, cursor))
+    page = query.order_by(day.desc(), model.id.desc()).limit(limit).subquery()
+    return select(page.c.rank, page.c.id, page.c.entry_on)
+
+
+def load_items(db: Session, pet_id: int, rows: List) -> List[dict]:
+    """Full items of the page's entries, one IN query per stream"""
+    ids_by_rank: Dict[int, List[int]] = {}
+    for row in rows:
+        ids_by_rank.setdefault(row.rank, []).append(row.id)
+
+    items: Dict[tuple, dict] = {}
+    for rank, ids in ids_by_rank.items():
+        stream = STREAMS[rank]
+        for found in db.query(stream.model).filter(stream.model.id.in_(ids)):
+            values = row_values(found, stream.model)
+            items[(rank, found.id)] = stream.build_item(values, pet_id)
+
+    return [
+        {
+            "type": STREAMS[row.rank].type,
+            "date": row.entry_on,
+            "item": items[(row.rank, row.id)],
+        }
+        for row in rows
+    ]
+
+
+@router.get("", response_model=schemas.TimelinePage)
+def get_timeline(
+    pet_id: int,
+    cursor: Optional[str] = None,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    """Get records, vet visits, weights and medications as one timeline.
+
+    The four date-ordered streams are merged by a single UNION ALL whose
+    branches each read at most limit + 1 rows from their (pet_id, date)
+    index; paging continues from the opaque `next_cursor`.
+    """
+    after = decode_cursor(cursor) if cursor else None
+
+    branches = [
+        stream_page(rank, stream, pet_id, after, from_date, to_date, limit + 1)
+        for rank, stream in enumerate(STREAMS)
+    ]
+    merged = union_all(*branches).subquery()
+    rows = db.execute(
+        select(merged.c.rank, merged.c.id, merged.c.entry_on)
+        .order_by(merged.c.entry_on.desc(), merged.c.rank.desc(), merged.c.id.desc())
+        .limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(Cursor(last.entry_on, last.rank, last.id))
+
+    return {
+        "items": load_items(db, pet_id, rows),
+        "limit": limit,
+        "next_cursor": next_cursor,
+    }
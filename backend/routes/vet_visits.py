@@ -1,42 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy import and_
 from typing import Optional
 from datetime import date
 
 from database import get_db
-from models import Pet, Record, RecordVetVisit
+from services.auth import owned_pet
+from models import RecordVetVisit, VetVisitAttachment
+from services.outbox import (
+    record_change,
+    record_row_change,
+    ENTITY_VET_VISIT,
+    OP_CREATE,
+    OP_UPDATE,
+    OP_DELETE,
+)
+from services.soft_delete import mark_deleted, soft_delete_attachments
+from services.patching import patch_row, pin_version, row_values
+from services.vet_costs import (
+    apply_visit_costs,
+    versioned_visit_cost,
+    visit_cost,
+    COST_FIELDS,
+)
+from services.records import touch_record, resolve_daily_record
+from services.concurrency import (
+    parse_if_match,
+    check_version,
+    set_etag,
+    version_conflict,
+)
 import schemas
 
-router = APIRouter(prefix="/pets/{pet_id}/vet-visits", tags=["vet_visits"])
+router = APIRouter(
+    prefix="/pets/{pet_id}/vet-visits",
+    tags=["vet_visits"],
+    dependencies=[Depends(owned_pet)],
+)
 
 
-def verify_pet_exists(pet_id: int, db: Session) -> Pet:
-    """Verify pet exists and is not deleted"""
-    pet = db.query(Pet).filter(Pet.id == pet_id, Pet.is_deleted == 0).first()
-    if not pet:
-        raise HTTPException(status_code=404, detail="Pet not found")
-    return pet
-
-
-def get_or_create_record(pet_id: int, visited_on: date, db: Session) -> Record:
-    """Get or create a record for the given date"""
-    record = (
-        db.query(Record)
-        .filter(
-            Record.pet_id == pet_id,
-            Record.recorded_on == visited_on,
-            Record.is_deleted == 0,
-        )
-        .first()
-    )
-
-    if not record:
-        record = Record(pet_id=pet_id, recorded_on=visited_on)
-        db.add(record)
-        db.flush()
-
-    return record
+def vet_visit_item(values: dict, pet_id: int) -> dict:
+    """Build the vet visit response item from column values"""
+    return {
+        "id": values["id"],
+        "pet_id": pet_id,
+        "visited_on": values["visited_on"],
+        "hospital_name": values["hospital_name"],
+        "doctor_name": values["doctor_name"],
+        "chief_complaint": values["chief_complaint"],
+        "diagnosis": values["diagnosis"],
+        "cost_yen": values["cost_yen"],
+        "next_visit_on": values["next_visit_on"],
+        "note": values["note"],
+        "created_at": values["created_at"],
+        "updated_at": values["updated_at"],
+        "version": values["version"],
+    }
 
 
 @router.get("", response_model=schemas.VetVisitList)
@@ -50,15 +70,12 @@ def get_vet_visits(
     db: Session = Depends(get_db),
 ):
     """Get vet visits for a pet"""
-    verify_pet_exists(pet_id, db)
-
-    # Join with records to filter by pet_id
+    # The denormalized pet_id and date keep the scan to the pet and the
+    # partitions of the requested years (children follow record deletes)
     query = (
-        db.query(RecordVetVisit, Record.pet_id)
-        .join(Record, RecordVetVisit.record_id == Record.id)
+        db.query(RecordVetVisit, RecordVetVisit.pet_id)
         .filter(
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordVetVisit.pet_id == pet_id,
             RecordVetVisit.is_deleted == 0,
         )
     )
@@ -89,9 +106,11 @@ def get_vet_visits(
                 chief_complaint=visit.chief_complaint,
                 diagnosis=visit.diagnosis,
                 cost_yen=visit.cost_yen,
+                next_visit_on=visit.next_visit_on,
                 note=visit.note,
                 created_at=visit.created_at,
                 updated_at=visit.updated_at,
+                version=visit.version,
             )
         )
 
@@ -100,43 +119,35 @@ def get_vet_visits(
 
 @router.post("", response_model=schemas.ItemResponse, status_code=201)
 def create_vet_visit(
-    pet_id: int, visit_data: schemas.VetVisitCreate, db: Session = Depends(get_db)
+    pet_id: int,
+    visit_data: schemas.VetVisitCreate,
+    db: Session = Depends(get_db),
 ):
     """Create a new vet visit"""
-    verify_pet_exists(pet_id, db)
-
     try:
-        # Get or create record for the visit date
-        record = get_or_create_record(pet_id, visit_data.visited_on, db)
+        # Resolve the daily record for the visit date
+        record_id = resolve_daily_record(db, pet_id, visit_data.visited_on)
 
         visit = RecordVetVisit(
-            record_id=record.id,
+            record_id=record_id,
+            pet_id=pet_id,
             visited_on=visit_data.visited_on,
             hospital_name=visit_data.hospital_name,
             doctor_name=visit_data.doctor_name,
             chief_complaint=visit_data.chief_complaint,
             diagnosis=visit_data.diagnosis,
             cost_yen=visit_data.cost_yen,
+            next_visit_on=visit_data.next_visit_on,
             note=visit_data.note,
         )
         db.add(visit)
+        apply_visit_costs(db, [], [visit_cost(visit)])
+        record_row_change(db, ENTITY_VET_VISIT, visit, pet_id, OP_CREATE)
         db.commit()
         db.refresh(visit)
 
         return {
-            "item": {
-                "id": visit.id,
-                "pet_id": pet_id,
-                "visited_on": visit.visited_on,
-                "hospital_name": visit.hospital_name,
-                "doctor_name": visit.doctor_name,
-                "chief_complaint": visit.chief_complaint,
-                "diagnosis": visit.diagnosis,
-                "cost_yen": visit.cost_yen,
-                "note": visit.note,
-                "created_at": visit.created_at,
-                "updated_at": visit.updated_at,
-            }
+            "item": vet_visit_item(row_values(visit, RecordVetVisit), pet_id)
         }
 
     except Exception as e:
@@ -145,17 +156,18 @@ def create_vet_visit(
 
 
 @router.get("/{visit_id}", response_model=schemas.ItemResponse)
-def get_vet_visit(pet_id: int, visit_id: int, db: Session = Depends(get_db)):
+def get_vet_visit(
+    pet_id: int,
+    visit_id: int,
+    response: Response,
+    db: Session = Depends(get_db),
+):
     """Get vet visit detail"""
-    verify_pet_exists(pet_id, db)
-
     visit = (
         db.query(RecordVetVisit)
-        .join(Record, RecordVetVisit.record_id == Record.id)
         .filter(
             RecordVetVisit.id == visit_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordVetVisit.pet_id == pet_id,
             RecordVetVisit.is_deleted == 0,
         )
         .first()
@@ -164,20 +176,9 @@ def get_vet_visit(pet_id: int, visit_id: int, db: Session = Depends(get_db)):
     if not visit:
         raise HTTPException(status_code=404, detail="Vet visit not found")
 
+    set_etag(response, visit.version)
     return {
-        "item": {
-            "id": visit.id,
-            "pet_id": pet_id,
-            "visited_on": visit.visited_on,
-            "hospital_name": visit.hospital_name,
-            "doctor_name": visit.doctor_name,
-            "chief_complaint": visit.chief_complaint,
-            "diagnosis": visit.diagnosis,
-            "cost_yen": visit.cost_yen,
-            "note": visit.note,
-            "created_at": visit.created_at,
-            "updated_at": visit.updated_at,
-        }
+        "item": vet_visit_item(row_values(visit, RecordVetVisit), pet_id)
     }
 
 
@@ -186,18 +187,16 @@ def update_vet_visit(
     pet_id: int,
     visit_id: int,
     visit_data: schemas.VetVisitUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
 ):
     """Update vet visit"""
-    verify_pet_exists(pet_id, db)
-
     visit = (
         db.query(RecordVetVisit)
-        .join(Record, RecordVetVisit.record_id == Record.id)
         .filter(
             RecordVetVisit.id == visit_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordVetVisit.pet_id == pet_id,
             RecordVetVisit.is_deleted == 0,
         )
         .first()
@@ -205,52 +204,102 @@ def update_vet_visit(
 
     if not visit:
         raise HTTPException(status_code=404, detail="Vet visit not found")
+    check_version(visit, parse_if_match(if_match))
 
     try:
+        old_cost = visit_cost(visit)
         visit.visited_on = visit_data.visited_on
         visit.hospital_name = visit_data.hospital_name
         visit.doctor_name = visit_data.doctor_name
         visit.chief_complaint = visit_data.chief_complaint
         visit.diagnosis = visit_data.diagnosis
         visit.cost_yen = visit_data.cost_yen
+        visit.next_visit_on = visit_data.next_visit_on
         visit.note = visit_data.note
+        apply_visit_costs(db, [old_cost], [visit_cost(visit)])
+        touch_record(db, visit.record_id)
+        record_row_change(db, ENTITY_VET_VISIT, visit, pet_id, OP_UPDATE)
 
         db.commit()
         db.refresh(visit)
+        set_etag(response, visit.version)
 
         return {
-            "item": {
-                "id": visit.id,
-                "pet_id": pet_id,
-                "visited_on": visit.visited_on,
-                "hospital_name": visit.hospital_name,
-                "doctor_name": visit.doctor_name,
-                "chief_complaint": visit.chief_complaint,
-                "diagnosis": visit.diagnosis,
-                "cost_yen": visit.cost_yen,
-                "note": visit.note,
-                "created_at": visit.created_at,
-                "updated_at": visit.updated_at,
-            }
+            "item": vet_visit_item(row_values(visit, RecordVetVisit), pet_id)
         }
 
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.patch("/{visit_id}", response_model=schemas.ItemResponse)
+def patch_vet_visit(
+    pet_id: int,
+    visit_id: int,
+    visit_data: schemas.VetVisitPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Partially update vet visit (JSON merge patch)"""
+    changes = visit_data.model_dump(exclude_unset=True)
+    criteria = [
+        RecordVetVisit.id == visit_id,
+        RecordVetVisit.pet_id == pet_id,
+        RecordVetVisit.is_deleted == 0,
+    ]
+    expected_version = parse_if_match(if_match)
+
+    try:
+        # patch_row only returns the new values; read the old ones first
+        # when the visit may move between cost buckets, and only replace
+        # the version they were read at
+        old_cost = None
+        if COST_FIELDS & changes.keys():
+            current = versioned_visit_cost(db, criteria)
+            if current:
+                old_cost, read_version = current
+                expected_version = pin_version(expected_version, read_version)
+        values = patch_row(db, RecordVetVisit, criteria, changes, expected_version)
+        if values is not None and changes:
+            if old_cost:
+                apply_visit_costs(db, [old_cost], [visit_cost(values)])
+            touch_record(db, values["record_id"])
+            record_change(
+                db, ENTITY_VET_VISIT, visit_id, pet_id, OP_UPDATE, values["version"]
+            )
+            db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if values is None:
+        raise HTTPException(status_code=404, detail="Vet visit not found")
+
+    set_etag(response, values["version"])
+    return {"item": vet_visit_item(values, pet_id)}
+
+
 @router.delete("/{visit_id}", status_code=204)
-def delete_vet_visit(pet_id: int, visit_id: int, db: Session = Depends(get_db)):
+def delete_vet_visit(
+    pet_id: int,
+    visit_id: int,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
     """Logical delete of vet visit"""
-    verify_pet_exists(pet_id, db)
-
     visit = (
         db.query(RecordVetVisit)
-        .join(Record, RecordVetVisit.record_id == Record.id)
         .filter(
             RecordVetVisit.id == visit_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordVetVisit.pet_id == pet_id,
             RecordVetVisit.is_deleted == 0,
         )
         .first()
@@ -259,7 +308,17 @@ def delete_vet_visit(pet_id: int, visit_id: int, db: Session = Depends(get_db)):
     if not visit:
         raise HTTPException(status_code=404, detail="Vet visit not found")
 
-    visit.is_deleted = 1
-    db.commit()
+    check_version(visit, parse_if_match(if_match))
+
+    try:
+        mark_deleted(visit)
+        soft_delete_attachments(db, VetVisitAttachment.vet_visit_id == visit.id)
+        apply_visit_costs(db, [visit_cost(visit)], [])
+        touch_record(db, visit.record_id)
+        record_row_change(db, ENTITY_VET_VISIT, visit, pet_id, OP_DELETE)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
 
     return None
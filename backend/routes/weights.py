@@ -1,41 +1,43 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from typing import Optional
 from datetime import date
 
 from database import get_db
-from models import Pet, Record, RecordWeight
+from services.auth import owned_pet
+from models import Pet, RecordWeight
+from services.outbox import (
+    record_change,
+    record_row_change,
+    ENTITY_WEIGHT,
+    OP_CREATE,
+    OP_UPDATE,
+    OP_DELETE,
+)
+from services.soft_delete import mark_deleted
+from services.patching import patch_row, pin_version
+from services.records import touch_record, resolve_daily_record
+from services.weight_trends import (
+    TREND_FIELDS,
+    apply_weight_change,
+    trend_item,
+    versioned_weight_point,
+    weight_point,
+)
+from services.concurrency import (
+    parse_if_match,
+    check_version,
+    set_etag,
+    version_conflict,
+)
 import schemas
 
-router = APIRouter(prefix="/pets/{pet_id}/weights", tags=["weights"])
-
-
-def verify_pet_exists(pet_id: int, db: Session) -> Pet:
-    """Verify pet exists and is not deleted"""
-    pet = db.query(Pet).filter(Pet.id == pet_id, Pet.is_deleted == 0).first()
-    if not pet:
-        raise HTTPException(status_code=404, detail="Pet not found")
-    return pet
-
-
-def get_or_create_record(pet_id: int, measured_on: date, db: Session) -> Record:
-    """Get or create a record for the given date"""
-    record = (
-        db.query(Record)
-        .filter(
-            Record.pet_id == pet_id,
-            Record.recorded_on == measured_on,
-            Record.is_deleted == 0,
-        )
-        .first()
-    )
-
-    if not record:
-        record = Record(pet_id=pet_id, recorded_on=measured_on)
-        db.add(record)
-        db.flush()
-
-    return record
+router = APIRouter(
+    prefix="/pets/{pet_id}/weights",
+    tags=["weights"],
+    dependencies=[Depends(owned_pet)],
+)
 
 
 @router.get("", response_model=schemas.WeightList)
@@ -45,18 +47,17 @@ def get_weights(
     to_date: Optional[date] = Query(None, alias="to"),
     limit: int = 200,
     offset: int = 0,
+    pet: Pet = Depends(owned_pet),
     db: Session = Depends(get_db),
 ):
     """Get weights for a pet"""
-    verify_pet_exists(pet_id, db)
 
-    # Join with records to filter by pet_id
+    # The denormalized pet_id and date keep the scan to the pet and the
+    # partitions of the requested years (children follow record deletes)
     query = (
-        db.query(RecordWeight, Record.pet_id)
-        .join(Record, RecordWeight.record_id == Record.id)
+        db.query(RecordWeight, RecordWeight.pet_id)
         .filter(
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordWeight.pet_id == pet_id,
             RecordWeight.is_deleted == 0,
         )
     )
@@ -80,6 +81,7 @@ def get_weights(
                 note=weight.note,
                 created_at=weight.created_at,
                 updated_at=weight.updated_at,
+                version=weight.version,
             )
         )
 
@@ -88,22 +90,25 @@ def get_weights(
 
 @router.post("", response_model=schemas.ItemResponse, status_code=201)
 def create_weight(
-    pet_id: int, weight_data: schemas.WeightCreate, db: Session = Depends(get_db)
+    pet_id: int,
+    weight_data: schemas.WeightCreate,
+    db: Session = Depends(get_db),
 ):
     """Create a new weight"""
-    verify_pet_exists(pet_id, db)
-
     try:
-        # Get or create record for the measured date
-        record = get_or_create_record(pet_id, weight_data.measured_on, db)
+        # Resolve the daily record for the measured date
+        record_id = resolve_daily_record(db, pet_id, weight_data.measured_on)
 
         weight = RecordWeight(
-            record_id=record.id,
+            record_id=record_id,
+            pet_id=pet_id,
             measured_on=weight_data.measured_on,
             weight_kg=weight_data.weight_kg,
             note=weight_data.note,
         )
         db.add(weight)
+        record_row_change(db, ENTITY_WEIGHT, weight, pet_id, OP_CREATE)
+        apply_weight_change(db, pet_id, None, weight_point(weight))
         db.commit()
         db.refresh(weight)
 
@@ -116,26 +121,40 @@ def create_weight(
                 "note": weight.note,
                 "created_at": weight.created_at,
                 "updated_at": weight.updated_at,
+                "version": weight.version,
             }
         }
 
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.get("/trend", response_model=schemas.ItemResponse)
+def get_weight_trend(
+    pet_id: int,
+    db: Session = Depends(get_db),
+):
+    """Get the pet's weight trend (EWMA, rolling slopes, sudden-loss flag)"""
+    return {"item": {"pet_id": pet_id, "trend": trend_item(db, pet_id)}}
+
+
 @router.get("/{weight_id}", response_model=schemas.ItemResponse)
-def get_weight(pet_id: int, weight_id: int, db: Session = Depends(get_db)):
+def get_weight(
+    pet_id: int,
+    weight_id: int,
+    response: Response,
+    db: Session = Depends(get_db),
+):
     """Get weight detail"""
-    verify_pet_exists(pet_id, db)
-
     weight = (
         db.query(RecordWeight)
-        .join(Record, RecordWeight.record_id == Record.id)
         .filter(
             RecordWeight.id == weight_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordWeight.pet_id == pet_id,
             RecordWeight.is_deleted == 0,
         )
         .first()
@@ -144,6 +163,7 @@ def get_weight(pet_id: int, weight_id: int, db: Session = Depends(get_db)):
     if not weight:
         raise HTTPException(status_code=404, detail="Weight not found")
 
+    set_etag(response, weight.version)
     return {
         "item": {
             "id": weight.id,
@@ -153,6 +173,7 @@ def get_weight(pet_id: int, weight_id: int, db: Session = Depends(get_db)):
             "note": weight.note,
             "created_at": weight.created_at,
             "updated_at": weight.updated_at,
+            "version": weight.version,
         }
     }
 
@@ -162,18 +183,16 @@ def update_weight(
     pet_id: int,
     weight_id: int,
     weight_data: schemas.WeightUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
 ):
     """Update weight"""
-    verify_pet_exists(pet_id, db)
-
     weight = (
         db.query(RecordWeight)
-        .join(Record, RecordWeight.record_id == Record.id)
         .filter(
             RecordWeight.id == weight_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordWeight.pet_id == pet_id,
             RecordWeight.is_deleted == 0,
         )
         .first()
@@ -181,14 +200,22 @@ def update_weight(
 
     if not weight:
         raise HTTPException(status_code=404, detail="Weight not found")
+    check_version(weight, parse_if_match(if_match))
 
     try:
+        before = weight_point(weight)
         weight.measured_on = weight_data.measured_on
         weight.weight_kg = weight_data.weight_kg
         weight.note = weight_data.note
+        touch_record(db, weight.record_id)
+        record_row_change(db, ENTITY_WEIGHT, weight, pet_id, OP_UPDATE)
+        after = weight_point(weight)
+        if after != before:
+            apply_weight_change(db, pet_id, before, after)
 
         db.commit()
         db.refresh(weight)
+        set_etag(response, weight.version)
 
         return {
             "item": {
@@ -199,26 +226,96 @@ def update_weight(
                 "note": weight.note,
                 "created_at": weight.created_at,
                 "updated_at": weight.updated_at,
+                "version": weight.version,
             }
         }
 
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def weight_item(values: dict, pet_id: int) -> dict:
+    """Build the weight response item from column values"""
+    return {
+        "id": values["id"],
+        "pet_id": pet_id,
+        "measured_on": values["measured_on"],
+        "weight_kg": float(values["weight_kg"]),
+        "note": values["note"],
+        "created_at": values["created_at"],
+        "updated_at": values["updated_at"],
+        "version": values["version"],
+    }
+
+
+@router.patch("/{weight_id}", response_model=schemas.ItemResponse)
+def patch_weight(
+    pet_id: int,
+    weight_id: int,
+    weight_data: schemas.WeightPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Partially update weight (JSON merge patch)"""
+    changes = weight_data.model_dump(exclude_unset=True)
+    criteria = [
+        RecordWeight.id == weight_id,
+        RecordWeight.pet_id == pet_id,
+        RecordWeight.is_deleted == 0,
+    ]
+    expected_version = parse_if_match(if_match)
+
+    try:
+        # patch_row only returns the new values; read the old ones first
+        # when the weight may move within the trend, and only replace the
+        # version they were read at
+        before = None
+        if TREND_FIELDS & changes.keys():
+            current = versioned_weight_point(db, criteria)
+            if current:
+                before, read_version = current
+                expected_version = pin_version(expected_version, read_version)
+        values = patch_row(db, RecordWeight, criteria, changes, expected_version)
+        if values is not None and changes:
+            if before:
+                apply_weight_change(db, pet_id, before, weight_point(values))
+            touch_record(db, values["record_id"])
+            record_change(
+                db, ENTITY_WEIGHT, weight_id, pet_id, OP_UPDATE, values["version"]
+            )
+            db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if values is None:
+        raise HTTPException(status_code=404, detail="Weight not found")
+
+    set_etag(response, values["version"])
+    return {"item": weight_item(values, pet_id)}
+
+
 @router.delete("/{weight_id}", status_code=204)
-def delete_weight(pet_id: int, weight_id: int, db: Session = Depends(get_db)):
+def delete_weight(
+    pet_id: int,
+    weight_id: int,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
     """Logical delete of weight"""
-    verify_pet_exists(pet_id, db)
-
     weight = (
         db.query(RecordWeight)
-        .join(Record, RecordWeight.record_id == Record.id)
         .filter(
             RecordWeight.id == weight_id,
-            Record.pet_id == pet_id,
-            Record.is_deleted == 0,
+            RecordWeight.pet_id == pet_id,
             RecordWeight.is_deleted == 0,
         )
         .first()
@@ -227,7 +324,16 @@ def delete_weight(pet_id: int, weight_id: int, db: Session = Depends(get_db)):
     if not weight:
         raise HTTPException(status_code=404, detail="Weight not found")
 
-    weight.is_deleted = 1
-    db.commit()
+    check_version(weight, parse_if_match(if_match))
+
+    try:
+        mark_deleted(weight)
+        touch_record(db, weight.record_id)
+        record_row_change(db, ENTITY_WEIGHT, weight, pet_id, OP_DELETE)
+        apply_weight_change(db, pet_id, weight_point(weight), None)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise version_conflict()
 
     return None
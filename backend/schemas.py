@@ -1,7 +1,23 @@
-from typing import Optional, List
+from typing import Any, Dict, List, Literal, Optional
 from datetime import date, datetime
 from decimal import Decimal
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, validator, field_validator
+
+# Medication schedule limits; days_of_week is a Monday=bit 0 bitmask
+MAX_INTERVAL_DAYS = 365
+MAX_TIMES_PER_DAY = 24
+ALL_DAYS_OF_WEEK = 0b1111111
+
+MAX_BATCH_OPERATIONS = 50
+
+MAX_ATTACHMENT_BYTES = 200 * 1024 * 1024
+
+
+def not_null(value):
+    """Reject an explicit null for a required field in a merge patch"""
+    if value is None:
+        raise ValueError("must not be null")
+    return value
 
 
 # Pet Schemas
@@ -21,10 +37,31 @@ class PetUpdate(PetBase):
     pass
 
 
+class PetPatch(BaseModel):
+    name: Optional[str] = Field(None, min_length=1, max_length=100)
+    species: Optional[str] = Field(None, max_length=50)
+    sex: Optional[str] = Field(None, max_length=20)
+    birth_date: Optional[date] = None
+    photo_url: Optional[str] = Field(None, max_length=500)
+
+    @field_validator("name")
+    @classmethod
+    def reject_null(cls, value):
+        return not_null(value)
+
+
+class PetPhotoUrls(BaseModel):
+    original: str
+    thumb: str
+    medium: str
+
+
 class Pet(PetBase):
     id: int
+    photo_urls: Optional[PetPhotoUrls] = None
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -32,6 +69,10 @@ class Pet(PetBase):
 
 class PetList(BaseModel):
     items: List[Pet]
+    total: int
+    limit: int
+    # Pass as `cursor` to get the next page; null on the last page
+    next_cursor: Optional[str]
 
     class Config:
         from_attributes = True
@@ -56,6 +97,7 @@ class RecordWeight(RecordWeightBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -76,11 +118,23 @@ class WeightUpdate(WeightBase):
     pass
 
 
+class WeightPatch(BaseModel):
+    measured_on: Optional[date] = None
+    weight_kg: Optional[Decimal] = Field(None, ge=0, le=999.99)
+    note: Optional[str] = Field(None, max_length=500)
+
+    @field_validator("measured_on", "weight_kg")
+    @classmethod
+    def reject_null(cls, value):
+        return not_null(value)
+
+
 class Weight(WeightBase):
     id: int
     pet_id: int
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -101,6 +155,9 @@ class RecordMedicationBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=200)
     dosage: Optional[str] = Field(None, max_length=200)
     frequency: Optional[str] = Field(None, max_length=200)
+    interval_days: Optional[int] = Field(None, ge=1, le=MAX_INTERVAL_DAYS)
+    times_per_day: Optional[int] = Field(None, ge=1, le=MAX_TIMES_PER_DAY)
+    days_of_week: Optional[int] = Field(None, ge=1, le=ALL_DAYS_OF_WEEK)
     start_on: date
     end_on: Optional[date] = None
     note: Optional[str] = None
@@ -118,6 +175,7 @@ class RecordMedication(RecordMedicationBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -128,6 +186,9 @@ class MedicationBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=200)
     dosage: Optional[str] = Field(None, max_length=200)
     frequency: Optional[str] = Field(None, max_length=200)
+    interval_days: Optional[int] = Field(None, ge=1, le=MAX_INTERVAL_DAYS)
+    times_per_day: Optional[int] = Field(None, ge=1, le=MAX_TIMES_PER_DAY)
+    days_of_week: Optional[int] = Field(None, ge=1, le=ALL_DAYS_OF_WEEK)
     start_on: date
     end_on: Optional[date] = None
     note: Optional[str] = None
@@ -141,11 +202,29 @@ class MedicationUpdate(MedicationBase):
     pass
 
 
+class MedicationPatch(BaseModel):
+    name: Optional[str] = Field(None, min_length=1, max_length=200)
+    dosage: Optional[str] = Field(None, max_length=200)
+    frequency: Optional[str] = Field(None, max_length=200)
+    interval_days: Optional[int] = Field(None, ge=1, le=MAX_INTERVAL_DAYS)
+    times_per_day: Optional[int] = Field(None, ge=1, le=MAX_TIMES_PER_DAY)
+    days_of_week: Optional[int] = Field(None, ge=1, le=ALL_DAYS_OF_WEEK)
+    start_on: Optional[date] = None
+    end_on: Optional[date] = None
+    note: Optional[str] = None
+
+    @field_validator("name", "start_on")
+    @classmethod
+    def reject_null(cls, value):
+        return not_null(value)
+
+
 class Medication(MedicationBase):
     id: int
     pet_id: int
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -161,6 +240,19 @@ class MedicationList(BaseModel):
         from_attributes = True
 
 
+class MedicationDose(BaseModel):
+    medication_id: int
+    name: str
+    dosage: Optional[str]
+    dose_on: date
+    doses: int
+
+
+class MedicationCalendar(BaseModel):
+    items: List[MedicationDose]
+    total: int
+
+
 # Record Vet Visit Schemas
 class RecordVetVisitBase(BaseModel):
     visited_on: date
@@ -169,6 +261,7 @@ class RecordVetVisitBase(BaseModel):
     chief_complaint: Optional[str] = Field(None, max_length=500)
     diagnosis: Optional[str] = Field(None, max_length=500)
     cost_yen: Optional[int] = Field(None, ge=0)
+    next_visit_on: Optional[date] = None
     note: Optional[str] = None
 
 
@@ -184,6 +277,7 @@ class RecordVetVisit(RecordVetVisitBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -197,6 +291,7 @@ class VetVisitBase(BaseModel):
     chief_complaint: Optional[str] = Field(None, max_length=500)
     diagnosis: Optional[str] = Field(None, max_length=500)
     cost_yen: Optional[int] = Field(None, ge=0)
+    next_visit_on: Optional[date] = None
     note: Optional[str] = None
 
 
@@ -208,11 +303,28 @@ class VetVisitUpdate(VetVisitBase):
     pass
 
 
+class VetVisitPatch(BaseModel):
+    visited_on: Optional[date] = None
+    hospital_name: Optional[str] = Field(None, max_length=200)
+    doctor_name: Optional[str] = Field(None, max_length=200)
+    chief_complaint: Optional[str] = Field(None, max_length=500)
+    diagnosis: Optional[str] = Field(None, max_length=500)
+    cost_yen: Optional[int] = Field(None, ge=0)
+    next_visit_on: Optional[date] = None
+    note: Optional[str] = None
+
+    @field_validator("visited_on")
+    @classmethod
+    def reject_null(cls, value):
+        return not_null(value)
+
+
 class VetVisit(VetVisitBase):
     id: int
     pet_id: int
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -228,6 +340,71 @@ class VetVisitList(BaseModel):
         from_attributes = True
 
 
+# Vet Visit Attachment Schemas
+class AttachmentUploadCreate(BaseModel):
+    file_name: str = Field(..., min_length=1, max_length=255)
+    content_type: Optional[str] = Field(None, max_length=100)
+    size_bytes: int = Field(..., ge=1, le=MAX_ATTACHMENT_BYTES)
+
+
+class AttachmentUpload(BaseModel):
+    id: int
+    vet_visit_id: int
+    pet_id: int
+    file_name: str
+    content_type: str
+    size_bytes: int
+    received_bytes: int
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class Attachment(BaseModel):
+    id: int
+    vet_visit_id: int
+    pet_id: int
+    file_name: str
+    content_type: str
+    size_bytes: int
+    sha256: str
+    created_at: datetime
+    updated_at: datetime
+    version: int
+
+    class Config:
+        from_attributes = True
+
+
+class AttachmentList(BaseModel):
+    items: List[Attachment]
+
+    class Config:
+        from_attributes = True
+
+
+# Report Schemas
+class ReportCreate(BaseModel):
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
+
+
+class Report(BaseModel):
+    id: int
+    pet_id: int
+    status: str
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
+    size_bytes: Optional[int] = None
+    error: Optional[str] = None
+    download_url: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
 # Record Schemas
 class RecordBase(BaseModel):
     recorded_on: date
@@ -247,6 +424,17 @@ class RecordUpdate(RecordBase):
     vet_visits: List[RecordVetVisitUpdate] = []
 
 
+class RecordPatch(BaseModel):
+    recorded_on: Optional[date] = None
+    condition: Optional[str] = Field(None, max_length=20)
+    note: Optional[str] = None
+
+    @field_validator("recorded_on")
+    @classmethod
+    def reject_null(cls, value):
+        return not_null(value)
+
+
 class Record(RecordBase):
     id: int
     pet_id: int
@@ -255,6 +443,7 @@ class Record(RecordBase):
     vet_visits: List[RecordVetVisit] = []
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -269,6 +458,7 @@ class RecordListItem(BaseModel):
     has_medications: bool
     has_vet_visits: bool
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -299,6 +489,19 @@ class WeightLastSummary(BaseModel):
     weight_kg: Decimal
 
 
+class TrendWindow(BaseModel):
+    window_days: int
+    points: int
+    slope_kg_per_day: Optional[float]
+
+
+class WeightTrendSummary(BaseModel):
+    last_measured_on: date
+    ewma_kg: float
+    sudden_loss: bool
+    windows: List[TrendWindow]
+
+
 class MedicationActiveSummary(BaseModel):
     count: int
     items: List[dict]
@@ -308,9 +511,155 @@ class PetSummary(BaseModel):
     pet_id: int
     vet_visit_last: Optional[VetVisitLastSummary]
     weight_last: Optional[WeightLastSummary]
+    weight_trend: Optional[WeightTrendSummary] = None
     medication_active: MedicationActiveSummary
 
 
+# Timeline Schemas
+TimelineType = Literal["record", "vet_visit", "weight", "medication"]
+
+
+class TimelineEntry(BaseModel):
+    type: TimelineType
+    date: date
+    item: dict
+
+
+class TimelinePage(BaseModel):
+    items: List[TimelineEntry]
+    limit: int
+    # Pass as `cursor` to get the next (older) page; null on the last page
+    next_cursor: Optional[str]
+
+
+# Cost Schemas
+class CostBucket(BaseModel):
+    year: Optional[int] = None
+    month: Optional[int] = None
+    hospital_name: Optional[str] = None
+    total_yen: int
+    visit_count: int
+
+
+class CostSummary(BaseModel):
+    group_by: str
+    items: List[CostBucket]
+    total_yen: int
+
+
+# Sync Schemas
+class SyncRecord(RecordBase):
+    id: int
+    pet_id: int
+    is_deleted: bool
+    deleted_at: Optional[datetime]
+    created_at: datetime
+    updated_at: datetime
+    version: int
+
+    class Config:
+        from_attributes = True
+
+
+class SyncWeight(WeightBase):
+    id: int
+    pet_id: int
+    record_id: int
+    is_deleted: bool
+    deleted_at: Optional[datetime]
+    created_at: datetime
+    updated_at: datetime
+    version: int
+
+    class Config:
+        from_attributes = True
+
+
+class SyncMedication(MedicationBase):
+    id: int
+    pet_id: int
+    record_id: int
+    is_deleted: bool
+    deleted_at: Optional[datetime]
+    created_at: datetime
+    updated_at: datetime
+    version: int
+
+    class Config:
+        from_attributes = True
+
+
+class SyncVetVisit(VetVisitBase):
+    id: int
+    pet_id: int
+    record_id: int
+    is_deleted: bool
+    deleted_at: Optional[datetime]
+    created_at: datetime
+    updated_at: datetime
+    version: int
+
+    class Config:
+        from_attributes = True
+
+
+class SyncResponse(BaseModel):
+    records: List[SyncRecord]
+    weights: List[SyncWeight]
+    medications: List[SyncMedication]
+    vet_visits: List[SyncVetVisit]
+    # Opaque token for the next sync
+    next_since: Optional[str]
+
+
+# Change Event Schemas
+class ChangeEvent(BaseModel):
+    seq: int
+    entity: str
+    entity_id: int
+    pet_id: int
+    op: str
+    version: Optional[int]
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class ChangeEventList(BaseModel):
+    items: List[ChangeEvent]
+    limit: int
+    next_since: int
+
+
+# Batch Schemas
+class BatchOperation(BaseModel):
+    method: Literal["GET", "POST", "PUT", "PATCH", "DELETE"]
+    # Path below /api, optionally with a query string
+    path: str = Field(..., pattern=r"^/")
+    body: Optional[Any] = None
+    headers: Dict[str, str] = Field(default_factory=dict)
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(
+        ..., min_length=1, max_length=MAX_BATCH_OPERATIONS
+    )
+    # One transaction for all operations, or a commit per operation
+    atomic: bool = True
+
+
+class BatchResult(BaseModel):
+    status: int
+    body: Optional[Any] = None
+    etag: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    committed: bool
+    results: List[BatchResult]
+
+
 # Response Schemas
 class ItemResponse(BaseModel):
     item: dict
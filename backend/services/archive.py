@@ -0,0 +1,201 @@
+"""Archive job: move long-deleted rows out of the live tables.
+
+Tables partitioned by year (services.partitions) are archived row by
+row like the others. archive_partitions additionally swaps out a whole
+old year, but only once it holds nothing live: a year's partition can
+still hold live rows (an open-ended medication started that year, a
+record still in use), which must stay where the routes find them.
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import delete, exists, literal, select, text
+from sqlalchemy.orm import Session
+
+from models import (
+    ARCHIVE_TABLES,
+    AttachmentUpload,
+    MedicationDose,
+    Pet,
+    PetWeightTrend,
+    Record,
+    ReportJob,
+    RecordWeight,
+    RecordMedication,
+    RecordVetVisit,
+    VetCostRollup,
+    VetVisitAttachment,
+    WeightTrendWindow,
+)
+from services.partitions import (
+    PARTITION_COLUMNS,
+    YEAR_PREFIX,
+    require_mysql,
+    year_partitions,
+)
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_KEEP_YEARS = 10
+
+# Children are archived before the rows they reference
+ARCHIVE_ORDER = (
+    VetVisitAttachment,
+    RecordWeight,
+    RecordMedication,
+    RecordVetVisit,
+    Record,
+    Pet,
+)
+
+# Foreign keys that keep a row in the live table while they point at it
+BLOCKING_REFERENCES = {
+    RecordVetVisit: (VetVisitAttachment.vet_visit_id,),
+    Record: (
+        RecordWeight.record_id,
+        RecordMedication.record_id,
+        RecordVetVisit.record_id,
+    ),
+    Pet: (
+        Record.pet_id,
+        RecordWeight.pet_id,
+        RecordMedication.pet_id,
+        RecordVetVisit.pet_id,
+        MedicationDose.pet_id,
+        VetVisitAttachment.pet_id,
+    ),
+}
+
+# Derived or temporary rows that are dropped together with the row they
+# were built from
+DERIVED_REFERENCES = {
+    RecordMedication: (MedicationDose.medication_id,),
+    RecordVetVisit: (AttachmentUpload.vet_visit_id,),
+    Pet: (
+        AttachmentUpload.pet_id,
+        VetCostRollup.pet_id,
+        PetWeightTrend.pet_id,
+        WeightTrendWindow.pet_id,
+        ReportJob.pet_id,
+    ),
+}
+
+
+def stamp_missing_deleted_at(db: Session) -> None:
+    """Backfill deleted_at on rows deleted before it was recorded"""
+    for model in ARCHIVE_ORDER:
+        db.query(model).filter(
+            model.is_deleted == 1, model.deleted_at.is_(None)
+        ).update({"deleted_at": model.updated_at}, synchronize_session=False)
+    db.commit()
+
+
+def archivable_ids(db: Session, model, cutoff: datetime, batch_size: int) -> List[int]:
+    """Get ids of rows deleted before the cutoff and no longer referenced"""
+    query = db.query(model.id).filter(
+        model.is_deleted == 1, model.deleted_at < cutoff
+    )
+    for reference in BLOCKING_REFERENCES.get(model, ()):
+        query = query.filter(~exists().where(reference == model.id))
+
+    return [row.id for row in query.order_by(model.id).limit(batch_size)]
+
+
+def archive_batch(db: Session, model, ids: List[int]) -> None:
+    """Copy a batch of rows to the archive table and remove them from the live one"""
+    source = model.__table__
+    target = ARCHIVE_TABLES[source.name]
+    columns = [column.name for column in source.columns]
+
+    rows = select(*source.columns, literal(datetime.utcnow())).where(
+        source.c.id.in_(ids)
+    )
+    db.execute(target.insert().from_select(columns + ["archived_at"], rows))
+    for reference in DERIVED_REFERENCES.get(model, ()):
+        db.execute(delete(reference.table).where(reference.in_(ids)))
+    db.execute(source.delete().where(source.c.id.in_(ids)))
+    db.commit()
+
+
+def archive_deleted_rows(
+    db: Session,
+    retention_days: int = DEFAULT_RETENTION_DAYS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[str, int]:
+    """Archive rows deleted more than retention_days ago, batch by batch"""
+    stamp_missing_deleted_at(db)
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+    counts = {}
+    for model in ARCHIVE_ORDER:
+        archived = 0
+        ids = archivable_ids(db, model, cutoff, batch_size)
+        while ids:
+            archive_batch(db, model, ids)
+            archived += len(ids)
+            ids = archivable_ids(db, model, cutoff, batch_size)
+        counts[model.__tablename__] = archived
+
+    return counts
+
+
+def holds_only_tombstones(db: Session, model, partition: str) -> bool:
+    """Whether every row of the partition is deleted and unreferenced"""
+    rows = f"SELECT id FROM {model.__tablename__} PARTITION ({partition})"
+    checks = [f"{rows} WHERE is_deleted = 0"]
+    for reference in BLOCKING_REFERENCES.get(model, ()):
+        checks.append(
+            f"SELECT 1 FROM {reference.table.name}"
+            f" WHERE {reference.name} IN ({rows})"
+        )
+    return not any(db.execute(text(f"{check} LIMIT 1")).first() for check in checks)
+
+
+def archive_year(db: Session, model, year: int) -> Optional[str]:
+    """Swap a year's partition out into its own table and drop it.
+
+    EXCHANGE and DROP PARTITION only change metadata, however many rows
+    the year holds; they stay readable in <table>_archive_<year>. A year
+    that still holds a live row, or a row something else points at, is
+    left in place (returns None).
+    """
+    table = model.__tablename__
+    target = f"{table}_archive_{year}"
+    partition = f"{YEAR_PREFIX}{year}"
+    if not holds_only_tombstones(db, model, partition):
+        return None
+    db.execute(text(f"CREATE TABLE {target} LIKE {table}"))
+    db.execute(text(f"ALTER TABLE {target} REMOVE PARTITIONING"))
+    db.execute(
+        text(f"ALTER TABLE {table} EXCHANGE PARTITION {partition} WITH TABLE {target}")
+    )
+    db.execute(text(f"ALTER TABLE {table} DROP PARTITION {partition}"))
+
+    for reference in DERIVED_REFERENCES.get(model, ()):
+        db.execute(
+            delete(reference.table).where(
+                reference.in_(select(text("id")).select_from(text(target)))
+            )
+        )
+    db.commit()
+    return target
+
+
+def archive_partitions(
+    db: Session, keep_years: int = DEFAULT_KEEP_YEARS
+) -> Dict[str, List[str]]:
+    """Archive the year partitions older than the last keep_years years.
+
+    Only years holding nothing but tombstones are swapped out.
+    """
+    require_mysql(db)
+    before_year = date.today().year - keep_years + 1
+    archived = {}
+    for model in PARTITION_COLUMNS:
+        table = model.__tablename__
+        targets = [
+            archive_year(db, model, year)
+            for year in year_partitions(db, table)
+            if year < before_year
+        ]
+        archived[table] = [target for target in targets if target]
+    return archived
@@ -0,0 +1,312 @@
+"""Vet visit attachments: resumable chunked uploads into content-addressed blobs.
+
+An upload is opened with the file's size, then its bytes arrive in any
+number of PUT requests carrying Content-Range. Each chunk is streamed
+straight into the upload's staging file at its offset, and the offset
+only advances through a conditional UPDATE, so concurrent or repeated
+chunks cannot skip or double-count bytes. A client that loses its
+connection reads received_bytes back and continues from there.
+
+The finished file is hashed from disk and stored once per SHA-256 under
+attachments/<aa>/<sha256>; identical documents share a blob. Nothing is
+ever read into memory whole, uploads and downloads alike.
+"""
+import hashlib
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Iterator, List, NamedTuple, Optional
+import anyio
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from sqlalchemy import delete, update
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+from starlette.types import Receive, Scope, Send
+
+from models import AttachmentUpload, VetVisitAttachment
+from services.outbox import record_row_change, ENTITY_ATTACHMENT, OP_CREATE
+from services.storage import get_storage
+
+ATTACHMENT_PREFIX = "attachments"
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+IO_CHUNK_BYTES = 1024 * 1024
+
+UPLOAD_EXPIRY_HOURS = 24
+PURGE_BATCH_SIZE = 500
+
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+# Sent without a body to ask for the upload's state (and finish it)
+STATUS_RANGE = re.compile(r"^bytes \*/(\d+)$")
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# ASGI extension through which a server sends a file descriptor's bytes
+# with sendfile(2)
+ZERO_COPY_SEND = "http.response.zerocopysend"
+
+
+class ByteRange(NamedTuple):
+    """Inclusive byte positions, as in Content-Range"""
+
+    start: int
+    end: int
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+
+def blob_key(sha256: str) -> str:
+    return f"{ATTACHMENT_PREFIX}/{sha256[:2]}/{sha256}"
+
+
+def parse_content_range(
+    header: Optional[str], size_bytes: int
+) -> Optional[ByteRange]:
+    """The chunk a PUT carries ("bytes start-end/total").
+
+    None for a status query ("bytes */total"), which sends no bytes.
+    """
+    header = header or ""
+    status = STATUS_RANGE.match(header)
+    match = CONTENT_RANGE.match(header)
+    if not status and not match:
+        raise HTTPException(
+            status_code=400, detail="Content-Range: bytes start-end/total required"
+        )
+    if status:
+        start, end, total = 0, 0, int(status.group(1))
+    else:
+        start, end, total = (int(value) for value in match.groups())
+    if total != size_bytes or start > end or end >= total:
+        raise HTTPException(
+            status_code=416, detail=f"Chunk outside the {size_bytes} byte upload"
+        )
+    return None if status else ByteRange(start, end)
+
+
+async def receive_chunk(request: Request, path: str, chunk: ByteRange) -> int:
+    """Stream a request body into the staging file at the chunk's offset.
+
+    Returns the number of bytes written; fewer than the chunk's length
+    when the client went away, so the received part still counts.
+    """
+    file = await run_in_threadpool(open, path, "r+b")
+    written = 0
+    try:
+        await run_in_threadpool(file.seek, chunk.start)
+        async for data in request.stream():
+            if written + len(data) > chunk.length:
+                raise HTTPException(
+                    status_code=400, detail="Body is longer than its Content-Range"
+                )
+            await run_in_threadpool(file.write, data)
+            written += len(data)
+    except ClientDisconnect:
+        pass
+    finally:
+        await run_in_threadpool(file.close)
+    return written
+
+
+def advance_upload(db: Session, upload_id: int, start: int, written: int) -> bool:
+    """Move the upload's offset past a written chunk if it still starts there"""
+    if not written:
+        return True
+    result = db.execute(
+        update(AttachmentUpload)
+        .where(
+            AttachmentUpload.id == upload_id,
+            AttachmentUpload.received_bytes == start,
+        )
+        .values(received_bytes=start + written, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def open_upload(db: Session, upload: AttachmentUpload) -> AttachmentUpload:
+    """Create the upload's empty staging file and save the upload"""
+    with get_storage().new_staging_file() as staged:
+        upload.staged_name = os.path.basename(staged.name)
+    db.add(upload)
+    db.commit()
+    db.refresh(upload)
+    return upload
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(IO_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def claim_upload(db: Session, upload: AttachmentUpload) -> bool:
+    """Remove a fully received upload's row; False if another request did.
+
+    Temporary state, so the row is deleted rather than flagged. The
+    DELETE holds the row until commit, so only one request finishes it.
+    """
+    result = db.execute(
+        delete(AttachmentUpload)
+        .where(
+            AttachmentUpload.id == upload.id,
+            AttachmentUpload.received_bytes == AttachmentUpload.size_bytes,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def complete_upload(
+    db: Session, upload: AttachmentUpload
+) -> Optional[VetVisitAttachment]:
+    """Store a fully received upload as a blob and record its attachment"""
+    if not claim_upload(db, upload):
+        db.rollback()
+        return None
+
+    storage = get_storage()
+    staged_path = storage.staging_path(upload.staged_name)
+    sha256 = file_sha256(staged_path)
+    # An identical blob may already exist; put_object then keeps it
+    storage.put_object(blob_key(sha256), staged_path)
+
+    attachment = VetVisitAttachment(
+        vet_visit_id=upload.vet_visit_id,
+        pet_id=upload.pet_id,
+        file_name=upload.file_name,
+        content_type=upload.content_type,
+        size_bytes=upload.size_bytes,
+        sha256=sha256,
+    )
+    db.add(attachment)
+    record_row_change(db, ENTITY_ATTACHMENT, attachment, upload.pet_id, OP_CREATE)
+    db.commit()
+    db.refresh(attachment)
+    return attachment
+
+
+def cancel_upload(db: Session, upload: AttachmentUpload) -> None:
+    storage = get_storage()
+    storage.discard_staged(storage.staging_path(upload.staged_name))
+    db.delete(upload)
+    db.commit()
+
+
+def purge_expired_uploads(
+    db: Session, expiry_hours: int = UPLOAD_EXPIRY_HOURS
+) -> int:
+    """Drop uploads idle for expiry_hours together with their staged files"""
+    cutoff = datetime.utcnow() - timedelta(hours=expiry_hours)
+    storage = get_storage()
+    purged = 0
+    while True:
+        expired: List[AttachmentUpload] = (
+            db.query(AttachmentUpload)
+            .filter(AttachmentUpload.updated_at < cutoff)
+            .order_by(AttachmentUpload.updated_at)
+            .limit(PURGE_BATCH_SIZE)
+            .all()
+        )
+        if not expired:
+            return purged
+        for upload in expired:
+            storage.discard_staged(storage.staging_path(upload.staged_name))
+            db.delete(upload)
+        db.commit()
+        purged += len(expired)
+
+
+def requested_range(header: Optional[str], size_bytes: int) -> Optional[ByteRange]:
+    """The single byte range asked for by a Range header, None for all of it.
+
+    Multiple ranges are answered with the whole file, as RFC 9110 allows.
+    """
+    match = BYTE_RANGE.match(header or "")
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(size_bytes - int(last), 0), size_bytes - 1
+    else:
+        start = int(first)
+        end = min(int(last), size_bytes - 1) if last else size_bytes - 1
+    if start >= size_bytes or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size_bytes}"},
+        )
+    return ByteRange(start, end)
+
+
+def read_range(key: str, byte_range: ByteRange) -> Iterator[bytes]:
+    """The bytes of a blob's range, read one buffer at a time"""
+    with get_storage().open_object(key) as file:
+        file.seek(byte_range.start)
+        remaining = byte_range.length
+        while remaining:
+            chunk = file.read(min(IO_CHUNK_BYTES, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+class FileRangeResponse(FileResponse):
+    """206 Partial Content for one byte range of a file on local disk.
+
+    The range goes to the server's sendfile when it offers the ASGI
+    zero-copy send extension; otherwise it is read in FileResponse's
+    chunk size, straight from the file like a whole-file download.
+    """
+
+    def __init__(self, path: str, byte_range: ByteRange, **kwargs) -> None:
+        super().__init__(path, status_code=206, **kwargs)
+        self.byte_range = byte_range
+        self.headers["content-length"] = str(byte_range.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+        elif ZERO_COPY_SEND in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send(
+                    {
+                        "type": ZERO_COPY_SEND,
+                        "file": file.fileno(),
+                        "offset": self.byte_range.start,
+                        "count": self.byte_range.length,
+                    }
+                )
+        else:
+            await self.send_chunks(send)
+
+    async def send_chunks(self, send: Send) -> None:
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.byte_range.start)
+            remaining = self.byte_range.length
+            while remaining:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining = remaining - len(chunk) if chunk else 0
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": bool(remaining),
+                    }
+                )
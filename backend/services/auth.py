@@ -0,0 +1,121 @@
+"""Who is making a request, behind a pluggable authentication backend.
+
+Routes take current_user_id as a dependency and scope every query by it.
+Routes under /pets/{pet_id} take owned_pet instead (routers add it as a
+router dependency), so no pet-scoped route can skip the ownership check.
+The backend is chosen by AUTH_BACKEND:
+- "token" (default): "Authorization: Bearer <user_id>.<signature>", the
+  signature being an HMAC-SHA256 of the user id under AUTH_SECRET. It
+  stands in for an identity provider; `python jobs.py issue-token`
+  prints a user's token. Links that cannot send headers (EventSource,
+  downloads) may pass the token as ?access_token= instead.
+- "dev": no credentials; every request acts as DEV_USER_ID, for local
+  development with the single-user frontend.
+
+Another provider (OIDC, sessions) only needs an authenticate(request)
+method returning the user's id, or None when the request carries no
+valid credentials.
+"""
+import hashlib
+import hmac
+import os
+from typing import Optional
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+
+from database import get_db
+from models import Pet
+
+BEARER_PREFIX = "Bearer "
+TOKEN_QUERY_PARAM = "access_token"
+DEFAULT_DEV_USER_ID = 1
+
+
+class TokenAuthenticator:
+    """Self-verifying user tokens signed with a shared secret"""
+
+    def __init__(self, secret: str) -> None:
+        if not secret:
+            raise RuntimeError("AUTH_SECRET is required for AUTH_BACKEND=token")
+        self.secret = secret.encode()
+
+    def signature(self, user_id: int) -> str:
+        return hmac.new(self.secret, str(user_id).encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, user_id: int) -> str:
+        return f"{user_id}.{self.signature(user_id)}"
+
+    def authenticate(self, request: Request) -> Optional[int]:
+        header = request.headers.get("authorization", "")
+        if header.startswith(BEARER_PREFIX):
+            token = header[len(BEARER_PREFIX):].strip()
+        else:
+            token = request.query_params.get(TOKEN_QUERY_PARAM, "")
+        user_id, _, signature = token.partition(".")
+        if not user_id.isdigit():
+            return None
+        # Constant-time comparison, so timing reveals nothing of the signature
+        if not hmac.compare_digest(signature, self.signature(int(user_id))):
+            return None
+        return int(user_id)
+
+
+class DevAuthenticator:
+    """Every request is the same user; for development only"""
+
+    def __init__(self, user_id: int) -> None:
+        self.user_id = user_id
+
+    def authenticate(self, request: Request) -> Optional[int]:
+        return self.user_id
+
+
+_authenticator = None
+
+
+def get_authenticator():
+    """Authenticator selected by AUTH_BACKEND, created on first use"""
+    global _authenticator
+    if _authenticator is None:
+        backend = os.getenv("AUTH_BACKEND", "token")
+        if backend == "token":
+            _authenticator = TokenAuthenticator(os.getenv("AUTH_SECRET", ""))
+        elif backend == "dev":
+            user_id = int(os.getenv("DEV_USER_ID", DEFAULT_DEV_USER_ID))
+            _authenticator = DevAuthenticator(user_id)
+        else:
+            raise RuntimeError(f"Unsupported AUTH_BACKEND: {backend}")
+    return _authenticator
+
+
+def current_user_id(request: Request) -> int:
+    """Id of the authenticated user (401 without valid credentials)"""
+    user_id = get_authenticator().authenticate(request)
+    if user_id is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user_id
+
+
+def find_owned_pet(db: Session, pet_id: int, user_id: int) -> Optional[Pet]:
+    """The user's pet, unless deleted"""
+    return (
+        db.query(Pet)
+        .filter(Pet.id == pet_id, Pet.user_id == user_id, Pet.is_deleted == 0)
+        .first()
+    )
+
+
+def owned_pet(
+    pet_id: int,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db),
+) -> Pet:
+    """The authenticated user's live pet of the path (404 otherwise)"""
+    pet = find_owned_pet(db, pet_id, user_id)
+    if not pet:
+        raise HTTPException(status_code=404, detail="Pet not found")
+    return pet
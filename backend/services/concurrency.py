@@ -0,0 +1,33 @@
+"""Optimistic concurrency: row versions exposed as ETag / If-Match"""
+from typing import Optional
+from fastapi import HTTPException, Response
+
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Get the version required by an If-Match header (None when unconditional)"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+
+def version_conflict() -> HTTPException:
+    """412 response for a write against an outdated version"""
+    return HTTPException(status_code=412, detail="Resource has been modified")
+
+
+def check_version(row, expected: Optional[int]) -> None:
+    """Reject the request when the loaded row is not at the expected version"""
+    if expected is not None and row.version != expected:
+        raise version_conflict()
+
+
+def set_etag(response: Response, version: int) -> None:
+    """Expose the row version so clients can send it back in If-Match"""
+    response.headers["ETag"] = f'"{version}"'
@@ -0,0 +1,153 @@
+"""Dose calendar: medication schedules expanded into medication_doses.
+
+A medication with times_per_day set is scheduled every interval_days days
+(default 1) from start_on, on the weekdays in days_of_week (default all).
+Doses are materialized up to DOSE_HORIZON_DAYS ahead so the calendar API
+is a range scan; the extend-doses job keeps the horizon rolling. Edits
+regenerate doses from today on only.
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from models import MedicationDose, RecordMedication
+from schemas import ALL_DAYS_OF_WEEK
+
+DOSE_HORIZON_DAYS = 90
+DEFAULT_INTERVAL_DAYS = 1
+
+SCHEDULE_COLUMNS = (
+    RecordMedication.id,
+    RecordMedication.pet_id,
+    RecordMedication.start_on,
+    RecordMedication.end_on,
+    RecordMedication.interval_days,
+    RecordMedication.times_per_day,
+    RecordMedication.days_of_week,
+)
+
+
+def horizon_end(today: Optional[date] = None) -> date:
+    """Last day doses are materialized for"""
+    return (today or date.today()) + timedelta(days=DOSE_HORIZON_DAYS)
+
+
+def dose_dates(schedule, first: date, last: date) -> Iterator[date]:
+    """Days in [first, last] on which the schedule has doses"""
+    first = max(first, schedule.start_on)
+    if schedule.end_on is not None:
+        last = min(last, schedule.end_on)
+    interval = schedule.interval_days or DEFAULT_INTERVAL_DAYS
+    weekdays = schedule.days_of_week or ALL_DAYS_OF_WEEK
+
+    # First day on the interval grid anchored at start_on
+    steps = -(-(first - schedule.start_on).days // interval)
+    day = schedule.start_on + timedelta(days=steps * interval)
+    step = timedelta(days=interval)
+    while day <= last:
+        if weekdays & (1 << day.weekday()):
+            yield day
+        day += step
+
+
+def expand(db: Session, schedule, first: date, last: date) -> int:
+    """Insert the dose rows of one schedule between first and last"""
+    rows = [
+        {
+            "medication_id": schedule.id,
+            "pet_id": schedule.pet_id,
+            "dose_on": day,
+            "doses": schedule.times_per_day,
+        }
+        for day in dose_dates(schedule, first, last)
+    ]
+    if rows:
+        db.execute(insert(MedicationDose), rows)
+    return len(rows)
+
+
+def medication_value(column):
+    """A column of the dose's medication, as a correlated subquery"""
+    return (
+        select(column)
+        .where(RecordMedication.id == MedicationDose.medication_id)
+        .scalar_subquery()
+    )
+
+
+def rebuild_doses(
+    db: Session, medication_ids: List[int], today: Optional[date] = None
+) -> None:
+    """Re-expand the given medications from today after they were written.
+
+    Past doses are history and stay, so an edit costs the days up to the
+    horizon however old the medication is; only past doses now outside
+    start_on..end_on go. A medication without doses yet is expanded from
+    its start_on. medication_doses is derived from record_medications,
+    so its rows are replaced outright rather than logically deleted.
+    """
+    if not medication_ids:
+        return
+    first_day = today or date.today()
+    expanded = set(
+        db.scalars(
+            select(MedicationDose.medication_id)
+            .where(MedicationDose.medication_id.in_(medication_ids))
+            .distinct()
+        )
+    )
+    db.query(MedicationDose).filter(
+        MedicationDose.medication_id.in_(medication_ids),
+        or_(
+            MedicationDose.dose_on >= first_day,
+            MedicationDose.dose_on < medication_value(RecordMedication.start_on),
+            MedicationDose.dose_on
+            > medication_value(RecordMedication.end_on_effective),
+        ),
+    ).delete(synchronize_session=False)
+
+    schedules = (
+        db.query(*SCHEDULE_COLUMNS)
+        .filter(
+            RecordMedication.id.in_(medication_ids),
+            RecordMedication.is_deleted == 0,
+            RecordMedication.times_per_day.isnot(None),
+        )
+        .all()
+    )
+    last = horizon_end(first_day)
+    for schedule in schedules:
+        first = first_day if schedule.id in expanded else schedule.start_on
+        expand(db, schedule, first, last)
+
+
+def extend_dose_horizon(db: Session, today: Optional[date] = None) -> int:
+    """Expand every live schedule up to the current horizon.
+
+    Each medication continues from its last materialized day, so a daily
+    run only inserts one new day per schedule.
+    """
+    last = horizon_end(today)
+    latest: Dict[int, date] = dict(
+        db.query(MedicationDose.medication_id, func.max(MedicationDose.dose_on))
+        .group_by(MedicationDose.medication_id)
+        .all()
+    )
+    schedules = (
+        db.query(*SCHEDULE_COLUMNS)
+        .filter(
+            RecordMedication.is_deleted == 0,
+            RecordMedication.times_per_day.isnot(None),
+            RecordMedication.end_on_effective > (today or date.today()),
+        )
+        .all()
+    )
+
+    inserted = 0
+    for schedule in schedules:
+        done = latest.get(schedule.id)
+        first = done + timedelta(days=1) if done else schedule.start_on
+        inserted += expand(db, schedule, first, last)
+    db.commit()
+    return inserted
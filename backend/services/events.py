@@ -0,0 +1,237 @@
+"""Live change notifications: an in-process bus fed by committed writes.
+
+Every write handler already appends its change events to the outbox
+(record_change). Session hooks snapshot those events when they are
+flushed and hand them to the configured broker once the transaction
+commits; rolled-back events are dropped. The broker delivers them to the
+EventBus of each worker, which fans them out to the SSE subscribers of
+the pet.
+
+Brokers (EVENT_BROKER):
+- "local" (default): stand-in for a single worker; events go straight to
+  this process's bus.
+- "outbox": cross-worker fan-out without extra infrastructure; every
+  worker tails change_events and feeds its own bus, so a write made in
+  one worker reaches subscribers connected to any other.
+
+A broker backed by a message server only needs publish, start and stop.
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import ChangeEvent
+import schemas
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 1000
+# Subscription key for the events of every pet
+ALL_PETS = None
+OUTBOX_POLL_SECONDS = 1.0
+OUTBOX_BATCH_SIZE = 1000
+
+# Session.info keys
+PENDING_EVENTS = "pending_change_events"
+HOLD_EVENTS = "hold_change_events"
+
+
+class Subscription:
+    """Queue of one SSE client; overflowed subscribers are disconnected.
+
+    A subscription to ALL_PETS gets the events of every pet.
+    """
+
+    def __init__(self, pet_id: Optional[int]) -> None:
+        self.pet_id = pet_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, change: schemas.ChangeEvent) -> None:
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            # The client resumes from its Last-Event-ID after reconnecting
+            self.overflowed = True
+
+
+class EventBus:
+    """Fan-out of committed change events to this worker's subscribers"""
+
+    def __init__(self) -> None:
+        self.subscribers: Dict[Optional[int], Set[Subscription]] = defaultdict(set)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.broker = None
+
+    def publish(self, changes: List[schemas.ChangeEvent]) -> None:
+        """Hand committed events to the broker, which feeds every worker's bus"""
+        if not changes or self.broker is None:
+            return
+        try:
+            self.broker.publish(changes)
+        except Exception:
+            logger.exception("publishing change events failed")
+
+    def subscribe(self, pet_id: Optional[int]) -> Subscription:
+        subscription = Subscription(pet_id)
+        self.subscribers[pet_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self.subscribers.get(subscription.pet_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[subscription.pet_id]
+
+    def deliver(self, changes: List[schemas.ChangeEvent]) -> None:
+        """Queue events for their pets' subscribers (event loop thread only)"""
+        for change in changes:
+            for key in (change.pet_id, ALL_PETS):
+                for subscription in list(self.subscribers.get(key, ())):
+                    subscription.put(change)
+
+    def deliver_threadsafe(self, changes: List[schemas.ChangeEvent]) -> None:
+        """Deliver from any thread, e.g. a sync route's worker thread"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.deliver, changes)
+
+
+bus = EventBus()
+
+
+class LocalBroker:
+    """Single-worker stand-in: publishes straight to this process's bus"""
+
+    def __init__(self, event_bus: EventBus) -> None:
+        self.bus = event_bus
+
+    def publish(self, changes: List[schemas.ChangeEvent]) -> None:
+        self.bus.deliver_threadsafe(changes)
+
+    async def start(self) -> None:
+        self.bus.loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        self.bus.loop = None
+
+
+class OutboxBroker:
+    """Cross-worker fan-out: each worker tails change_events into its bus"""
+
+    def __init__(self, event_bus: EventBus, session_factory) -> None:
+        self.bus = event_bus
+        self.session_factory = session_factory
+        self.last_seq = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self, changes: List[schemas.ChangeEvent]) -> None:
+        """Nothing to send: the committed outbox rows are the messages"""
+
+    def poll(self) -> List[schemas.ChangeEvent]:
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(ChangeEvent)
+                .filter(ChangeEvent.seq > self.last_seq)
+                .order_by(ChangeEvent.seq)
+                .limit(OUTBOX_BATCH_SIZE)
+                .all()
+            )
+            changes = [schemas.ChangeEvent.model_validate(row) for row in rows]
+        finally:
+            db.close()
+        if changes:
+            self.last_seq = changes[-1].seq
+        return changes
+
+    def latest_seq(self) -> int:
+        db = self.session_factory()
+        try:
+            return db.query(func.max(ChangeEvent.seq)).scalar() or 0
+        finally:
+            db.close()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                changes = await asyncio.to_thread(self.poll)
+                self.bus.deliver(changes)
+                if len(changes) == OUTBOX_BATCH_SIZE:
+                    continue
+            except Exception:
+                logger.exception("outbox tail failed")
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+
+    async def start(self) -> None:
+        self.bus.loop = asyncio.get_running_loop()
+        self.last_seq = await asyncio.to_thread(self.latest_seq)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.bus.loop = None
+
+
+def build_broker(session_factory):
+    """Broker selected by EVENT_BROKER ("local" or "outbox")"""
+    if os.getenv("EVENT_BROKER", "local") == "outbox":
+        broker = OutboxBroker(bus, session_factory)
+    else:
+        broker = LocalBroker(bus)
+    bus.broker = broker
+    return broker
+
+
+def after_flush(session: Session, flush_context) -> None:
+    # Snapshot now: rows are expired by the time after_commit runs
+    session.info.setdefault(PENDING_EVENTS, []).extend(
+        schemas.ChangeEvent.model_validate(row)
+        for row in session.new
+        if isinstance(row, ChangeEvent)
+    )
+
+
+def after_commit(session: Session) -> None:
+    if not session.info.get(HOLD_EVENTS):
+        publish_held_events(session)
+
+
+def after_rollback(session: Session) -> None:
+    session.info.pop(PENDING_EVENTS, None)
+
+
+SESSION_HOOKS = (
+    ("after_flush", after_flush),
+    ("after_commit", after_commit),
+    ("after_rollback", after_rollback),
+)
+
+
+def attach_session_events(session_factory) -> None:
+    """Publish the change events of every committed session of the factory"""
+    for name, hook in SESSION_HOOKS:
+        if not event.contains(session_factory, name, hook):
+            event.listen(session_factory, name, hook)
+
+
+def hold_events(session: Session) -> None:
+    """Keep a session's events past its commits until publish_held_events.
+
+    For sessions whose commits only release savepoints of an outer
+    transaction that may still roll back.
+    """
+    session.info[HOLD_EVENTS] = True
+
+
+def publish_held_events(session: Session) -> None:
+    bus.publish(session.info.pop(PENDING_EVENTS, None))
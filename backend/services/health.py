@@ -0,0 +1,167 @@
+"""Readiness from a background probe of the database and the pool.
+
+Health endpoints never touch the database themselves: a load balancer
+polling them would add load exactly when the database is struggling,
+and a hung check would look like a dead process. Instead every process
+runs a HealthProbe that, every HEALTH_PROBE_SECONDS:
+- times a SELECT 1 on the primary over a connection of its own, so a
+  saturated pool does not hide the database's latency,
+- samples how many of this process's pooled connections are in use.
+
+/readyz answers from the last WINDOW_SAMPLES samples. The process
+reports itself not ready (503) while the median DB latency exceeds
+READY_MAX_DB_LATENCY_MS, the mean pool use exceeds
+READY_MAX_POOL_SATURATION, the last probe failed or is stale, or it is
+shutting down, so the balancer moves traffic elsewhere before requests
+queue up for connections. /livez only says the event loop is running.
+"""
+import asyncio
+import logging
+import os
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROBE_SECONDS = 2.0
+DEFAULT_MAX_DB_LATENCY_MS = 250.0
+DEFAULT_MAX_POOL_SATURATION = 0.9
+WINDOW_SAMPLES = 5
+# A probe result older than this many intervals no longer counts
+STALE_INTERVALS = 3
+MS_PER_SECOND = 1000
+
+
+@dataclass
+class Readiness:
+    ready: bool
+    reasons: List[str]
+    db_error: Optional[str]
+    db_latency_ms: Optional[float]
+    pool_saturation: Optional[float]
+    checked_at: Optional[float]
+
+
+@dataclass
+class ProbeWindow:
+    latencies_ms: Deque[float] = field(
+        default_factory=lambda: deque(maxlen=WINDOW_SAMPLES)
+    )
+    saturations: Deque[float] = field(
+        default_factory=lambda: deque(maxlen=WINDOW_SAMPLES)
+    )
+    error: Optional[str] = "not probed yet"
+    checked_at: Optional[float] = None
+
+
+class HealthProbe:
+    """Samples the primary's latency and the pool's use on a timer"""
+
+    def __init__(self) -> None:
+        self.interval = DEFAULT_PROBE_SECONDS
+        self.max_latency_ms = DEFAULT_MAX_DB_LATENCY_MS
+        self.max_saturation = DEFAULT_MAX_POOL_SATURATION
+        self.engine: Optional[Engine] = None
+        self.probe_engine: Optional[Engine] = None
+        self.pool_capacity = 1
+        self.window = ProbeWindow()
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, engine: Optional[Engine], pool_capacity: int) -> None:
+        """Probe in the background; without a database, stay not ready"""
+        self.interval = float(os.getenv("HEALTH_PROBE_SECONDS", DEFAULT_PROBE_SECONDS))
+        self.max_latency_ms = float(
+            os.getenv("READY_MAX_DB_LATENCY_MS", DEFAULT_MAX_DB_LATENCY_MS)
+        )
+        self.max_saturation = float(
+            os.getenv("READY_MAX_POOL_SATURATION", DEFAULT_MAX_POOL_SATURATION)
+        )
+        self.engine = engine
+        self.pool_capacity = pool_capacity
+        self.stopping = False
+        if engine is None:
+            self.window.error = "DATABASE_URL is not set"
+            return
+        # One connection kept open for the probe, outside the app's pool
+        self.probe_engine = create_engine(
+            engine.url, pool_size=1, max_overflow=0, pool_pre_ping=True
+        )
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        self.stopping = True
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.probe_engine:
+            self.probe_engine.dispose()
+
+    def ping(self) -> float:
+        """Milliseconds for a SELECT 1 on the probe's connection"""
+        started = time.perf_counter()
+        with self.probe_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return (time.perf_counter() - started) * MS_PER_SECOND
+
+    async def sample(self) -> None:
+        window = self.window
+        window.saturations.append(self.engine.pool.checkedout() / self.pool_capacity)
+        try:
+            latency = await asyncio.wait_for(
+                asyncio.to_thread(self.ping), self.interval
+            )
+        except asyncio.TimeoutError:
+            window.error = f"database did not answer within {self.interval:g}s"
+        except Exception as e:
+            logger.warning("database probe failed: %s", e)
+            window.error = "database unreachable"
+        else:
+            window.latencies_ms.append(latency)
+            window.error = None
+        window.checked_at = time.time()
+
+    async def run(self) -> None:
+        while True:
+            await self.sample()
+            await asyncio.sleep(self.interval)
+
+    def readiness(self) -> Readiness:
+        """Judge the last samples; never touches the database"""
+        window = self.window
+        latency = (
+            statistics.median(window.latencies_ms) if window.latencies_ms else None
+        )
+        saturation = (
+            statistics.fmean(window.saturations) if window.saturations else None
+        )
+        reasons = []
+        if self.stopping:
+            reasons.append("shutting down")
+        if window.error:
+            reasons.append(window.error)
+        elif time.time() - window.checked_at > STALE_INTERVALS * self.interval:
+            reasons.append("database probe is stale")
+        if latency is not None and latency > self.max_latency_ms:
+            reasons.append(f"database latency {latency:.0f}ms")
+        if saturation is not None and saturation > self.max_saturation:
+            reasons.append(f"connection pool {saturation:.0%} in use")
+        return Readiness(
+            ready=not reasons,
+            reasons=reasons,
+            db_error=window.error,
+            db_latency_ms=None if latency is None else round(latency, 1),
+            pool_saturation=None if saturation is None else round(saturation, 2),
+            checked_at=window.checked_at,
+        )
+
+
+health_probe = HealthProbe()
@@ -0,0 +1,55 @@
+"""Transactional outbox: change events written alongside pet data"""
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import Session
+
+from models import ChangeEvent
+
+ENTITY_PET = "pet"
+ENTITY_RECORD = "record"
+ENTITY_WEIGHT = "weight"
+ENTITY_MEDICATION = "medication"
+ENTITY_VET_VISIT = "vet_visit"
+ENTITY_ATTACHMENT = "attachment"
+
+OP_CREATE = "create"
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+
+
+def record_change(
+    db: Session,
+    entity: str,
+    entity_id: int,
+    pet_id: int,
+    op: str,
+    version: Optional[int] = None,
+) -> None:
+    """Append a change event to the outbox in the caller's transaction.
+
+    The event is only added to the session, so it is committed or rolled
+    back together with the write it describes.
+    """
+    db.add(
+        ChangeEvent(
+            entity=entity,
+            entity_id=entity_id,
+            pet_id=pet_id,
+            op=op,
+            version=version,
+        )
+    )
+
+
+def record_row_change(db: Session, entity: str, row, pet_id: int, op: str) -> None:
+    """Flush a changed row and append its change event with the new version"""
+    db.flush()
+    record_change(db, entity, row.id, pet_id, op, row.version)
+
+
+def record_row_changes(
+    db: Session, changes: List[Tuple[str, object, str]], pet_id: int
+) -> None:
+    """Flush and append change events for (entity, row, op) entries"""
+    db.flush()
+    for entity, row, op in changes:
+        record_change(db, entity, row.id, pet_id, op, row.version)
@@ -0,0 +1,167 @@
+"""Yearly range partitioning of records and their child tables (MySQL).
+
+records, record_weights, record_medications and record_vet_visits are
+partitioned BY RANGE COLUMNS on their own date, one partition per
+calendar year plus pmax for anything later. Queries that compare that
+date column directly (no functions around it) are pruned to the
+partitions of the years they ask for, which is why the routes filter
+children on their denormalized pet_id and date instead of joining
+records.
+
+MySQL requires the partitioning column in every unique key and does not
+allow foreign keys on partitioned tables, so partitioning:
+- drops the foreign keys from and to these tables (the ORM keeps them
+  as metadata for joins; the application keeps the references intact),
+- turns the primary key into (id, date column); id stays auto-increment
+  and unique, and the ORM still identifies rows by id alone.
+
+Old years are archived a partition at a time (services.archive).
+"""
+from datetime import date
+from typing import Dict, List, Set
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models import Record, RecordWeight, RecordMedication, RecordVetVisit
+
+DEFAULT_YEARS_AHEAD = 2
+
+YEAR_PREFIX = "p"
+OVERFLOW_PARTITION = "pmax"
+
+# Children before records, so a year's rows leave in reference order
+PARTITION_COLUMNS = {
+    RecordWeight: RecordWeight.measured_on,
+    RecordMedication: RecordMedication.start_on,
+    RecordVetVisit: RecordVetVisit.visited_on,
+    Record: Record.recorded_on,
+}
+PARTITIONED_NAMES = tuple(model.__tablename__ for model in PARTITION_COLUMNS)
+
+
+def is_mysql(db: Session) -> bool:
+    return db.get_bind().dialect.name == "mysql"
+
+
+def require_mysql(db: Session) -> None:
+    if not is_mysql(db):
+        raise RuntimeError("Table partitioning is only supported on MySQL")
+
+
+def year_partitions(db: Session, table: str) -> List[int]:
+    """Years that have their own partition in the table, ascending"""
+    if not is_mysql(db):
+        return []
+    names = db.execute(
+        text(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS"
+            " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+            " AND PARTITION_NAME IS NOT NULL"
+        ),
+        {"table": table},
+    ).scalars()
+    return sorted(
+        int(name[len(YEAR_PREFIX):])
+        for name in names
+        if name != OVERFLOW_PARTITION
+    )
+
+
+def partitioned_tables(db: Session) -> Set[str]:
+    """Which of the partitionable tables are partitioned already"""
+    return {table for table in PARTITIONED_NAMES if year_partitions(db, table)}
+
+
+def year_partition(year: int) -> str:
+    boundary = date(year + 1, 1, 1).isoformat()
+    return f"PARTITION {YEAR_PREFIX}{year} VALUES LESS THAN ('{boundary}')"
+
+
+def partition_list(years: range) -> str:
+    partitions = [year_partition(year) for year in years]
+    partitions.append(f"PARTITION {OVERFLOW_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    return "(" + ", ".join(partitions) + ")"
+
+
+def drop_foreign_keys(db: Session) -> None:
+    """Drop every foreign key from or to the partitionable tables"""
+    names = ", ".join(f"'{table}'" for table in PARTITIONED_NAMES)
+    constraints = db.execute(
+        text(
+            "SELECT TABLE_NAME, CONSTRAINT_NAME"
+            " FROM information_schema.REFERENTIAL_CONSTRAINTS"
+            " WHERE CONSTRAINT_SCHEMA = DATABASE()"
+            f" AND (TABLE_NAME IN ({names}) OR REFERENCED_TABLE_NAME IN ({names}))"
+        )
+    ).all()
+    for table, constraint in constraints:
+        db.execute(text(f"ALTER TABLE {table} DROP FOREIGN KEY {constraint}"))
+
+
+def first_year(db: Session, model) -> int:
+    """Year of the table's earliest row (this year when it is empty)"""
+    column = PARTITION_COLUMNS[model]
+    earliest = db.query(column).order_by(column).limit(1).scalar()
+    return (earliest or date.today()).year
+
+
+def partition_tables(
+    db: Session, years_ahead: int = DEFAULT_YEARS_AHEAD
+) -> Dict[str, int]:
+    """Partition the tables that are not yet; returns partitions per table.
+
+    Rebuilds each table, so run it in a maintenance window.
+    """
+    require_mysql(db)
+    drop_foreign_keys(db)
+    last_year = date.today().year + years_ahead
+    done = partitioned_tables(db)
+
+    counts = {}
+    for model, column in PARTITION_COLUMNS.items():
+        table = model.__tablename__
+        if table in done:
+            continue
+        years = range(first_year(db, model), last_year + 1)
+        db.execute(
+            text(
+                f"ALTER TABLE {table} DROP PRIMARY KEY,"
+                f" ADD PRIMARY KEY (id, {column.name})"
+            )
+        )
+        db.execute(
+            text(
+                f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS({column.name})"
+                f" {partition_list(years)}"
+            )
+        )
+        counts[table] = len(years)
+    return counts
+
+
+def add_partitions(
+    db: Session, years_ahead: int = DEFAULT_YEARS_AHEAD
+) -> Dict[str, int]:
+    """Split pmax so every year up to years_ahead has its own partition.
+
+    pmax only holds rows dated beyond the last year partition, so run
+    this (yearly at least) before such rows appear and the split stays
+    a metadata change.
+    """
+    require_mysql(db)
+    last_year = date.today().year + years_ahead
+    counts = {}
+    for table in PARTITIONED_NAMES:
+        existing = year_partitions(db, table)
+        if not existing or existing[-1] >= last_year:
+            counts[table] = 0
+            continue
+        years = range(existing[-1] + 1, last_year + 1)
+        db.execute(
+            text(
+                f"ALTER TABLE {table} REORGANIZE PARTITION {OVERFLOW_PARTITION}"
+                f" INTO {partition_list(years)}"
+            )
+        )
+        counts[table] = len(years)
+    return counts
@@ -0,0 +1,102 @@
+"""Partial updates issued as a single UPDATE of the changed columns"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+
+def supports_returning(db: Session) -> bool:
+    """Whether the bound backend can return rows from an UPDATE"""
+    return db.get_bind().dialect.update_returning
+
+
+def row_values(row, model) -> Dict[str, Any]:
+    """Column values of a loaded row"""
+    columns = model.__table__.columns
+    return {column.name: getattr(row, column.name) for column in columns}
+
+
+def pin_version(expected_version: Optional[int], read_version: int) -> int:
+    """Version to make a patch conditional on, after reading the row first.
+
+    Values read before the UPDATE belong to the row it replaces only if
+    nobody wrote the row in between, so the UPDATE must match the version
+    they were read at; one the client asked for must be that same one.
+    """
+    if expected_version is not None and expected_version != read_version:
+        raise StaleDataError("row has been modified")
+    return read_version
+
+
+def load_row(
+    db: Session, model, criteria: List, expected_version: Optional[int]
+):
+    """Load the matching row, rejecting it when it is at another version"""
+    row = db.query(model).filter(*criteria).first()
+    if row and expected_version is not None and row.version != expected_version:
+        raise StaleDataError(f"{model.__tablename__} {row.id} has been modified")
+    return row
+
+
+def update_returning(
+    db: Session,
+    model,
+    criteria: List,
+    values: Dict[str, Any],
+    expected_version: Optional[int],
+) -> Optional[Dict[str, Any]]:
+    """Run the UPDATE and read the new row back in the same statement"""
+    conditions = list(criteria)
+    if expected_version is not None:
+        conditions.append(model.version == expected_version)
+
+    statement = (
+        update(model)
+        .where(*conditions)
+        .values(**values, version=model.version + 1)
+        .returning(*model.__table__.columns)
+        .execution_options(synchronize_session=False)
+    )
+    row = db.execute(statement).mappings().first()
+    if row:
+        return dict(row)
+
+    # Only a conditional update needs the extra probe to tell 404 from 412
+    if expected_version is not None and db.query(model.id).filter(*criteria).first():
+        raise StaleDataError(f"{model.__tablename__} has been modified")
+    return None
+
+
+def patch_row(
+    db: Session,
+    model,
+    criteria: List,
+    changes: Dict[str, Any],
+    expected_version: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """Write only the changed columns of the matching row and return its values.
+
+    With RETURNING support this is one UPDATE round trip. Otherwise the row
+    is loaded once, the ORM flushes an UPDATE of the changed attributes and
+    the values are taken from memory instead of refreshing. Returns None
+    when no row matches and raises StaleDataError when expected_version is
+    given and the row has moved on.
+    """
+    if not changes:
+        row = load_row(db, model, criteria, expected_version)
+        return row_values(row, model) if row else None
+
+    values = dict(changes, updated_at=datetime.utcnow())
+
+    if supports_returning(db):
+        return update_returning(db, model, criteria, values, expected_version)
+
+    row = load_row(db, model, criteria, expected_version)
+    if not row:
+        return None
+    for name, value in values.items():
+        setattr(row, name, value)
+    db.flush()
+
+    return row_values(row, model)
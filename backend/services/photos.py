@@ -0,0 +1,233 @@
+"""Pet photos: streamed uploads, content-hash names and resized variants.
+
+An upload is streamed from the request body into a staging file while it
+is hashed, then stored as photos/<sha256>.<ext>, so the name changes
+whenever the content does and every URL can be cached forever. Resized
+JPEG variants (photos/<sha256>_<variant>.jpg) are rendered by a process
+pool after the response has been sent; until a variant is ready the
+original is served in its place.
+
+The pet's photo_url points at the original, and photo_urls() derives the
+variant URLs from it.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+# Pillow is only needed by the thumbnail workers; the web process does
+# not load it
+if TYPE_CHECKING:
+    from PIL import Image
+
+from services.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+PHOTO_PREFIX = "photos"
+PHOTO_URL_PREFIX = "/api/photos/"
+MAX_PHOTO_BYTES = 20 * 1024 * 1024
+
+# Longest edge in pixels of each variant
+VARIANTS = {"thumb": 160, "medium": 640}
+VARIANT_EXTENSION = "jpg"
+VARIANT_QUALITY = 85
+# Background of transparent pixels once flattened into a JPEG
+VARIANT_BACKGROUND = (255, 255, 255)
+
+DEFAULT_THUMBNAIL_WORKERS = 2
+
+MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+SNIFF_BYTES = 12
+
+PHOTO_NAME = re.compile(
+    r"^(?P<digest>[0-9a-f]{64})"
+    rf"(?:_(?P<variant>{'|'.join(VARIANTS)}))?"
+    rf"\.(?P<ext>{'|'.join(MEDIA_TYPES)})$"
+)
+
+
+def sniff_extension(head: bytes) -> Optional[str]:
+    """Image format from the file's leading bytes, whatever the client claims"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def photo_key(name: str) -> str:
+    return f"{PHOTO_PREFIX}/{name}"
+
+
+def variant_name(digest: str, variant: str) -> str:
+    return f"{digest}_{variant}.{VARIANT_EXTENSION}"
+
+
+def photo_urls(photo_url: Optional[str]) -> Optional[Dict[str, str]]:
+    """URLs of the original and every variant of an uploaded photo.
+
+    None when the pet has no photo or photo_url links somewhere else.
+    """
+    if not photo_url or not photo_url.startswith(PHOTO_URL_PREFIX):
+        return None
+    match = PHOTO_NAME.match(photo_url[len(PHOTO_URL_PREFIX):])
+    if not match or match["variant"]:
+        return None
+    urls = {"original": photo_url}
+    for variant in VARIANTS:
+        urls[variant] = PHOTO_URL_PREFIX + variant_name(match["digest"], variant)
+    return urls
+
+
+def declared_length(request: Request) -> Optional[int]:
+    try:
+        return int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413, detail=f"Photo exceeds {MAX_PHOTO_BYTES} bytes"
+    )
+
+
+async def receive_photo(request: Request) -> str:
+    """Stream the request body into storage and return the photo's name.
+
+    The body is hashed and written chunk by chunk, so memory use does not
+    depend on the photo's size.
+    """
+    length = declared_length(request)
+    if length is not None and length > MAX_PHOTO_BYTES:
+        raise too_large()
+
+    storage = get_storage()
+    digest = hashlib.sha256()
+    head = b""
+    size = 0
+    staged = storage.new_staging_file()
+
+    def write(chunk: bytes) -> None:
+        digest.update(chunk)
+        staged.write(chunk)
+
+    try:
+        with staged:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_PHOTO_BYTES:
+                    raise too_large()
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[: SNIFF_BYTES - len(head)]
+                await run_in_threadpool(write, chunk)
+
+        extension = sniff_extension(head)
+        if extension is None:
+            raise HTTPException(
+                status_code=415, detail="Photo must be a JPEG, PNG or WebP image"
+            )
+        name = f"{digest.hexdigest()}.{extension}"
+        await run_in_threadpool(storage.put_object, photo_key(name), staged.name)
+    finally:
+        storage.discard_staged(staged.name)
+    return name
+
+
+def flatten(image: "Image.Image") -> "Image.Image":
+    """RGB copy of an image, with transparency composited onto a background"""
+    from PIL import Image
+
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, VARIANT_BACKGROUND)
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def render_variants(source_path: str, targets: List[Tuple[int, str]]) -> None:
+    """Write a JPEG of the image per (longest edge, path), in a worker process"""
+    from PIL import Image, ImageOps
+
+    largest = max(edge for edge, _ in targets)
+    with Image.open(source_path) as source:
+        # JPEGs are decoded at a reduced scale when that still covers the
+        # largest variant, which skips most of the decoding work
+        source.draft("RGB", (largest, largest))
+        image = flatten(ImageOps.exif_transpose(source))
+
+    # Largest first, so each variant is resized from the previous one
+    for edge, target in sorted(targets, reverse=True):
+        image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        image.save(
+            target, "JPEG", quality=VARIANT_QUALITY, optimize=True, progressive=True
+        )
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def thumbnail_pool() -> ProcessPoolExecutor:
+    """Worker processes for rendering variants, started on first use"""
+    global _pool
+    if _pool is None:
+        workers = int(os.getenv("THUMBNAIL_WORKERS", DEFAULT_THUMBNAIL_WORKERS))
+        # Spawned, not forked: the server process runs threads and an event loop
+        _pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown_thumbnail_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def store_variants(digest: str, staged: Dict[str, str], future: Future) -> None:
+    """Move rendered variants into storage (runs when the render finishes)"""
+    storage = get_storage()
+    try:
+        future.result()
+        for variant, path in staged.items():
+            storage.put_object(photo_key(variant_name(digest, variant)), path)
+    except Exception:
+        logger.exception("rendering variants of photo %s failed", digest)
+    finally:
+        for path in staged.values():
+            storage.discard_staged(path)
+
+
+def schedule_variants(name: str) -> None:
+    """Render the photo's missing variants in the background"""
+    storage = get_storage()
+    digest = PHOTO_NAME.match(name)["digest"]
+    missing = [
+        variant
+        for variant in VARIANTS
+        if storage.head_object(photo_key(variant_name(digest, variant))) is None
+    ]
+    if not missing:
+        return
+
+    staged = {}
+    for variant in missing:
+        with storage.new_staging_file() as file:
+            staged[variant] = file.name
+    targets = [(VARIANTS[variant], staged[variant]) for variant in missing]
+    future = thumbnail_pool().submit(
+        render_variants, storage.local_path(photo_key(name)), targets
+    )
+    future.add_done_callback(partial(store_variants, digest, staged))
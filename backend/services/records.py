@@ -0,0 +1,228 @@
+"""Helpers for the daily records that child rows hang off"""
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Record, RecordWeight, RecordMedication, RecordVetVisit
+from services.outbox import (
+    record_change,
+    ENTITY_RECORD,
+    ENTITY_WEIGHT,
+    ENTITY_MEDICATION,
+    ENTITY_VET_VISIT,
+    OP_CREATE,
+    OP_UPDATE,
+    OP_DELETE,
+)
+
+INITIAL_VERSION = 1
+
+# Affected-rows value MySQL reports for a fresh INSERT ... ON DUPLICATE KEY
+MYSQL_INSERTED_ROWCOUNT = 1
+
+CHILD_ENTITIES = (
+    (RecordWeight, ENTITY_WEIGHT),
+    (RecordMedication, ENTITY_MEDICATION),
+    (RecordVetVisit, ENTITY_VET_VISIT),
+)
+
+ON_CONFLICT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+DUPLICATE_DAY_CONSTRAINT = "uq_records_pet_date_live"
+# SQLite names the columns of a violated constraint, not the constraint
+SQLITE_DUPLICATE_DAY = "records.pet_id, records.recorded_on, records.is_live"
+
+
+def is_duplicate_day(error: IntegrityError) -> bool:
+    """Whether the error violates uq_records_pet_date_live (not an FK etc.)"""
+    message = str(error.orig)
+    return DUPLICATE_DAY_CONSTRAINT in message or SQLITE_DUPLICATE_DAY in message
+
+
+def touch_record(db: Session, record_id: int) -> None:
+    """Bump a record's version after one of its children changed.
+
+    A client still holding the old record version then gets 412 from
+    update_record instead of replacing children it has not seen.
+    """
+    db.query(Record).filter(Record.id == record_id).update(
+        {"version": Record.version + 1, "updated_at": datetime.utcnow()},
+        synchronize_session=False,
+    )
+
+
+def new_record_values(pet_id: int, recorded_on: date, now: datetime) -> dict:
+    """Column values for a fresh, empty daily record"""
+    return {
+        "pet_id": pet_id,
+        "recorded_on": recorded_on,
+        "is_deleted": 0,
+        "version": INITIAL_VERSION,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def upsert_mysql(db: Session, pet_id: int, recorded_on: date) -> Tuple[int, bool]:
+    """INSERT ... ON DUPLICATE KEY UPDATE, reading the id via LAST_INSERT_ID"""
+    now = datetime.utcnow()
+    stmt = mysql.insert(Record).values(**new_record_values(pet_id, recorded_on, now))
+    stmt = stmt.on_duplicate_key_update(
+        id=func.last_insert_id(Record.id),
+        version=Record.version + 1,
+        updated_at=now,
+    )
+    result = db.execute(stmt)
+    return result.lastrowid, result.rowcount == MYSQL_INSERTED_ROWCOUNT
+
+
+def upsert_on_conflict(
+    db: Session, pet_id: int, recorded_on: date
+) -> Tuple[int, bool]:
+    """INSERT ... ON CONFLICT DO UPDATE ... RETURNING (PostgreSQL, SQLite)"""
+    now = datetime.utcnow()
+    insert = ON_CONFLICT_INSERTS[db.get_bind().dialect.name]
+    stmt = insert(Record).values(**new_record_values(pet_id, recorded_on, now))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Record.pet_id, Record.recorded_on, Record.is_live],
+        set_={"version": Record.version + 1, "updated_at": now},
+    ).returning(Record.id, Record.version)
+    record_id, version = db.execute(stmt).one()
+    return record_id, version == INITIAL_VERSION
+
+
+def select_or_insert(db: Session, pet_id: int, recorded_on: date) -> Tuple[int, bool]:
+    """Fallback for backends without an upsert: retry the SELECT on a lost race"""
+    criteria = [
+        Record.pet_id == pet_id,
+        Record.recorded_on == recorded_on,
+        Record.is_deleted == 0,
+    ]
+    record_id = db.query(Record.id).filter(*criteria).scalar()
+    if record_id is None:
+        try:
+            with db.begin_nested():
+                record = Record(pet_id=pet_id, recorded_on=recorded_on)
+                db.add(record)
+            return record.id, True
+        except IntegrityError as e:
+            if not is_duplicate_day(e):
+                raise
+            record_id = db.query(Record.id).filter(*criteria).scalar()
+
+    touch_record(db, record_id)
+    return record_id, False
+
+
+def resolve_daily_record(db: Session, pet_id: int, recorded_on: date) -> int:
+    """Id of the pet's live record for the date, creating it if needed.
+
+    One upsert against uq_records_pet_date_live, so concurrent posts for the
+    same day share a record. An existing record gets its version bumped like
+    touch_record; a new one is announced on the change feed.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        record_id, created = upsert_mysql(db, pet_id, recorded_on)
+    elif dialect in ON_CONFLICT_INSERTS:
+        record_id, created = upsert_on_conflict(db, pet_id, recorded_on)
+    else:
+        record_id, created = select_or_insert(db, pet_id, recorded_on)
+
+    if created:
+        record_change(
+            db, ENTITY_RECORD, record_id, pet_id, OP_CREATE, INITIAL_VERSION
+        )
+    return record_id
+
+
+def duplicate_days(db: Session) -> List[Tuple[int, date]]:
+    """(pet_id, recorded_on) pairs that have more than one live record"""
+    return (
+        db.query(Record.pet_id, Record.recorded_on)
+        .filter(Record.is_deleted == 0)
+        .group_by(Record.pet_id, Record.recorded_on)
+        .having(func.count(Record.id) > 1)
+        .all()
+    )
+
+
+def reparent_children(
+    db: Session, pet_id: int, keeper_id: int, duplicate_ids: List[int], now: datetime
+) -> None:
+    """Move live children of the duplicates under the kept record"""
+    for model, entity in CHILD_ENTITIES:
+        child_ids = db.scalars(
+            select(model.id).where(
+                model.record_id.in_(duplicate_ids), model.is_deleted == 0
+            )
+        ).all()
+        if not child_ids:
+            continue
+        db.query(model).filter(model.id.in_(child_ids)).update(
+            {"record_id": keeper_id, "updated_at": now, "version": model.version + 1},
+            synchronize_session=False,
+        )
+        for child_id in child_ids:
+            record_change(db, entity, child_id, pet_id, OP_UPDATE)
+
+
+def merge_day(db: Session, pet_id: int, recorded_on: date) -> int:
+    """Fold the duplicate records of one day into the oldest one.
+
+    Returns the number of records retired.
+    """
+    rows = (
+        db.query(Record.id, Record.condition, Record.note)
+        .filter(
+            Record.pet_id == pet_id,
+            Record.recorded_on == recorded_on,
+            Record.is_deleted == 0,
+        )
+        .order_by(Record.id)
+        .all()
+    )
+    keeper, duplicates = rows[0], rows[1:]
+    duplicate_ids = [row.id for row in duplicates]
+    now = datetime.utcnow()
+
+    reparent_children(db, pet_id, keeper.id, duplicate_ids, now)
+
+    # Keep the first condition/note written for the day
+    merged: Dict[str, Optional[str]] = {
+        "condition": next((row.condition for row in rows if row.condition), None),
+        "note": next((row.note for row in rows if row.note), None),
+    }
+    db.query(Record).filter(Record.id == keeper.id).update(
+        {**merged, "updated_at": now, "version": Record.version + 1},
+        synchronize_session=False,
+    )
+    db.query(Record).filter(Record.id.in_(duplicate_ids)).update(
+        {
+            "is_deleted": 1,
+            "deleted_at": now,
+            "updated_at": now,
+            "version": Record.version + 1,
+        },
+        synchronize_session=False,
+    )
+
+    record_change(db, ENTITY_RECORD, keeper.id, pet_id, OP_UPDATE)
+    for record_id in duplicate_ids:
+        record_change(db, ENTITY_RECORD, record_id, pet_id, OP_DELETE)
+    return len(duplicate_ids)
+
+
+def merge_duplicate_records(db: Session) -> int:
+    """Merge every pet's duplicate daily records, one day per transaction"""
+    retired = 0
+    for pet_id, recorded_on in duplicate_days(db):
+        retired += merge_day(db, pet_id, recorded_on)
+        db.commit()
+    return retired
@@ -0,0 +1,364 @@
+"""In-process reminder scheduler for medication doses and vet follow-ups.
+
+Upcoming reminders sit in a min-heap ordered by due time. Each source
+(dose calendar, follow-up dates) is read forward with a keyset cursor one
+page at a time, and only once none of its loaded reminders are left in
+the heap, so memory stays at about one page per source however many
+reminders are scheduled. Writes are picked up by tailing the change_events
+outbox; heap entries are re-checked against the database when they fire,
+so edited or deleted rows are dropped then.
+
+Run the scheduler in a single process only (REMINDERS_ENABLED=1), or every
+worker will send the same reminders.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from models import ChangeEvent, MedicationDose, RecordMedication, RecordVetVisit
+from services.outbox import ENTITY_MEDICATION, ENTITY_VET_VISIT
+
+logger = logging.getLogger(__name__)
+
+KIND_DOSE = "medication_dose"
+KIND_FOLLOW_UP = "vet_follow_up"
+
+DOSE_REMINDER_TIME = time(8, 0)
+FOLLOW_UP_REMINDER_TIME = time(9, 0)
+FOLLOW_UP_LEAD_DAYS = 1
+
+PAGE_SIZE = 1000
+LOAD_WINDOW = timedelta(days=1)
+TICK_SECONDS = 30
+DISPATCH_BATCH_SIZE = 500
+CHANGE_BATCH_SIZE = 1000
+
+# Cursor id meaning "every row of the cursor date is loaded"
+END_OF_DAY_ID = sys.maxsize
+
+Cursor = Tuple[date, int]
+
+
+class Reminder(NamedTuple):
+    due_at: datetime
+    kind: str
+    entity_id: int
+    key_on: date
+    pet_id: int
+    message: str
+
+
+class LogNotifier:
+    """Stand-in notifier that writes reminders to the application log"""
+
+    async def send(self, reminder: Reminder) -> None:
+        logger.info(
+            "reminder %s pet=%s: %s", reminder.kind, reminder.pet_id, reminder.message
+        )
+
+
+class FileNotifier:
+    """Stand-in notifier that appends reminders to a JSON-lines file"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    async def send(self, reminder: Reminder) -> None:
+        line = json.dumps(reminder._asdict(), default=str, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+def build_notifier():
+    """Notifier selected by REMINDER_NOTIFIER ("log" or "file")"""
+    if os.getenv("REMINDER_NOTIFIER", "log") == "file":
+        return FileNotifier(os.getenv("REMINDER_FILE", "reminders.jsonl"))
+    return LogNotifier()
+
+
+class DoseSource:
+    """One reminder per scheduled day of each medication"""
+
+    kind = KIND_DOSE
+    entity = ENTITY_MEDICATION
+    lead_days = 0
+
+    def remind_at(self, key_on: date) -> datetime:
+        return datetime.combine(key_on, DOSE_REMINDER_TIME)
+
+    def query(self, db: Session):
+        return (
+            db.query(MedicationDose, RecordMedication.name)
+            .join(
+                RecordMedication, MedicationDose.medication_id == RecordMedication.id
+            )
+            .filter(RecordMedication.is_deleted == 0)
+        )
+
+    def reminder(self, row) -> Reminder:
+        dose, name = row
+        return Reminder(
+            self.remind_at(dose.dose_on),
+            self.kind,
+            dose.id,
+            dose.dose_on,
+            dose.pet_id,
+            f"{name}: {dose.doses} dose(s) today",
+        )
+
+    def fetch(
+        self, db: Session, after: Cursor, until: date, limit: int
+    ) -> List[Reminder]:
+        on, entity_id = after
+        rows = (
+            self.query(db)
+            .filter(
+                or_(
+                    MedicationDose.dose_on > on,
+                    and_(MedicationDose.dose_on == on, MedicationDose.id > entity_id),
+                ),
+                MedicationDose.dose_on <= until,
+            )
+            .order_by(MedicationDose.dose_on, MedicationDose.id)
+            .limit(limit)
+            .all()
+        )
+        return [self.reminder(row) for row in rows]
+
+    def changed(
+        self, db: Session, entity_ids: Iterable[int], since: date
+    ) -> List[Reminder]:
+        rows = (
+            self.query(db)
+            .filter(
+                MedicationDose.medication_id.in_(entity_ids),
+                MedicationDose.dose_on >= since,
+            )
+            .all()
+        )
+        return [self.reminder(row) for row in rows]
+
+    def live(self, db: Session, reminders: List[Reminder]) -> Set[Tuple[int, date]]:
+        ids = [reminder.entity_id for reminder in reminders]
+        rows = self.query(db).filter(MedicationDose.id.in_(ids)).all()
+        return {(dose.id, dose.dose_on) for dose, _ in rows}
+
+
+class FollowUpSource:
+    """A reminder the day before each planned follow-up visit"""
+
+    kind = KIND_FOLLOW_UP
+    entity = ENTITY_VET_VISIT
+    lead_days = FOLLOW_UP_LEAD_DAYS
+
+    def remind_at(self, key_on: date) -> datetime:
+        remind_on = key_on - timedelta(days=self.lead_days)
+        return datetime.combine(remind_on, FOLLOW_UP_REMINDER_TIME)
+
+    def query(self, db: Session):
+        return db.query(RecordVetVisit).filter(
+            RecordVetVisit.is_deleted == 0, RecordVetVisit.next_visit_on.isnot(None)
+        )
+
+    def reminder(self, visit: RecordVetVisit) -> Reminder:
+        place = visit.hospital_name or "the vet"
+        return Reminder(
+            self.remind_at(visit.next_visit_on),
+            self.kind,
+            visit.id,
+            visit.next_visit_on,
+            visit.pet_id,
+            f"Follow-up visit at {place} on {visit.next_visit_on.isoformat()}",
+        )
+
+    def fetch(
+        self, db: Session, after: Cursor, until: date, limit: int
+    ) -> List[Reminder]:
+        on, entity_id = after
+        visits = (
+            self.query(db)
+            .filter(
+                or_(
+                    RecordVetVisit.next_visit_on > on,
+                    and_(
+                        RecordVetVisit.next_visit_on == on,
+                        RecordVetVisit.id > entity_id,
+                    ),
+                ),
+                RecordVetVisit.next_visit_on <= until,
+            )
+            .order_by(RecordVetVisit.next_visit_on, RecordVetVisit.id)
+            .limit(limit)
+            .all()
+        )
+        return [self.reminder(visit) for visit in visits]
+
+    def changed(
+        self, db: Session, entity_ids: Iterable[int], since: date
+    ) -> List[Reminder]:
+        visits = (
+            self.query(db)
+            .filter(
+                RecordVetVisit.id.in_(entity_ids),
+                RecordVetVisit.next_visit_on >= since,
+            )
+            .all()
+        )
+        return [self.reminder(visit) for visit in visits]
+
+    def live(self, db: Session, reminders: List[Reminder]) -> Set[Tuple[int, date]]:
+        ids = [reminder.entity_id for reminder in reminders]
+        visits = self.query(db).filter(RecordVetVisit.id.in_(ids)).all()
+        return {(visit.id, visit.next_visit_on) for visit in visits}
+
+
+class ReminderScheduler:
+    """Min-heap of upcoming reminders fed incrementally from the database"""
+
+    def __init__(self, session_factory, notifier=None, sources=None) -> None:
+        self.session_factory = session_factory
+        self.notifier = notifier or build_notifier()
+        self.sources = sources or (DoseSource(), FollowUpSource())
+        self.heap: List[Reminder] = []
+        self.cursors: Dict[str, Cursor] = {}
+        self.last_seq = 0
+        self.started_at = datetime.now()
+        self.checked_at = self.started_at
+        self.backlog = False
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def push(self, reminder: Reminder) -> None:
+        if reminder.due_at >= self.started_at:
+            heapq.heappush(self.heap, reminder)
+
+    def reset(self, db: Session) -> None:
+        """Start from now: earlier reminders are never sent"""
+        self.started_at = datetime.now()
+        self.checked_at = self.started_at
+        today = self.started_at.date()
+        for source in self.sources:
+            first_key = today + timedelta(days=source.lead_days)
+            self.cursors[source.kind] = (first_key - timedelta(days=1), END_OF_DAY_ID)
+        self.last_seq = db.query(func.max(ChangeEvent.seq)).scalar() or 0
+
+    def refill(self, db: Session, source, horizon: datetime) -> None:
+        """Load pages of a source until the heap holds its next reminders"""
+        until = horizon.date() + timedelta(days=source.lead_days)
+        while self.cursors[source.kind] < (until, END_OF_DAY_ID):
+            cursor = self.cursors[source.kind]
+            if self.heap and self.heap[0].due_at <= source.remind_at(cursor[0]):
+                return
+            page = source.fetch(db, cursor, until, PAGE_SIZE)
+            for reminder in page:
+                self.push(reminder)
+            if len(page) < PAGE_SIZE:
+                self.cursors[source.kind] = (until, END_OF_DAY_ID)
+            else:
+                self.cursors[source.kind] = (page[-1].key_on, page[-1].entity_id)
+
+    def apply_changes(self, db: Session) -> None:
+        """Push reminders of rows written since the last tick.
+
+        Only reminders at or before a source's cursor are pushed; the rest
+        are read by the cursor when it gets there. Reminders that fell due
+        before the previous tick were already handled.
+        """
+        events = (
+            db.query(ChangeEvent.seq, ChangeEvent.entity, ChangeEvent.entity_id)
+            .filter(ChangeEvent.seq > self.last_seq)
+            .order_by(ChangeEvent.seq)
+            .limit(CHANGE_BATCH_SIZE)
+            .all()
+        )
+        if not events:
+            return
+        self.last_seq = events[-1].seq
+
+        today = datetime.now().date()
+        for source in self.sources:
+            ids = {
+                event.entity_id for event in events if event.entity == source.entity
+            }
+            if not ids:
+                continue
+            cursor = self.cursors[source.kind]
+            for reminder in source.changed(db, ids, today):
+                key = (reminder.key_on, reminder.entity_id)
+                if key <= cursor and reminder.due_at > self.checked_at:
+                    self.push(reminder)
+
+    def due(self, now: datetime) -> List[Reminder]:
+        """Pop the reminders due by now, without duplicates"""
+        popped: Dict[Tuple[str, int, date], Reminder] = {}
+        while (
+            self.heap
+            and self.heap[0].due_at <= now
+            and len(popped) < DISPATCH_BATCH_SIZE
+        ):
+            reminder = heapq.heappop(self.heap)
+            popped[(reminder.kind, reminder.entity_id, reminder.key_on)] = reminder
+        return list(popped.values())
+
+    def still_live(self, db: Session, reminders: List[Reminder]) -> List[Reminder]:
+        """Drop reminders whose row was deleted or rescheduled since loading"""
+        valid = []
+        for source in self.sources:
+            own = [reminder for reminder in reminders if reminder.kind == source.kind]
+            if own:
+                live = source.live(db, own)
+                valid += [r for r in own if (r.entity_id, r.key_on) in live]
+        return valid
+
+    def tick(self) -> List[Reminder]:
+        """One synchronous pass over the database; returns reminders to send"""
+        db = self.session_factory()
+        try:
+            if not self.cursors:
+                self.reset(db)
+            now = datetime.now()
+            self.apply_changes(db)
+            for source in self.sources:
+                self.refill(db, source, now + LOAD_WINDOW)
+            reminders = self.due(now)
+            self.checked_at = now
+            # More may be due behind this batch or the next page
+            self.backlog = bool(reminders)
+            return self.still_live(db, reminders)
+        finally:
+            db.close()
+
+    def sleep_seconds(self) -> float:
+        if self.backlog:
+            return 0
+        if not self.heap:
+            return TICK_SECONDS
+        until_next = (self.heap[0].due_at - datetime.now()).total_seconds()
+        return min(max(until_next, 0), TICK_SECONDS)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                reminders = await asyncio.to_thread(self.tick)
+                for reminder in reminders:
+                    await self.notifier.send(reminder)
+            except Exception:
+                logger.exception("reminder tick failed")
+            await asyncio.sleep(self.sleep_seconds())
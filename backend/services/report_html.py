@@ -0,0 +1,288 @@
+"""Printable HTML history of a pet, written section by section to a file.
+
+Every section streams its rows from the database in batches and writes
+them out as it goes, so building a report of any length holds only one
+batch in memory. The weight chart is an inline SVG whose scale comes
+from one aggregate query, after which the points are streamed as well.
+"""
+from datetime import date, datetime
+from html import escape
+from typing import Iterable, Optional, Sequence, TextIO
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models import (
+    Pet,
+    Record,
+    RecordMedication,
+    RecordVetVisit,
+    RecordWeight,
+    VetCostRollup,
+)
+
+STREAM_BATCH_SIZE = 500
+
+CHART_WIDTH = 720
+CHART_HEIGHT = 240
+CHART_PADDING = 24
+# Longer weight histories are thinned to about this many points
+MAX_CHART_POINTS = 1000
+
+STYLE = """
+body { font-family: sans-serif; margin: 24px; color: #222; }
+h1 { font-size: 20px; } h2 { font-size: 16px; margin-top: 28px; }
+table { border-collapse: collapse; width: 100%; font-size: 12px; }
+th, td { border: 1px solid #999; padding: 4px 6px; text-align: left; }
+td.num { text-align: right; }
+.meta { font-size: 12px; color: #555; }
+@media print {
+  body { margin: 0; } h2 { break-after: avoid; } tr { break-inside: avoid; }
+}
+"""
+
+
+def cell(value) -> str:
+    if value is None:
+        return "<td></td>"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f'<td class="num">{value:,}</td>'
+    return f"<td>{escape(str(value))}</td>"
+
+
+def write_table(
+    out: TextIO, title: str, headers: Sequence[str], rows: Iterable[Sequence]
+) -> int:
+    """Write a titled table row by row; returns the number of rows"""
+    out.write(f"<h2>{escape(title)}</h2>\n<table><thead><tr>")
+    out.write("".join(f"<th>{escape(header)}</th>" for header in headers))
+    out.write("</tr></thead><tbody>\n")
+    count = 0
+    for row in rows:
+        out.write("<tr>" + "".join(cell(value) for value in row) + "</tr>\n")
+        count += 1
+    if not count:
+        out.write(f'<tr><td colspan="{len(headers)}">記録なし</td></tr>\n')
+    out.write("</tbody></table>\n")
+    return count
+
+
+def in_period(column, from_date: Optional[date], to_date: Optional[date]) -> list:
+    conditions = []
+    if from_date:
+        conditions.append(column >= from_date)
+    if to_date:
+        conditions.append(column <= to_date)
+    return conditions
+
+
+def stream(db: Session, statement) -> Iterable:
+    """Rows of a statement, fetched from the server in batches"""
+    return db.execute(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+
+def write_profile(out: TextIO, pet: Pet, from_date, to_date) -> None:
+    period = f"{from_date or '最初'} 〜 {to_date or '最新'}"
+    out.write(f"<h1>{escape(pet.name)} の診療記録</h1>\n<p class=\"meta\">")
+    out.write(
+        " / ".join(
+            escape(f"{label}: {value}")
+            for label, value in (
+                ("種別", pet.species or "-"),
+                ("性別", pet.sex or "-"),
+                ("生年月日", pet.birth_date or "-"),
+                ("期間", period),
+                ("作成", datetime.now().strftime("%Y-%m-%d %H:%M")),
+            )
+        )
+    )
+    out.write("</p>\n")
+
+
+def write_costs(out: TextIO, db: Session, pet_id: int, from_date, to_date) -> None:
+    """Monthly vet costs from the rollups, with a grand total"""
+    month = VetCostRollup.year * 100 + VetCostRollup.month
+    conditions = [VetCostRollup.pet_id == pet_id]
+    if from_date:
+        conditions.append(month >= from_date.year * 100 + from_date.month)
+    if to_date:
+        conditions.append(month <= to_date.year * 100 + to_date.month)
+    statement = (
+        select(
+            VetCostRollup.year,
+            VetCostRollup.month,
+            VetCostRollup.hospital_name,
+            VetCostRollup.visit_count,
+            VetCostRollup.total_yen,
+        )
+        .where(*conditions, VetCostRollup.visit_count > 0)
+        .order_by(
+            VetCostRollup.year, VetCostRollup.month, VetCostRollup.hospital_name
+        )
+    )
+    totals = {"visits": 0, "yen": 0}
+
+    def rows():
+        for row in stream(db, statement):
+            totals["visits"] += row.visit_count
+            totals["yen"] += row.total_yen
+            yield (
+                f"{row.year}-{row.month:02d}",
+                row.hospital_name or "-",
+                row.visit_count,
+                row.total_yen,
+            )
+
+    headers = ("年月", "病院", "回数", "費用（円）")
+    write_table(out, "通院費用（月別）", headers, rows())
+    out.write(
+        f"<p>合計: {totals['visits']:,} 回 / {totals['yen']:,} 円"
+        "（期間は月単位）</p>\n"
+    )
+
+
+def write_weight_chart(
+    out: TextIO, db: Session, pet_id: int, from_date, to_date
+) -> None:
+    """SVG line of the weights, scaled by one aggregate query first"""
+    conditions = [
+        RecordWeight.pet_id == pet_id,
+        RecordWeight.is_deleted == 0,
+        *in_period(RecordWeight.measured_on, from_date, to_date),
+    ]
+    bounds = db.execute(
+        select(
+            func.count(),
+            func.min(RecordWeight.measured_on),
+            func.max(RecordWeight.measured_on),
+            func.min(RecordWeight.weight_kg),
+            func.max(RecordWeight.weight_kg),
+        ).where(*conditions)
+    ).one()
+    count, first_on, last_on, low, high = bounds
+    out.write("<h2>体重の推移</h2>\n")
+    if not count:
+        out.write("<p>記録なし</p>\n")
+        return
+
+    low, high = float(low), float(high)
+    days = max((last_on - first_on).days, 1)
+    span = max(high - low, 0.1)
+    plot_width = CHART_WIDTH - 2 * CHART_PADDING
+    plot_height = CHART_HEIGHT - 2 * CHART_PADDING
+    step = -(-count // MAX_CHART_POINTS)
+
+    out.write(
+        f'<svg width="{CHART_WIDTH}" height="{CHART_HEIGHT}" '
+        f'viewBox="0 0 {CHART_WIDTH} {CHART_HEIGHT}">'
+        f'<text x="2" y="14" font-size="11">{high:.2f} kg</text>'
+        f'<text x="2" y="{CHART_HEIGHT - 4}" font-size="11">{low:.2f} kg</text>'
+        '<polyline fill="none" stroke="#36c" stroke-width="2" points="'
+    )
+    statement = (
+        select(RecordWeight.measured_on, RecordWeight.weight_kg)
+        .where(*conditions)
+        .order_by(RecordWeight.measured_on, RecordWeight.id)
+    )
+    for index, row in enumerate(stream(db, statement)):
+        if index % step and index != count - 1:
+            continue
+        x = CHART_PADDING + plot_width * (row.measured_on - first_on).days / days
+        y = CHART_PADDING + plot_height * (high - float(row.weight_kg)) / span
+        out.write(f"{x:.1f},{y:.1f} ")
+    out.write('"/></svg>\n')
+    out.write(f'<p class="meta">{first_on} 〜 {last_on}（{count} 件）</p>\n')
+
+
+def write_visits(out: TextIO, db: Session, pet_id: int, from_date, to_date) -> None:
+    statement = (
+        select(
+            RecordVetVisit.visited_on,
+            RecordVetVisit.hospital_name,
+            RecordVetVisit.doctor_name,
+            RecordVetVisit.chief_complaint,
+            RecordVetVisit.diagnosis,
+            RecordVetVisit.cost_yen,
+            RecordVetVisit.next_visit_on,
+        )
+        .where(
+            RecordVetVisit.pet_id == pet_id,
+            RecordVetVisit.is_deleted == 0,
+            *in_period(RecordVetVisit.visited_on, from_date, to_date),
+        )
+        .order_by(RecordVetVisit.visited_on, RecordVetVisit.id)
+    )
+    write_table(
+        out,
+        "通院",
+        ("日付", "病院", "獣医師", "主訴", "診断", "費用（円）", "次回"),
+        stream(db, statement),
+    )
+
+
+def write_medications(
+    out: TextIO, db: Session, pet_id: int, from_date, to_date
+) -> None:
+    statement = (
+        select(
+            RecordMedication.start_on,
+            RecordMedication.end_on,
+            RecordMedication.name,
+            RecordMedication.dosage,
+            RecordMedication.frequency,
+        )
+        .where(
+            RecordMedication.pet_id == pet_id,
+            RecordMedication.is_deleted == 0,
+            *in_period(RecordMedication.start_on, from_date, to_date),
+        )
+        .order_by(RecordMedication.start_on, RecordMedication.id)
+    )
+    write_table(
+        out, "投薬", ("開始", "終了", "薬", "用量", "頻度"), stream(db, statement)
+    )
+
+
+def write_records(out: TextIO, db: Session, pet_id: int, from_date, to_date) -> None:
+    statement = (
+        select(Record.recorded_on, Record.condition, Record.note)
+        .where(
+            Record.pet_id == pet_id,
+            Record.is_deleted == 0,
+            *in_period(Record.recorded_on, from_date, to_date),
+        )
+        .order_by(Record.recorded_on, Record.id)
+    )
+    rows = (
+        (row.recorded_on, row.condition, row.note)
+        for row in stream(db, statement)
+        if row.condition or row.note
+    )
+    write_table(out, "体調・メモ", ("日付", "体調", "メモ"), rows)
+
+
+SECTIONS = (
+    write_costs,
+    write_weight_chart,
+    write_visits,
+    write_medications,
+    write_records,
+)
+
+
+def render_report(
+    db: Session,
+    pet: Pet,
+    out: TextIO,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+) -> None:
+    """Write the pet's printable history as one HTML document"""
+    out.write(
+        '<!DOCTYPE html>\n<html lang="ja"><head><meta charset="utf-8">'
+        f"<title>{escape(pet.name)} の診療記録</title><style>{STYLE}</style>"
+        "</head><body>\n"
+    )
+    write_profile(out, pet, from_date, to_date)
+    for section in SECTIONS:
+        section(out, db, pet.id, from_date, to_date)
+    out.write("</body></html>\n")
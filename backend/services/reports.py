@@ -0,0 +1,286 @@
+"""Background report jobs: a DB-backed queue drained by an in-process pool.
+
+Requests only add a row to report_jobs. Every server process runs a
+ReportWorker that claims queued jobs with a conditional UPDATE, so
+several processes can share the table, and renders at most
+REPORT_WORKERS of them at a time on its own threads, away from the
+event loop and the request threadpool. A job left running for longer
+than RUNNING_TIMEOUT is taken to have died with its process and is
+queued again.
+
+Reports are cached by content. The cache key hashes the parameters
+together with the pet's latest change_events seq, which moves on every
+write to the pet's data, so asking again about an unchanged pet returns
+the earlier job instead of rendering a new one.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Set, Tuple
+from fastapi import HTTPException
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from models import ChangeEvent, Pet, ReportJob
+from services.report_html import render_report
+from services.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+REUSABLE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE)
+
+# Bumped when the report's layout changes, so cached reports are rebuilt
+REPORT_LAYOUT_VERSION = 1
+REPORT_PREFIX = "reports"
+
+DEFAULT_REPORT_WORKERS = 2
+MAX_PENDING_PER_PET = 3
+RETRY_AFTER_SECONDS = 30
+POLL_SECONDS = 5
+RUNNING_TIMEOUT = timedelta(minutes=10)
+MAX_ERROR_LENGTH = 500
+
+REPORT_RETENTION_DAYS = 7
+PURGE_BATCH_SIZE = 500
+
+
+def data_seq(db: Session, pet_id: int) -> int:
+    """The pet's latest change seq, read from the (pet_id, seq) index"""
+    seq = db.query(func.max(ChangeEvent.seq)).filter(
+        ChangeEvent.pet_id == pet_id
+    ).scalar()
+    return seq or 0
+
+
+def cache_key(
+    pet_id: int, from_date: Optional[date], to_date: Optional[date], seq: int
+) -> str:
+    raw = f"{REPORT_LAYOUT_VERSION}|{pet_id}|{from_date}|{to_date}|{seq}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def enqueue_report(
+    db: Session, pet_id: int, from_date: Optional[date], to_date: Optional[date]
+) -> Tuple[ReportJob, bool]:
+    """Queue a report unless an equal one exists; returns (job, created)"""
+    key = cache_key(pet_id, from_date, to_date, data_seq(db, pet_id))
+    cached = (
+        db.query(ReportJob)
+        .filter(
+            ReportJob.pet_id == pet_id,
+            ReportJob.cache_key == key,
+            ReportJob.status.in_(REUSABLE_STATUSES),
+        )
+        .order_by(ReportJob.id.desc())
+        .first()
+    )
+    if cached:
+        return cached, False
+
+    pending = (
+        db.query(func.count(ReportJob.id))
+        .filter(
+            ReportJob.pet_id == pet_id,
+            ReportJob.status.in_((STATUS_QUEUED, STATUS_RUNNING)),
+        )
+        .scalar()
+    )
+    if pending >= MAX_PENDING_PER_PET:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many reports in progress for this pet",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+
+    job = ReportJob(
+        pet_id=pet_id,
+        status=STATUS_QUEUED,
+        from_date=from_date,
+        to_date=to_date,
+        cache_key=key,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    report_worker.notify()
+    return job, True
+
+
+def claim_jobs(session_factory, limit: int) -> List[int]:
+    """Mark up to limit queued jobs as running in this process"""
+    db = session_factory()
+    try:
+        now = datetime.utcnow()
+        db.query(ReportJob).filter(
+            ReportJob.status == STATUS_RUNNING,
+            ReportJob.started_at < now - RUNNING_TIMEOUT,
+        ).update({"status": STATUS_QUEUED}, synchronize_session=False)
+
+        candidates = (
+            db.query(ReportJob.id)
+            .filter(ReportJob.status == STATUS_QUEUED)
+            .order_by(ReportJob.id)
+            .limit(limit)
+            .all()
+        )
+        claimed = []
+        for (job_id,) in candidates:
+            # Another process may have claimed it since the SELECT
+            result = db.execute(
+                update(ReportJob)
+                .where(ReportJob.id == job_id, ReportJob.status == STATUS_QUEUED)
+                .values(status=STATUS_RUNNING, started_at=now)
+            )
+            if result.rowcount:
+                claimed.append(job_id)
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def finish_job(db: Session, job_id: int, **values) -> None:
+    db.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, ReportJob.status == STATUS_RUNNING)
+        .values(finished_at=datetime.utcnow(), **values)
+    )
+    db.commit()
+
+
+def build_report(session_factory, job_id: int) -> None:
+    """Render a claimed job into storage and record the outcome"""
+    db = session_factory()
+    storage = get_storage()
+    staged = storage.new_staging_file()
+    try:
+        job = db.get(ReportJob, job_id)
+        pet = db.get(Pet, job.pet_id)
+        with staged:
+            out = io.TextIOWrapper(staged, encoding="utf-8")
+            render_report(db, pet, out, job.from_date, job.to_date)
+            out.flush()
+            out.detach()
+        key = f"{REPORT_PREFIX}/{job_id}.html"
+        stored = storage.put_object(key, staged.name)
+        finish_job(
+            db, job_id, status=STATUS_DONE, result_key=key, size_bytes=stored.size
+        )
+    except Exception as e:
+        logger.exception("report job %s failed", job_id)
+        db.rollback()
+        finish_job(db, job_id, status=STATUS_FAILED, error=str(e)[:MAX_ERROR_LENGTH])
+    finally:
+        storage.discard_staged(staged.name)
+        db.close()
+
+
+class ReportWorker:
+    """Drains report_jobs on a bounded pool of threads in this process"""
+
+    def __init__(self) -> None:
+        self.session_factory = None
+        self.concurrency = 0
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.running: Set[asyncio.Future] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, session_factory) -> None:
+        """Run REPORT_WORKERS renders at a time here (0 leaves it to others)"""
+        self.concurrency = int(os.getenv("REPORT_WORKERS", DEFAULT_REPORT_WORKERS))
+        if self.concurrency <= 0:
+            return
+        self.session_factory = session_factory
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="report"
+        )
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        # Renders cannot be interrupted; let the ones in flight finish
+        if self.running:
+            await asyncio.wait(self.running)
+        if self.executor:
+            self.executor.shutdown()
+        self.loop = None
+
+    def notify(self) -> None:
+        """Wake the worker for a new job (from any thread)"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def finished(self, future: asyncio.Future) -> None:
+        self.running.discard(future)
+        self.wakeup.set()
+
+    async def dispatch(self) -> None:
+        free = self.concurrency - len(self.running)
+        if free <= 0:
+            return
+        job_ids = await asyncio.to_thread(claim_jobs, self.session_factory, free)
+        for job_id in job_ids:
+            future = self.loop.run_in_executor(
+                self.executor, build_report, self.session_factory, job_id
+            )
+            self.running.add(future)
+            future.add_done_callback(self.finished)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.dispatch()
+            except Exception:
+                logger.exception("claiming report jobs failed")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+
+report_worker = ReportWorker()
+
+
+def purge_reports(db: Session, retention_days: int = REPORT_RETENTION_DAYS) -> int:
+    """Drop reports finished more than retention_days ago with their files"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    storage = get_storage()
+    purged = 0
+    while True:
+        jobs = (
+            db.query(ReportJob)
+            .filter(ReportJob.finished_at < cutoff)
+            .order_by(ReportJob.finished_at)
+            .limit(PURGE_BATCH_SIZE)
+            .all()
+        )
+        if not jobs:
+            return purged
+        result_keys = [job.result_key for job in jobs if job.result_key]
+        for job in jobs:
+            # Generated output: removed, not logically deleted
+            db.delete(job)
+        db.commit()
+        # Files go only once no row can hand them out as a cache hit; a
+        # failure here leaves an orphan file, never a job without one
+        for key in result_keys:
+            storage.delete_object(key)
+        purged += len(jobs)
@@ -0,0 +1,70 @@
+"""Startup check that the database is migrated to this code's schema.
+
+Migrations are applied ahead of deploys with `alembic upgrade head`,
+never by the app itself. At startup each process only compares the
+one-row alembic_version table with the newest revision shipped in
+migrations/versions, instead of reflecting or creating tables.
+
+Alembic itself is not imported here: loading it costs more than the
+rest of the startup, and the head revision can be read off the
+scripts' revision / down_revision lines.
+"""
+import os
+import re
+from typing import Optional, Set
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VERSIONS_DIR = os.path.join(BACKEND_DIR, "migrations", "versions")
+VERSION_TABLE = "alembic_version"
+
+REVISION_LINE = re.compile(r"^revision\b.*?=\s*['\"](\w+)['\"]", re.MULTILINE)
+DOWN_REVISION_LINE = re.compile(r"^down_revision\b.*?=(.*)$", re.MULTILINE)
+QUOTED = re.compile(r"['\"](\w+)['\"]")
+
+
+def head_revision() -> Optional[str]:
+    """The revision no other migration script builds on"""
+    revisions: Set[str] = set()
+    parents: Set[str] = set()
+    for name in os.listdir(VERSIONS_DIR):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(VERSIONS_DIR, name), encoding="utf-8") as file:
+            source = file.read()
+        revision = REVISION_LINE.search(source)
+        if revision:
+            revisions.add(revision.group(1))
+        down = DOWN_REVISION_LINE.search(source)
+        if down:
+            parents.update(QUOTED.findall(down.group(1)))
+    heads = revisions - parents
+    if len(heads) > 1:
+        raise RuntimeError(f"Migrations have several heads: {sorted(heads)}")
+    return heads.pop() if heads else None
+
+
+def current_revision(engine: Engine) -> Optional[str]:
+    with engine.connect() as connection:
+        if not inspect(connection).has_table(VERSION_TABLE):
+            return None
+        return connection.execute(
+            text(f"SELECT version_num FROM {VERSION_TABLE}")
+        ).scalar()
+
+
+def check_schema_version(engine: Optional[Engine]) -> None:
+    """Refuse to start against a database at another revision.
+
+    Without DATABASE_URL there is no engine and nothing to check.
+    """
+    if engine is None:
+        return
+    expected = head_revision()
+    current = current_revision(engine)
+    if current != expected:
+        raise RuntimeError(
+            f"Database schema is at revision {current or 'none'}, this code "
+            f"needs {expected}: run `alembic upgrade head` first"
+        )
@@ -0,0 +1,85 @@
+"""Logical deletes that stamp deleted_at and cascade to dependent rows"""
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import (
+    Pet,
+    Record,
+    RecordWeight,
+    RecordMedication,
+    RecordVetVisit,
+    VetVisitAttachment,
+)
+from services.vet_costs import remove_live_visits
+from services.weight_trends import recompute_pet
+
+CHILD_MODELS = (RecordWeight, RecordMedication, RecordVetVisit)
+
+
+def mark_deleted(row, now: Optional[datetime] = None) -> None:
+    """Flag a single loaded row as deleted"""
+    row.is_deleted = 1
+    row.deleted_at = now or datetime.utcnow()
+
+
+def tombstone_values(model, now: datetime) -> dict:
+    """Column values for a bulk logical delete"""
+    return {
+        "is_deleted": 1,
+        "deleted_at": now,
+        "updated_at": now,
+        "version": model.version + 1,
+    }
+
+
+def soft_delete_attachments(
+    db: Session, criteria, now: Optional[datetime] = None
+) -> None:
+    """Flag the live attachments matching the criteria as deleted.
+
+    The blobs stay in storage: other attachments may share them.
+    """
+    db.query(VetVisitAttachment).filter(
+        criteria, VetVisitAttachment.is_deleted == 0
+    ).update(
+        tombstone_values(VetVisitAttachment, now or datetime.utcnow()),
+        synchronize_session=False,
+    )
+
+
+def soft_delete_record(db: Session, record: Record) -> None:
+    """Delete a record and its live children in the current transaction.
+
+    Children are flagged with one UPDATE per child table; the change feed
+    only carries the record's own delete event.
+    """
+    now = datetime.utcnow()
+    mark_deleted(record, now)
+    remove_live_visits(db, RecordVetVisit.record_id == record.id)
+    record_visits = select(RecordVetVisit.id).where(
+        RecordVetVisit.record_id == record.id
+    )
+    soft_delete_attachments(
+        db, VetVisitAttachment.vet_visit_id.in_(record_visits), now
+    )
+
+    for model in CHILD_MODELS:
+        db.query(model).filter(
+            model.record_id == record.id, model.is_deleted == 0
+        ).update(tombstone_values(model, now), synchronize_session=False)
+    recompute_pet(db, record.pet_id)
+
+
+def soft_delete_pet(db: Session, pet: Pet) -> None:
+    """Delete a pet, its records and their children in the current transaction"""
+    now = datetime.utcnow()
+    mark_deleted(pet, now)
+    remove_live_visits(db, RecordVetVisit.pet_id == pet.id)
+    soft_delete_attachments(db, VetVisitAttachment.pet_id == pet.id, now)
+
+    for model in CHILD_MODELS + (Record,):
+        db.query(model).filter(
+            model.pet_id == pet.id, model.is_deleted == 0
+        ).update(tombstone_values(model, now), synchronize_session=False)
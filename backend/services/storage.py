@@ -0,0 +1,99 @@
+"""Object storage for uploaded files, behind an S3-style key/value interface.
+
+Objects are addressed by keys such as "photos/<sha256>.jpg". Callers
+stage uploads in a temporary file (new_staging_file) and hand it over
+with put_object, so no object is ever held in memory whole.
+
+Backends (STORAGE_BACKEND):
+- "local" (default): files under STORAGE_DIR; stands in for an
+  S3-compatible bucket. put_object is an atomic rename, so readers never
+  see a partial object.
+
+An S3-compatible backend only needs the same methods: put_object
+uploads the staged file, open_object streams the body and local_path
+returns None, making routes stream instead of serving the file directly.
+"""
+import os
+import tempfile
+from typing import BinaryIO, NamedTuple, Optional
+
+DEFAULT_STORAGE_DIR = "storage"
+STAGING_PREFIX = ".staging"
+
+
+class ObjectInfo(NamedTuple):
+    key: str
+    size: int
+
+
+class LocalStorage:
+    """Objects as files under a root directory, keyed by relative path"""
+
+    def __init__(self, root: str) -> None:
+        self.root = os.path.abspath(root)
+        self.staging_dir = os.path.join(self.root, STAGING_PREFIX)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def path_of(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep) or key.startswith(STAGING_PREFIX):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def new_staging_file(self) -> BinaryIO:
+        """Temporary file on the storage's filesystem, so put_object can rename it"""
+        return tempfile.NamedTemporaryFile(dir=self.staging_dir, delete=False)
+
+    def staging_path(self, name: str) -> str:
+        """Path of a staging file by the name it was created with"""
+        return os.path.join(self.staging_dir, os.path.basename(name))
+
+    def put_object(self, key: str, staged_path: str) -> ObjectInfo:
+        """Move a staged file into place; an existing object is kept as is"""
+        path = self.path_of(key)
+        if os.path.exists(path):
+            # Keys are content hashes, so the stored object is identical
+            os.unlink(staged_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(staged_path, path)
+        return ObjectInfo(key, os.path.getsize(path))
+
+    def head_object(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            return ObjectInfo(key, os.path.getsize(self.path_of(key)))
+        except FileNotFoundError:
+            return None
+
+    def open_object(self, key: str) -> BinaryIO:
+        return open(self.path_of(key), "rb")
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path of the object on this host, for zero-copy file responses"""
+        return self.path_of(key)
+
+    def delete_object(self, key: str) -> None:
+        try:
+            os.unlink(self.path_of(key))
+        except FileNotFoundError:
+            pass
+
+    def discard_staged(self, staged_path: str) -> None:
+        try:
+            os.unlink(staged_path)
+        except FileNotFoundError:
+            pass
+
+
+_storage = None
+
+
+def get_storage() -> LocalStorage:
+    """Storage selected by STORAGE_BACKEND, created on first use"""
+    global _storage
+    if _storage is None:
+        backend = os.getenv("STORAGE_BACKEND", "local")
+        if backend != "local":
+            raise RuntimeError(f"Unsupported STORAGE_BACKEND: {backend}")
+        _storage = LocalStorage(os.getenv("STORAGE_DIR", DEFAULT_STORAGE_DIR))
+    return _storage
@@ -0,0 +1,226 @@
+"""Vet cost rollups: visit spend pre-aggregated per pet, month and hospital.
+
+Every write that adds, changes or removes a live vet visit passes the
+visit's old and new cost through apply_visit_costs, which adds the net
+difference to the affected buckets with an atomic upsert. The cost
+endpoints then only read vet_cost_rollups; rebuild_cost_rollups recomputes
+the table from the visits if it ever drifts.
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from sqlalchemy import extract, func, insert, literal, select
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Session
+
+from models import Pet, RecordVetVisit, VetCostRollup
+from services.records import ON_CONFLICT_INSERTS
+
+# Fields of a vet visit that move its cost between buckets
+COST_FIELDS = frozenset({"visited_on", "hospital_name", "cost_yen"})
+
+NO_HOSPITAL = ""
+
+BUCKET_COLUMNS = (
+    VetCostRollup.pet_id,
+    VetCostRollup.year,
+    VetCostRollup.month,
+    VetCostRollup.hospital_name,
+)
+
+GROUP_COLUMNS = {
+    "month": (VetCostRollup.year, VetCostRollup.month),
+    "year": (VetCostRollup.year,),
+    "hospital": (VetCostRollup.hospital_name,),
+}
+
+Bucket = Tuple[int, int, int, str]
+
+
+class VisitCost(NamedTuple):
+    pet_id: int
+    visited_on: date
+    hospital_name: Optional[str]
+    cost_yen: Optional[int]
+
+
+def visit_cost(visit) -> VisitCost:
+    """Cost-relevant values of a visit row or of a column-values dict"""
+    if isinstance(visit, dict):
+        return VisitCost(*(visit[field] for field in VisitCost._fields))
+    return VisitCost(*(getattr(visit, field) for field in VisitCost._fields))
+
+
+def versioned_visit_cost(
+    db: Session, criteria: List
+) -> Optional[Tuple[VisitCost, int]]:
+    """A visit's current cost values and the row version they were read at"""
+    row = (
+        db.query(
+            *(getattr(RecordVetVisit, field) for field in VisitCost._fields),
+            RecordVetVisit.version,
+        )
+        .filter(*criteria)
+        .first()
+    )
+    return (VisitCost(*row[:-1]), row[-1]) if row else None
+
+
+def bucket_of(cost: VisitCost) -> Bucket:
+    visited_on = cost.visited_on
+    return (
+        cost.pet_id,
+        visited_on.year,
+        visited_on.month,
+        cost.hospital_name or NO_HOSPITAL,
+    )
+
+
+def bump(db: Session, bucket: Bucket, total_yen: int, visit_count: int) -> None:
+    """Add to one bucket, creating it if needed, in a single statement"""
+    now = datetime.utcnow()
+    values = dict(zip((column.key for column in BUCKET_COLUMNS), bucket))
+    values.update(total_yen=total_yen, visit_count=visit_count, updated_at=now)
+
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(VetCostRollup).values(**values)
+        stmt = stmt.on_duplicate_key_update(
+            total_yen=VetCostRollup.total_yen + stmt.inserted.total_yen,
+            visit_count=VetCostRollup.visit_count + stmt.inserted.visit_count,
+            updated_at=now,
+        )
+    elif dialect in ON_CONFLICT_INSERTS:
+        stmt = ON_CONFLICT_INSERTS[dialect](VetCostRollup).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(BUCKET_COLUMNS),
+            set_={
+                "total_yen": VetCostRollup.total_yen + stmt.excluded.total_yen,
+                "visit_count": VetCostRollup.visit_count + stmt.excluded.visit_count,
+                "updated_at": now,
+            },
+        )
+    else:
+        updated = db.query(VetCostRollup).filter(
+            *(column == value for column, value in zip(BUCKET_COLUMNS, bucket))
+        ).update(
+            {
+                "total_yen": VetCostRollup.total_yen + total_yen,
+                "visit_count": VetCostRollup.visit_count + visit_count,
+                "updated_at": now,
+            },
+            synchronize_session=False,
+        )
+        if updated:
+            return
+        stmt = insert(VetCostRollup).values(**values)
+    db.execute(stmt)
+
+
+def apply_visit_costs(
+    db: Session, removed: Iterable[VisitCost], added: Iterable[VisitCost]
+) -> None:
+    """Move visit costs between buckets; unchanged buckets are not written"""
+    deltas: Dict[Bucket, List[int]] = defaultdict(lambda: [0, 0])
+    for sign, costs in ((-1, removed), (1, added)):
+        for cost in costs:
+            delta = deltas[bucket_of(cost)]
+            delta[0] += sign * (cost.cost_yen or 0)
+            delta[1] += sign
+
+    for bucket, (total_yen, visit_count) in sorted(deltas.items()):
+        if total_yen or visit_count:
+            bump(db, bucket, total_yen, visit_count)
+
+
+def bucket_expressions() -> tuple:
+    """Bucket key columns computed from record_vet_visits"""
+    return (
+        RecordVetVisit.pet_id,
+        extract("year", RecordVetVisit.visited_on),
+        extract("month", RecordVetVisit.visited_on),
+        func.coalesce(RecordVetVisit.hospital_name, NO_HOSPITAL),
+    )
+
+
+def remove_live_visits(db: Session, *criteria) -> None:
+    """Take the live visits matching criteria out of the rollups.
+
+    Used by cascading deletes, which flag visits with one bulk UPDATE.
+    """
+    keys = bucket_expressions()
+    rows = (
+        db.query(
+            *keys,
+            func.sum(func.coalesce(RecordVetVisit.cost_yen, 0)),
+            func.count(RecordVetVisit.id),
+        )
+        .filter(RecordVetVisit.is_deleted == 0, *criteria)
+        .group_by(*keys)
+        .all()
+    )
+    for pet_id, year, month, hospital_name, total_yen, visit_count in rows:
+        bucket = (pet_id, int(year), int(month), hospital_name)
+        bump(db, bucket, -int(total_yen), -visit_count)
+
+
+def rebuild_cost_rollups(db: Session) -> int:
+    """Recompute every bucket from the live visits in one statement.
+
+    vet_cost_rollups is derived data, so its rows are replaced outright.
+    """
+    keys = bucket_expressions()
+    aggregated = (
+        select(
+            *keys,
+            func.sum(func.coalesce(RecordVetVisit.cost_yen, 0)),
+            func.count(RecordVetVisit.id),
+            literal(datetime.utcnow()),
+        )
+        .where(RecordVetVisit.is_deleted == 0)
+        .group_by(*keys)
+    )
+    columns = [column.key for column in BUCKET_COLUMNS]
+    columns += ["total_yen", "visit_count", "updated_at"]
+
+    db.query(VetCostRollup).delete(synchronize_session=False)
+    db.execute(insert(VetCostRollup).from_select(columns, aggregated))
+    db.commit()
+    return db.query(func.count(VetCostRollup.id)).scalar()
+
+
+def cost_breakdown(
+    db: Session, group_by: str, user_id: int, pet_id: Optional[int] = None
+) -> List[dict]:
+    """Spend per month, year or hospital for one pet or all the user's pets.
+
+    The user's pets come from idx_pets_user and each pet's buckets from
+    uq_vet_costs_bucket, so other users' rollups are never read.
+    """
+    group_columns = GROUP_COLUMNS[group_by]
+    total_yen = func.sum(VetCostRollup.total_yen)
+    visit_count = func.sum(VetCostRollup.visit_count)
+
+    query = (
+        db.query(*group_columns, total_yen, visit_count)
+        .join(Pet, VetCostRollup.pet_id == Pet.id)
+        .filter(Pet.user_id == user_id, Pet.is_deleted == 0)
+    )
+    if pet_id is not None:
+        query = query.filter(VetCostRollup.pet_id == pet_id)
+    rows = (
+        query.group_by(*group_columns)
+        .having(visit_count > 0)
+        .order_by(*group_columns)
+        .all()
+    )
+
+    items = []
+    for row in rows:
+        item = dict(zip((column.key for column in group_columns), row))
+        if "hospital_name" in item:
+            item["hospital_name"] = item["hospital_name"] or None
+        item["total_yen"] = int(row[-2])
+        item["visit_count"] = int(row[-1])
+        items.append(item)
+    return items
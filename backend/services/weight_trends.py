@@ -0,0 +1,475 @@
+"""Weight trends: per-pet EWMA and rolling slopes kept current on every write.
+
+pet_weight_trends holds the exponentially weighted moving average of a
+pet's weights; weight_trend_windows holds the least-squares sums of the
+weights measured in the TREND_WINDOWS days up to the latest measurement.
+Adding a new latest weight, editing the latest weight's value or deleting
+it updates both in O(1): the EWMA steps forward (or back to the stored
+previous value) and the window sums gain or lose single points. Writes
+that rewrite history, such as a back-dated weight, refold the pet's
+weights with recompute_pet. recompute_all rebuilds every pet in one pass.
+
+Nothing is locked: trend rows are read from the transaction's snapshot
+and every write of them is conditional on the pet_weight_trends row's
+version, which each write bumps. When another transaction changed the
+pet's weights meanwhile, the write raises StaleDataError and the request
+fails with a conflict like any other concurrent edit, instead of folding
+weights its snapshot cannot see.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import groupby
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from models import Pet, PetWeightTrend, RecordWeight, WeightTrendWindow
+
+TREND_WINDOWS = (7, 30, 90)
+TREND_EPOCH = date(2000, 1, 1)
+EWMA_HALF_LIFE_DAYS = 7
+MIN_TREND_POINTS = 3
+
+# Loss over a whole window, relative to the EWMA, that raises sudden_loss
+LOSS_ALERT_RATIOS = {7: 0.03, 30: 0.05, 90: 0.10}
+
+# weight_kg has two decimals; window sums are kept in hundredths of a kg
+WEIGHT_SCALE = 100
+
+RECOMPUTE_BATCH_SIZE = 1000
+
+SUM_FIELDS = ("points", "sum_x", "sum_y", "sum_xy", "sum_xx")
+STATE_FIELDS = (
+    "last_weight_id",
+    "last_measured_on",
+    "ewma_kg",
+    "prev_measured_on",
+    "prev_ewma_kg",
+    "sudden_loss",
+)
+
+# Fields of a weight that move it within the trend
+TREND_FIELDS = frozenset({"measured_on", "weight_kg"})
+
+
+class Point(NamedTuple):
+    measured_on: date
+    weight_id: int
+    weight: int  # hundredths of a kg
+
+
+def scaled(weight_kg) -> int:
+    return int(round(Decimal(str(weight_kg)) * WEIGHT_SCALE))
+
+
+def day_index(day: date) -> int:
+    return (day - TREND_EPOCH).days
+
+
+def ewma_step(
+    previous: Optional[float], previous_on: Optional[date], point: Point
+) -> float:
+    """EWMA after a point; the weight decays by half every EWMA_HALF_LIFE_DAYS"""
+    weight_kg = point.weight / WEIGHT_SCALE
+    if previous is None:
+        return weight_kg
+    days = max((point.measured_on - previous_on).days, 1)
+    alpha = 1 - 0.5 ** (days / EWMA_HALF_LIFE_DAYS)
+    return previous + alpha * (weight_kg - previous)
+
+
+def in_window(day: date, last: date, window_days: int) -> bool:
+    return day > last - timedelta(days=window_days)
+
+
+def shift(window: WeightTrendWindow, points: Iterable[Point], sign: int) -> None:
+    """Add (sign=1) or remove (sign=-1) points from a window's sums"""
+    for point in points:
+        x = day_index(point.measured_on)
+        window.points += sign
+        window.sum_x += sign * x
+        window.sum_y += sign * point.weight
+        window.sum_xy += sign * x * point.weight
+        window.sum_xx += sign * x * x
+
+
+def slope(window) -> Optional[float]:
+    """Least-squares slope in kg/day, or None with too few distinct days"""
+    n = window.points
+    if n < MIN_TREND_POINTS:
+        return None
+    denominator = n * window.sum_xx - window.sum_x ** 2
+    if denominator == 0:
+        return None
+    numerator = n * window.sum_xy - window.sum_x * window.sum_y
+    return numerator / denominator / WEIGHT_SCALE
+
+
+def is_sudden_loss(ewma_kg: Optional[float], windows: Iterable) -> bool:
+    if not ewma_kg:
+        return False
+    for window in windows:
+        per_day = slope(window)
+        ratio = LOSS_ALERT_RATIOS[window.window_days]
+        if per_day is not None and per_day * window.window_days / ewma_kg <= -ratio:
+            return True
+    return False
+
+
+def live_points(db: Session, pet_id: int, *criteria) -> List[Point]:
+    """The pet's live weights matching criteria, oldest first"""
+    rows = (
+        db.query(RecordWeight.measured_on, RecordWeight.id, RecordWeight.weight_kg)
+        .filter(RecordWeight.pet_id == pet_id, RecordWeight.is_deleted == 0, *criteria)
+        .order_by(RecordWeight.measured_on, RecordWeight.id)
+        .all()
+    )
+    return [Point(on, weight_id, scaled(kg)) for on, weight_id, kg in rows]
+
+
+def latest_point(db: Session, pet_id: int) -> Optional[Point]:
+    row = (
+        db.query(RecordWeight.measured_on, RecordWeight.id, RecordWeight.weight_kg)
+        .filter(RecordWeight.pet_id == pet_id, RecordWeight.is_deleted == 0)
+        .order_by(RecordWeight.measured_on.desc(), RecordWeight.id.desc())
+        .first()
+    )
+    return Point(row[0], row[1], scaled(row[2])) if row else None
+
+
+def points_between(
+    db: Session, pet_id: int, after: date, until: date
+) -> List[Point]:
+    """Live points in (after - longest window, until - shortest window]"""
+    return live_points(
+        db,
+        pet_id,
+        RecordWeight.measured_on > after - timedelta(days=max(TREND_WINDOWS)),
+        RecordWeight.measured_on <= until - timedelta(days=min(TREND_WINDOWS)),
+    )
+
+
+def weight_point(weight) -> Point:
+    """Trend point of a weight row or of a column-values dict"""
+    if isinstance(weight, dict):
+        return Point(weight["measured_on"], weight["id"], scaled(weight["weight_kg"]))
+    return Point(weight.measured_on, weight.id, scaled(weight.weight_kg))
+
+
+def versioned_weight_point(
+    db: Session, criteria: List
+) -> Optional[Tuple[Point, int]]:
+    """A weight's current trend point and the row version it was read at"""
+    row = (
+        db.query(
+            RecordWeight.measured_on,
+            RecordWeight.id,
+            RecordWeight.weight_kg,
+            RecordWeight.version,
+        )
+        .filter(*criteria)
+        .first()
+    )
+    return (Point(row[0], row[1], scaled(row[2])), row[3]) if row else None
+
+
+def fold(
+    pet_id: int, points: List[Point]
+) -> Tuple[PetWeightTrend, List[WeightTrendWindow]]:
+    """Trend rows of a pet built from its full history, oldest point first"""
+    state = PetWeightTrend(pet_id=pet_id)
+    for field in STATE_FIELDS:
+        setattr(state, field, None)
+    for point in points:
+        state.prev_measured_on, state.prev_ewma_kg = (
+            state.last_measured_on,
+            state.ewma_kg,
+        )
+        state.ewma_kg = ewma_step(state.ewma_kg, state.last_measured_on, point)
+        state.last_measured_on = point.measured_on
+        state.last_weight_id = point.weight_id
+
+    windows = []
+    for window_days in TREND_WINDOWS:
+        window = WeightTrendWindow(pet_id=pet_id, window_days=window_days)
+        for field in SUM_FIELDS:
+            setattr(window, field, 0)
+        if points:
+            last = state.last_measured_on
+            shift(
+                window,
+                (p for p in points if in_window(p.measured_on, last, window_days)),
+                1,
+            )
+        windows.append(window)
+
+    state.sudden_loss = int(is_sudden_loss(state.ewma_kg, windows))
+    return state, windows
+
+
+def save_trend(db: Session, state: PetWeightTrend) -> None:
+    """Flush the pet's trend rows, conditional on the trend's version.
+
+    Call once the request's own rows are flushed, so that only the trend
+    can fail here. A first trend inserted concurrently by another
+    transaction is reported like a version conflict.
+    """
+    state.updated_at = datetime.utcnow()
+    try:
+        db.flush()
+    except IntegrityError as e:
+        raise StaleDataError(f"pet_weight_trends {state.pet_id} changed") from e
+
+
+def recompute_pet(db: Session, pet_id: int) -> None:
+    """Refold one pet's trend from its live weights.
+
+    Every trend column is rewritten; a pet without live weights loses
+    its trend rows.
+    """
+    db.flush()
+    state, windows = load_trend(db, pet_id)
+    points = live_points(db, pet_id)
+    if not points:
+        if state is not None:
+            for window in windows.values():
+                db.delete(window)
+            db.delete(state)
+            db.flush()
+        return
+
+    folded, folded_windows = fold(pet_id, points)
+    if state is None:
+        state = folded
+        db.add(state)
+    for field in STATE_FIELDS:
+        setattr(state, field, getattr(folded, field))
+    for window in folded_windows:
+        stored = windows.get(window.window_days)
+        if stored is None:
+            db.add(window)
+            continue
+        for field in SUM_FIELDS:
+            setattr(stored, field, getattr(window, field))
+    save_trend(db, state)
+
+
+def load_trend(
+    db: Session, pet_id: int
+) -> Tuple[Optional[PetWeightTrend], Dict[int, WeightTrendWindow]]:
+    """A pet's trend rows as of the transaction's snapshot"""
+    state = db.get(PetWeightTrend, pet_id)
+    windows = {
+        window.window_days: window
+        for window in db.query(WeightTrendWindow).filter(
+            WeightTrendWindow.pet_id == pet_id
+        )
+    }
+    return state, windows
+
+
+def slide(
+    windows: Dict[int, WeightTrendWindow],
+    points: List[Point],
+    old_last: date,
+    new_last: date,
+    sign: int,
+) -> None:
+    """Move each window's end from old_last to new_last.
+
+    sign=-1 drops the points that fall out when the end moves forward;
+    sign=1 takes them back in when it moves back.
+    """
+    for window_days, window in windows.items():
+        shift(
+            window,
+            (
+                p
+                for p in points
+                if in_window(p.measured_on, old_last, window_days)
+                != in_window(p.measured_on, new_last, window_days)
+            ),
+            sign,
+        )
+
+
+def append_latest(
+    db: Session,
+    state: PetWeightTrend,
+    windows: Dict[int, WeightTrendWindow],
+    point: Point,
+) -> None:
+    """Make a new point the latest measurement"""
+    old_last = state.last_measured_on
+    if old_last is not None:
+        leaving = points_between(db, state.pet_id, old_last, point.measured_on)
+        leaving = [p for p in leaving if p.weight_id != point.weight_id]
+        slide(windows, leaving, old_last, point.measured_on, -1)
+    for window in windows.values():
+        shift(window, [point], 1)
+
+    state.prev_measured_on, state.prev_ewma_kg = old_last, state.ewma_kg
+    state.ewma_kg = ewma_step(state.ewma_kg, old_last, point)
+    state.last_measured_on, state.last_weight_id = point.measured_on, point.weight_id
+
+
+def replace_latest(
+    state: PetWeightTrend,
+    windows: Dict[int, WeightTrendWindow],
+    before: Point,
+    after: Point,
+) -> None:
+    """Swap the latest measurement's weight, keeping its date"""
+    for window in windows.values():
+        shift(window, [before], -1)
+        shift(window, [after], 1)
+    state.ewma_kg = ewma_step(state.prev_ewma_kg, state.prev_measured_on, after)
+
+
+def drop_latest(
+    db: Session,
+    state: PetWeightTrend,
+    windows: Dict[int, WeightTrendWindow],
+    point: Point,
+) -> bool:
+    """Undo the latest point after its deletion; False if a refold is needed"""
+    previous = latest_point(db, state.pet_id)
+    # Without a previous point the refold drops the trend rows
+    if previous is None or state.prev_measured_on != previous.measured_on:
+        return False
+    for window in windows.values():
+        shift(window, [point], -1)
+    returning = points_between(
+        db, state.pet_id, previous.measured_on, point.measured_on
+    )
+    slide(windows, returning, point.measured_on, previous.measured_on, 1)
+
+    state.ewma_kg = state.prev_ewma_kg
+    state.last_measured_on = previous.measured_on
+    state.last_weight_id = previous.weight_id
+    # Only one step back is kept; deleting the next latest point refolds
+    state.prev_measured_on = state.prev_ewma_kg = None
+    return True
+
+
+def applied_in_place(
+    db: Session,
+    state: Optional[PetWeightTrend],
+    windows: Dict[int, WeightTrendWindow],
+    before: Optional[Point],
+    after: Optional[Point],
+) -> bool:
+    """Apply a change to the latest measurement in O(1) if it is one"""
+    if state is None or sorted(windows) != sorted(TREND_WINDOWS):
+        return False
+    if before is None:
+        latest = (state.last_measured_on, state.last_weight_id)
+        if state.last_weight_id is not None and (
+            (after.measured_on, after.weight_id) < latest
+        ):
+            return False
+        append_latest(db, state, windows, after)
+        return True
+    if before.weight_id != state.last_weight_id:
+        return False
+    if after is None:
+        return drop_latest(db, state, windows, before)
+    # Without the previous EWMA (first point, or right after drop_latest)
+    # the new value cannot be re-derived in place
+    if after.measured_on != before.measured_on or state.prev_ewma_kg is None:
+        return False
+    replace_latest(state, windows, before, after)
+    return True
+
+
+def apply_weight_change(
+    db: Session, pet_id: int, before: Optional[Point], after: Optional[Point]
+) -> None:
+    """Update a pet's trend after one weight was created, changed or deleted.
+
+    before is None for a created weight and after is None for a deleted
+    one. Raises StaleDataError when the pet's trend changed since the
+    transaction's snapshot.
+    """
+    db.flush()
+    state, windows = load_trend(db, pet_id)
+    if not applied_in_place(db, state, windows, before, after):
+        recompute_pet(db, pet_id)
+        return
+    state.sudden_loss = int(is_sudden_loss(state.ewma_kg, windows.values()))
+    save_trend(db, state)
+
+
+def recompute_all(db: Session) -> int:
+    """Rebuild every pet's trend in one ordered pass over the weights.
+
+    Pets are read in keyset batches and each batch's weights in a single
+    query ordered by pet and date, folded pet by pet. The trend tables are
+    derived data, so their rows are replaced outright. Returns the number
+    of pets with weights.
+    """
+    db.query(WeightTrendWindow).delete(synchronize_session=False)
+    db.query(PetWeightTrend).delete(synchronize_session=False)
+
+    pets = 0
+    after_id = 0
+    while True:
+        pet_ids = db.scalars(
+            select(Pet.id)
+            .where(Pet.is_deleted == 0, Pet.id > after_id)
+            .order_by(Pet.id)
+            .limit(RECOMPUTE_BATCH_SIZE)
+        ).all()
+        if not pet_ids:
+            break
+        rows = (
+            db.query(
+                RecordWeight.pet_id,
+                RecordWeight.measured_on,
+                RecordWeight.id,
+                RecordWeight.weight_kg,
+            )
+            .filter(RecordWeight.pet_id.in_(pet_ids), RecordWeight.is_deleted == 0)
+            .order_by(RecordWeight.pet_id, RecordWeight.measured_on, RecordWeight.id)
+            .all()
+        )
+        for pet_id, group in groupby(rows, key=lambda row: row[0]):
+            points = [Point(on, id_, scaled(kg)) for _, on, id_, kg in group]
+            state, windows = fold(pet_id, points)
+            db.add_all([state] + windows)
+            pets += 1
+        db.flush()
+        db.expunge_all()
+        after_id = pet_ids[-1]
+
+    db.commit()
+    return pets
+
+
+def window_item(window) -> dict:
+    return {
+        "window_days": window.window_days,
+        "points": window.points,
+        "slope_kg_per_day": slope(window),
+    }
+
+
+def trend_item(db: Session, pet_id: int) -> Optional[dict]:
+    """A pet's stored trend, or None before its first weight"""
+    state = db.get(PetWeightTrend, pet_id)
+    if state is None or state.last_measured_on is None:
+        return None
+    windows = (
+        db.query(WeightTrendWindow)
+        .filter(WeightTrendWindow.pet_id == pet_id)
+        .order_by(WeightTrendWindow.window_days)
+        .all()
+    )
+    return {
+        "last_measured_on": state.last_measured_on,
+        "ewma_kg": round(state.ewma_kg, 2),
+        "sudden_loss": bool(state.sudden_loss),
+        "windows": [window_item(window) for window in windows],
+    }
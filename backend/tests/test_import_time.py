@@ -0,0 +1,17 @@
+import pytest
+
+from check_import_time import DEFAULT_BUDGET_MS, main_import_ms, profile_imports
+
+# Best of a few fresh interpreters: the first may still be writing .pyc
+# files, and a busy machine only ever makes a run slower
+RUNS = 3
+
+
+# Wall-clock, so left out of the default run (see pytest.ini)
+@pytest.mark.import_time
+def test_import_main_within_budget() -> None:
+    total_ms = min(main_import_ms(profile_imports()) for _ in range(RUNS))
+    assert total_ms <= DEFAULT_BUDGET_MS, (
+        f"import main took {total_ms} ms (budget {DEFAULT_BUDGET_MS} ms): "
+        "run `python check_import_time.py` to see the slowest modules"
+    )
@@ -0,0 +1,81 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import pytest
+from sqlalchemy import create_engine, insert
+from starlette.requests import Request
+
+import database
+from models import Pet
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    """A primary and one replica; nothing connects to them"""
+    primary = create_engine("sqlite://")
+    replica = create_engine("sqlite://")
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "replica_engines", [replica])
+    return primary, replica
+
+
+def request(method: str, headers: Optional[Dict[str, str]] = None) -> Request:
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": method, "headers": raw})
+
+
+def bind_of(method: str, headers: Optional[Dict[str, str]] = None):
+    sessions = database.get_db(request(method, headers))
+    db = next(sessions)
+    try:
+        return db.get_bind()
+    finally:
+        sessions.close()
+
+
+def write_response_headers(status: int = 200) -> List[tuple]:
+    """Headers ReadYourWritesMiddleware adds to a POST answered with status"""
+    sent = []
+
+    async def app(scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": status, "headers": []})
+
+    async def send(message) -> None:
+        sent.append(message)
+
+    middleware = database.ReadYourWritesMiddleware(app)
+    asyncio.run(middleware({"type": "http", "method": "POST"}, None, send))
+    return [(k.decode(), v.decode()) for k, v in sent[0]["headers"]]
+
+
+def test_get_reads_replica_and_writes_go_to_primary(engines) -> None:
+    primary, replica = engines
+    assert bind_of("GET") is replica
+    assert bind_of("POST") is primary
+
+    db = database.SessionLocal()
+    db.info["read_only"] = True
+    try:
+        assert db.get_bind(clause=insert(Pet)) is primary
+    finally:
+        db.close()
+
+
+def test_get_after_write_reads_primary(engines) -> None:
+    primary, replica = engines
+    headers = write_response_headers()
+    until = dict(headers)[database.READ_PRIMARY_HEADER.lower()]
+    cookie = dict(headers)["set-cookie"].split(";")[0]
+
+    assert bind_of("GET", {database.READ_PRIMARY_HEADER: until}) is primary
+    assert bind_of("GET", {"cookie": cookie}) is primary
+    assert bind_of("GET") is replica
+
+
+def test_expired_or_failed_write_reads_replica(engines) -> None:
+    _, replica = engines
+    assert database.READ_PRIMARY_HEADER.lower() not in dict(
+        write_response_headers(status=409)
+    )
+    expired = {database.READ_PRIMARY_HEADER: "1.000"}
+    assert bind_of("GET", expired) is replica
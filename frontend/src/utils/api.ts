@@ -1,4 +1,9 @@
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000/api';
+// Bearer token of the user (AUTH_BACKEND=token); unset with AUTH_BACKEND=dev
+const API_TOKEN: string | undefined = import.meta.env.VITE_API_TOKEN;
+// Returned after our writes; sent back so reads see them despite replica lag
+const READ_PRIMARY_HEADER = 'X-Read-Primary-Until';
+let readPrimaryUntil: string | null = null;
 
 interface FetchOptions extends RequestInit {
   headers?: Record<string, string>;
@@ -12,9 +17,12 @@ async function fetchAPI<T>(endpoint: string, options: FetchOptions = {}): Promis
       ...options,
       headers: {
         'Content-Type': 'application/json',
+        ...(API_TOKEN ? { Authorization: `Bearer ${API_TOKEN}` } : {}),
+        ...(readPrimaryUntil ? { [READ_PRIMARY_HEADER]: readPrimaryUntil } : {}),
         ...options.headers,
       },
     });
+    readPrimaryUntil = response.headers.get(READ_PRIMARY_HEADER) ?? readPrimaryUntil;
 
     if (response.status === 204) {
       return null;
@@ -41,6 +49,11 @@ export interface Pet {
   sex?: string;
   birth_date?: string;
   photo_url?: string;
+  photo_urls?: {
+    original: string;
+    thumb: string;
+    medium: string;
+  } | null;
   created_at?: string;
   updated_at?: string;
 }
@@ -145,8 +158,32 @@ export const healthCheck = (): Promise<HealthCheckResponse> => fetchAPI<HealthCh
 export const dbHealthCheck = (): Promise<HealthCheckResponse> => fetchAPI<HealthCheckResponse>('/db/health');
 
 // Pets
-export const getPets = (): Promise<ListResponse<Pet>> =>
-  fetchAPI<ListResponse<Pet>>('/pets');
+export interface PetPage {
+  items: Pet[];
+  total: number;
+  limit: number;
+  next_cursor: string | null;
+}
+
+export interface PetQuery {
+  species?: string;
+  sex?: string;
+  born_from?: string;
+  born_to?: string;
+  name_prefix?: string;
+  sort?: 'id' | '-id' | 'name' | '-name' | 'birth_date' | '-birth_date';
+  limit?: number;
+  cursor?: string;
+}
+
+export const getPets = (query: PetQuery = {}): Promise<PetPage> => {
+  const params = new URLSearchParams();
+  Object.entries(query).forEach(([key, value]) => {
+    if (value !== undefined) params.set(key, String(value));
+  });
+  const search = params.toString();
+  return fetchAPI<PetPage>(search ? `/pets?${search}` : '/pets');
+};
 
 export const getPet = (petId: number): Promise<ItemResponse<Pet>> =>
   fetchAPI<ItemResponse<Pet>>(`/pets/${petId}`);